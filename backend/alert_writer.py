@@ -0,0 +1,202 @@
+"""
+Background writer for the counsellor-facing wellbeing alert log.
+
+Requests only put a formatted line on a bounded in-memory queue. A single
+writer thread appends queued alerts in batches, fsyncs them, and rotates
+the file by size and age. When the queue is full the alert is dropped and
+counted rather than blocking a student's reply. The dropped count shows up
+in /api/health and the app log. close() drains the queue, so alerts still
+pending at shutdown are written.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class AlertWriter:
+    """Batched, rotating append-only writer fed from a bounded queue"""
+
+    def __init__(self, log_dir, filename='wellbeing_alerts.log', max_queue=10000,
+                 batch_size=200, flush_interval=0.5, fsync=True,
+                 max_bytes=10 * 1024 * 1024, rotate_interval=86400, backup_count=14):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, filename)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._file = None
+        self._opened_at = 0.0
+        self._pending = []
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self.last_error = None
+
+    def write(self, line):
+        """Queue one alert line; returns False if it had to be dropped"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            logger.error("Safety alert queue full, dropped alert (%s dropped so far): %s", dropped, line.rstrip())
+            return False
+
+    def start(self):
+        """Start the writer thread (also done lazily on the first write)"""
+        with self._lock:
+            if self._thread is not None or self._stop.is_set():
+                return
+            self._thread = threading.Thread(target=self._run, name='alert-writer', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=10.0):
+        """Stop the writer thread and write everything still queued"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if thread is None or not thread.is_alive():
+            # No thread left to race with, so drain whatever it didn't get to
+            self._drain()
+            self._close_file()
+        if self.dropped:
+            logger.warning("Safety alert writer closed with %s dropped alerts", self.dropped)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._pending.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            else:
+                self._collect()
+            if self._pending:
+                self._flush()
+        self._drain()
+        self._close_file()
+
+    def _collect(self):
+        """Top the pending batch up with whatever else is already queued"""
+        while len(self._pending) < self.batch_size:
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _drain(self):
+        while True:
+            self._collect()
+            if not self._pending or not self._flush():
+                return
+
+    def _flush(self):
+        """Append the pending batch; on failure keep it and retry on the next pass"""
+        try:
+            if self._file is None:
+                self._open()
+            if self._should_rotate():
+                self._rotate()
+            self._file.write(''.join(self._pending))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            self.last_error = str(e)
+            logger.error("Could not write safety alerts to %s: %s", self.path, e)
+            self._close_file()
+            # Back off so a full or read-only disk isn't retried in a tight loop
+            self._stop.wait(1.0)
+            return False
+
+        self.written += len(self._pending)
+        self.batches += 1
+        self._pending = []
+        return True
+
+    def _open(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._opened_at = self._started_at()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _started_at(self):
+        """When the existing file was started, so a restart doesn't reset its age for rotation.
+
+        That's the timestamp its first alert starts with, or failing that its
+        last modification; a new or empty file starts now.
+        """
+        try:
+            if not os.path.getsize(self.path):
+                return time.time()
+            with open(self.path, encoding='utf-8', errors='replace') as f:
+                first = f.readline()
+        except OSError:
+            return time.time()
+        try:
+            return datetime.fromisoformat(first.split(' | ', 1)[0].strip()).timestamp()
+        except ValueError:
+            return os.path.getmtime(self.path)
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _should_rotate(self):
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _rotate(self):
+        """Rename the current file with a timestamp suffix and prune old ones"""
+        self._close_file()
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            os.replace(self.path, f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+            self.rotations += 1
+            self._prune()
+        self._open()
+
+    def _prune(self):
+        if self.backup_count <= 0:
+            return
+        prefix = os.path.basename(self.path) + '.'
+        backups = sorted(name for name in os.listdir(self.log_dir) if name.startswith(prefix))
+        for name in backups[:-self.backup_count]:
+            try:
+                os.remove(os.path.join(self.log_dir, name))
+            except OSError as e:
+                logger.warning("Could not remove old safety alert log %s: %s", name, e)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'queued': self._queue.qsize() + len(self._pending),
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'last_error': self.last_error
+        }
@@ -1,63 +1,350 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import requests
 import json
+import hashlib
 from datetime import datetime
 import logging
+import atexit
 import os
+import signal
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from dotenv import load_dotenv
+from ollama_pool import OllamaNode, OllamaPool, parse_nodes
+from ollama_health import CircuitBreaker, StartupCheck
+from conversation_context import ConversationContextStore
+from conversation_store import ConversationStore
+from response_cache import ResponseCache
+from single_flight import SingleFlight, coalescing_key, coalescing_windows
+from reference_index import ReferenceIndexCache, estimate_tokens
+from chatbot_registry import ChatbotRegistry, chatbot_fields
+from history_window import RollingSummaries, select_history
+from personas import Persona, PrefixReuse, format_history
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from safety_scanner import SafetyScanner
+from alert_writer import AlertWriter
+from rate_limiter import RateLimited, RateLimiter, parse_limits
+from request_logging import RequestLogPipeline
+from shared_state import MetricsPublisher, other_workers_metrics, shared_object, state_shared
+from deadlines import (
+    DEADLINE_HEADER, AbandonedGenerations, Deadline, GenerationAbandoned, current_deadline,
+    deadline_scope, parse_timeout, set_deadline, time_left
+)
+from generation_budget import GenerationBudget, context_size
+from generation_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_CUSTOM, PRIORITY_HOLDEN, PRIORITY_WELLBEING,
+    PRIORITY_WELLBEING_CONCERN, GenerationScheduler, SchedulerBusy
+)
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
+# Routes and request hooks; create_app() builds the Flask app around them
+api = Blueprint('api', __name__)
 
-# Configure CORS with specific origins
+# CORS origins allowed by create_app()
 cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:8080,http://localhost:5173').split(',')
-CORS(app, origins=cors_origins)
 
-# Configure logging with environment variables
+# Configure logging with environment variables. Records are queued and
+# written by a background thread, as JSON lines tagged with the request ID
+# (LOG_FORMAT=text for the plain format); LOG_SAMPLE_RATE keeps only that
+# fraction of requests' INFO logs.
 log_level = os.getenv('LOG_LEVEL', 'INFO')
 log_file = os.getenv('LOG_FILE', 'wellbeing_app.log')
 
-logging.basicConfig(
+request_logs = RequestLogPipeline(
+    [logging.StreamHandler(sys.stdout), logging.FileHandler(log_file)],
     level=getattr(logging, log_level.upper()),
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(log_file)
-    ]
+    json_lines=os.getenv('LOG_FORMAT', 'json').lower() == 'json',
+    max_queue=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+    sample_rate=float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
 )
+request_logs.install()
+atexit.register(request_logs.stop)
 logger = logging.getLogger(__name__)
 
 # Ollama server configuration from environment
 OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
 MODEL_NAME = os.getenv('MODEL_NAME', 'llama3.2:3b')
+def keep_alive_setting(value):
+    """Ollama reads a bare number as seconds (negative: forever) but needs a unit in a string"""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+# How long Ollama keeps the model (and its KV cache) loaded after a request; -1 pins it
+OLLAMA_KEEP_ALIVE = keep_alive_setting(os.getenv('OLLAMA_KEEP_ALIVE', '30m'))
+# Preload the model on each node at startup and again whenever Ollama evicts it
+OLLAMA_WARM_UP = os.getenv('OLLAMA_WARM_UP', 'True').lower() == 'true'
+# Context size for every generation. Ollama reloads the model when num_ctx changes,
+# so it is one value rather than per persona or per request.
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', '4096'))
+
+# Ollama servers as 'url[|model|model...]', comma-separated; defaults to OLLAMA_URL alone
+OLLAMA_NODES = parse_nodes(os.getenv('OLLAMA_NODES') or OLLAMA_URL)
+
+# Every chat path shares one pool of Ollama nodes. Each node has a pooled
+# keep-alive connection, a cached up/down state and a breaker so outages
+# fail fast, and each generation goes to the least-loaded healthy node.
+# Under serve.py, each node's breaker is shared by all the worker processes
+# (see shared_state.py), as are the stores, limits and generation slots below.
+ollama = OllamaPool([
+    OllamaNode(
+        url,
+        models,
+        pool_size=int(os.getenv('OLLAMA_POOL_SIZE', '16')),
+        pool_block=os.getenv('OLLAMA_POOL_BLOCK', 'False').lower() == 'true',
+        connect_timeout=float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '2')),
+        health_interval=float(os.getenv('OLLAMA_HEALTH_INTERVAL', '5')),
+        warm_model=MODEL_NAME if OLLAMA_WARM_UP else None,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        warm_timeout=float(os.getenv('OLLAMA_WARM_TIMEOUT', '120')),
+        warm_options={'num_ctx': OLLAMA_NUM_CTX},
+        breaker=shared_object(
+            f'breaker {url}',
+            CircuitBreaker,
+            failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3')),
+            reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+        )
+    )
+    for url, models in OLLAMA_NODES
+])
+
+# Per-conversation Ollama context so each turn only prompt-evaluates the new message
+CONTEXT_REUSE_ENABLED = os.getenv('CONTEXT_REUSE_ENABLED', 'True').lower() == 'true'
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', '1536'))
+conversation_contexts = shared_object(
+    'conversation_contexts',
+    ConversationContextStore,
+    max_conversations=int(os.getenv('CONTEXT_MAX_CONVERSATIONS', '500')),
+    max_tokens=CONTEXT_MAX_TOKENS,
+    idle_timeout=float(os.getenv('CONTEXT_IDLE_TIMEOUT', '900'))
+)
+
+# Session mode: the backend keeps each conversation so clients that send a
+# session_id only need to send the new message
+CONVERSATION_STORE_ENABLED = os.getenv('CONVERSATION_STORE_ENABLED', 'True').lower() == 'true'
+conversation_store = shared_object(
+    'conversation_store',
+    ConversationStore,
+    max_bytes=int(os.getenv('CONVERSATION_STORE_MAX_BYTES', str(64 * 1024 * 1024))),
+    max_conversations=int(os.getenv('CONVERSATION_STORE_MAX_CONVERSATIONS', '20000')),
+    max_messages=int(os.getenv('CONVERSATION_STORE_MAX_MESSAGES', '200')),
+    idle_timeout=float(os.getenv('CONVERSATION_STORE_IDLE_TIMEOUT', '3600'))
+)
+
+# Opt-in cache of replies to opening questions, shared across students.
+# Wellbeing is left out unless explicitly listed.
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'False').lower() == 'true'
+RESPONSE_CACHE_PERSONAS = set(os.getenv('RESPONSE_CACHE_PERSONAS', 'holden,custom').split(','))
+response_cache = shared_object(
+    'response_cache',
+    ResponseCache,
+    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2000')),
+    max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(8 * 1024 * 1024))),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+    similarity=float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.9'))
+)
+
+# Identical requests (same persona, message and history) that arrive while
+# a generation for them is in flight share it. Listed as 'persona[:window
+# seconds]'; wellbeing is left out unless explicitly listed.
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW', '2'))
+COALESCE_PERSONAS = coalescing_windows(os.getenv('COALESCE_PERSONAS', 'holden,custom'), COALESCE_WINDOW)
+in_flight = SingleFlight(COALESCE_PERSONAS)
+
+# Recent history is kept up to a per-persona token budget instead of a fixed
+# number of messages; older messages are folded into a rolling summary
+HISTORY_TOKEN_BUDGETS = {
+    'wellbeing': int(os.getenv('WELLBEING_HISTORY_TOKENS', '600')),
+    'holden': int(os.getenv('HOLDEN_HISTORY_TOKENS', '600')),
+    'custom': int(os.getenv('CUSTOM_HISTORY_TOKENS', '900'))
+}
+HISTORY_SUMMARIES_ENABLED = os.getenv('HISTORY_SUMMARIES_ENABLED', 'True').lower() == 'true'
+
+# Custom chatbot reference materials longer than the token budget are
+# indexed once and only the chunks relevant to each turn are sent
+REFERENCE_TOP_K = int(os.getenv('REFERENCE_TOP_K', '4'))
+REFERENCE_TOKEN_BUDGET = int(os.getenv('REFERENCE_TOKEN_BUDGET', '600'))
+reference_indexes = ReferenceIndexCache(
+    max_indexes=int(os.getenv('REFERENCE_MAX_INDEXES', '64')),
+    chunk_words=int(os.getenv('REFERENCE_CHUNK_WORDS', '120'))
+)
+
+# Bounded, priority-ordered admission in front of every Ollama generation
+GENERATION_MAX_CONCURRENT = int(os.getenv('GENERATION_MAX_CONCURRENT', '2'))
+GENERATION_QUEUE_SIZE = int(os.getenv('GENERATION_QUEUE_SIZE', '64'))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv('GENERATION_QUEUE_TIMEOUT', '20'))
+# Order queued generations fair-share by student, not first come first served
+GENERATION_FAIR_SHARE = os.getenv('GENERATION_FAIR_SHARE', 'True').lower() == 'true'
+generation_scheduler = shared_object(
+    'generation_scheduler',
+    GenerationScheduler,
+    max_concurrent=GENERATION_MAX_CONCURRENT,
+    max_queue=GENERATION_QUEUE_SIZE,
+    max_wait=GENERATION_QUEUE_TIMEOUT
+)
+
+# Reply budgets: each chat generation's num_predict is chosen from the queue depth and
+# generation speed so GENERATION_LATENCY_TARGET seconds holds for 95% of requests.
+# Listed personas only; wellbeing replies are only trimmed if listed.
+GENERATION_BUDGET_ENABLED = os.getenv('GENERATION_BUDGET_ENABLED', 'True').lower() == 'true'
+generation_budget = GenerationBudget(
+    target_p95=float(os.getenv('GENERATION_LATENCY_TARGET', '15')),
+    slots=GENERATION_MAX_CONCURRENT,
+    min_tokens=int(os.getenv('GENERATION_MIN_REPLY_TOKENS', '96')),
+    kinds=set(os.getenv('GENERATION_BUDGET_PERSONAS', 'holden,custom').split(','))
+)
+
+# End-to-end deadlines: a chat request waits at most its X-Request-Timeout header's
+# seconds (capped at REQUEST_TIMEOUT_MAX), or REQUEST_TIMEOUT without one. Queue waits
+# and Ollama timeouts are cut to fit, and a generation is abandoned once the deadline
+# passes or the student disconnects.
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '120'))
+REQUEST_TIMEOUT_MAX = float(os.getenv('REQUEST_TIMEOUT_MAX', '300'))
+# Longest wait for Ollama to start or continue a reply
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', '30'))
+# WSGI servers that expose the client's socket, so a generation can notice the student leaving
+CLIENT_SOCKET_KEYS = ('werkzeug.socket', 'gunicorn.socket')
+abandoned_generations = AbandonedGenerations()
+
+# Teachers' batch evaluations of a custom chatbot: messages per batch, and how many
+# of a batch's generations may queue at once so one batch can't fill the queue
+BATCH_MAX_MESSAGES = int(os.getenv('BATCH_MAX_MESSAGES', '50'))
+BATCH_PARALLELISM = int(os.getenv('BATCH_PARALLELISM', str(GENERATION_MAX_CONCURRENT)))
+
+# Token-bucket limits per student and per client IP, as 'endpoint:requests/seconds'
+# ('*' covers unlisted endpoints). The IP limit is shared by a class behind one address.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+# Behind a reverse proxy, take the client IP from X-Forwarded-For
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv('RATE_LIMIT_TRUST_FORWARDED_FOR', 'False').lower() == 'true'
+rate_limiter = shared_object(
+    'rate_limiter',
+    RateLimiter,
+    parse_limits(os.getenv('STUDENT_RATE_LIMITS', 'holden:10/60,wellbeing:20/60,custom:10/60,evaluate:5/600')),
+    parse_limits(os.getenv('IP_RATE_LIMITS', '*:600/60,evaluate:20/600')),
+    max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+)
+
+# Request, safety and Ollama timing metrics served at /api/metrics
+metrics = MetricsRegistry(prefix='schoolmate_')
+http_requests = metrics.counter('http_requests_total', 'Chat API requests by route, method and status', ('endpoint', 'method', 'status'))
+http_latency = metrics.histogram('http_request_duration_seconds', 'Time from request to the end of the response, including streams', ('endpoint',))
+safety_levels = metrics.counter('safety_checks_total', 'Wellbeing messages by safety level', ('level',))
+rate_limited_requests = metrics.counter('rate_limited_requests_total', 'Chat requests turned away by a rate limit', ('endpoint', 'scope'))
+coalesced_requests = metrics.counter('coalesced_requests_total', 'Chat requests that shared an identical in-flight generation', ('persona',))
+abandoned_generation_count = metrics.counter('abandoned_generations_total', 'Generations stopped because the deadline passed or the student disconnected', ('persona', 'reason'))
+skipped_generation_count = metrics.counter('skipped_generations_total', 'Generations not started because the deadline had passed or the student had disconnected', ('persona', 'reason'))
+abandoned_generation_seconds = metrics.counter('abandoned_generation_seconds_total', 'Ollama time spent on generations that were then abandoned', ('persona', 'reason'))
+reply_budget_tokens = metrics.histogram('reply_budget_tokens', 'num_predict chosen for each budgeted chat generation', ('persona',),
+                                        buckets=(32, 64, 96, 128, 192, 256, 384, 512, 768, 1024))
+replies_cut_short = metrics.counter('replies_cut_short_total', 'Replies that reached their num_predict before the model finished', ('persona',))
+ollama_errors = metrics.counter('ollama_errors_total', 'Failed Ollama generations by kind', ('kind',))
+ollama_prompt_tokens = metrics.counter('ollama_prompt_eval_tokens_total', 'Prompt tokens evaluated by Ollama', ('persona',))
+ollama_full_prompt_tokens = metrics.counter('ollama_full_prompt_tokens_total', 'Tokens of full prompts sent to Ollama (not continuing a kept context)', ('persona',))
+ollama_reused_tokens = metrics.counter('ollama_reused_prompt_tokens_total', 'Full-prompt tokens Ollama reused from its prompt cache instead of evaluating', ('persona',))
+ollama_eval_tokens = metrics.counter('ollama_eval_tokens_total', 'Tokens generated by Ollama', ('persona',))
+ollama_seconds = metrics.counter('ollama_duration_seconds_total', 'Ollama time by phase (load, prompt_eval, eval, total)', ('persona', 'phase'))
+ollama_prompt_eval = metrics.histogram('ollama_prompt_eval_seconds', 'Prompt evaluation time per generation', ('persona',),
+                                       buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+ollama_tokens_per_second = metrics.histogram('ollama_eval_tokens_per_second', 'Generation speed per reply', ('persona',),
+                                             buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200))
+
+# How much of each persona's full prompts Ollama reuses from its prompt cache, reported at /api/health
+prefix_reuse = PrefixReuse()
+
+def observe_generation(persona, response_json, continued=False):
+    """Record the timing breakdown Ollama returns with a finished generation.
+    
+    `continued` generations sent only the new turn with a kept context, so
+    they say nothing about how well the persona's prompt prefix is cached.
+    """
+    # Custom chatbots are reported together rather than one series per chatbot
+    kind = persona.kind
+    if not continued:
+        measured = prefix_reuse.record(kind, response_json)
+        if measured:
+            ollama_full_prompt_tokens.inc(kind, amount=measured[0])
+            ollama_reused_tokens.inc(kind, amount=measured[1])
+    prompt_eval = response_json.get('prompt_eval_duration', 0) / 1e9
+    eval_seconds = response_json.get('eval_duration', 0) / 1e9
+    eval_count = response_json.get('eval_count', 0)
+    ollama_prompt_tokens.inc(kind, amount=response_json.get('prompt_eval_count', 0))
+    ollama_eval_tokens.inc(kind, amount=eval_count)
+    ollama_seconds.inc(kind, 'load', amount=response_json.get('load_duration', 0) / 1e9)
+    ollama_seconds.inc(kind, 'prompt_eval', amount=prompt_eval)
+    ollama_seconds.inc(kind, 'eval', amount=eval_seconds)
+    ollama_seconds.inc(kind, 'total', amount=response_json.get('total_duration', 0) / 1e9)
+    ollama_prompt_eval.observe(prompt_eval, kind)
+    if eval_seconds > 0:
+        ollama_tokens_per_second.observe(eval_count / eval_seconds, kind)
+    if response_json.get('done_reason') == 'length':
+        replies_cut_short.inc(kind)
+    generation_budget.observe(kind, response_json)
+    # A budgeted chat request's latency so far, which its reply has just ended
+    deadline = current_deadline()
+    if GENERATION_BUDGET_ENABLED and deadline is not None and generation_budget.applies(kind):
+        generation_budget.observe_latency(deadline.elapsed())
 
 # Crisis detection keywords
 CRISIS_KEYWORDS = [
     'suicide', 'kill myself', 'want to die', 'end my life', 
-    'self harm', 'cutting', 'nobody would care if',
+    'self harm', 'harm myself', 'hurt myself', 'cutting', 'nobody would care if',
     'better off without me', 'end it all', 'no point living',
-    'overdose', 'jump off', 'hang myself', 'shoot myself'
+    'overdose', 'overdosed', 'overdoses', 'suicides',
+    'jump off', 'hang myself', 'shoot myself'
 ]
 
 CONCERN_KEYWORDS = [
     'depressed', 'anxiety', 'panic attack', 'can\'t cope',
-    'worthless', 'hopeless', 'nobody likes me', 'bullied',
-    'scared', 'alone', 'hate myself', 'stupid', 'failure',
-    'cant sleep', 'cant eat', 'throwing up', 'hurting'
+    'panic attacks', 'worthless', 'worthlessness', 'hopeless', 'hopelessness',
+    'nobody likes me', 'bullied', 'scared', 'alone', 'hate myself', 'stupid',
+    'failure', 'failures', 'cant sleep', 'cant eat', 'throwing up', 'hurting'
 ]
 
+# Counselor alert log, read once at startup and written by a background thread
+ENABLE_SAFETY_LOGGING = os.getenv('ENABLE_SAFETY_LOGGING', 'True').lower() == 'true'
+SAFETY_LOG_DIR = os.getenv('SAFETY_LOG_DIR', 'wellbeing_logs')
+# Under serve.py the workers share one writer, so only one process appends and rotates the file
+alert_writer = shared_object(
+    'alert_writer',
+    AlertWriter,
+    SAFETY_LOG_DIR,
+    max_queue=int(os.getenv('SAFETY_LOG_QUEUE_SIZE', '10000')),
+    batch_size=int(os.getenv('SAFETY_LOG_BATCH_SIZE', '200')),
+    flush_interval=float(os.getenv('SAFETY_LOG_FLUSH_INTERVAL', '0.5')),
+    fsync=os.getenv('SAFETY_LOG_FSYNC', 'True').lower() == 'true',
+    max_bytes=int(os.getenv('SAFETY_LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+    rotate_interval=float(os.getenv('SAFETY_LOG_ROTATE_INTERVAL', '86400')),
+    backup_count=int(os.getenv('SAFETY_LOG_BACKUP_COUNT', '14'))
+)
+# Write out any queued alerts on shutdown (a shared writer is closed by serve.py)
+if not state_shared():
+    atexit.register(alert_writer.close)
+
+# All safety phrases compiled once into a single matcher. Counsellors can
+# edit the keyword file; the lists above are used if it is missing.
+safety_scanner = SafetyScanner(
+    {'CRISIS': CRISIS_KEYWORDS, 'CONCERN': CONCERN_KEYWORDS},
+    path=os.getenv('SAFETY_KEYWORDS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'safety_keywords.json')),
+    reload_interval=float(os.getenv('SAFETY_KEYWORDS_RELOAD_INTERVAL', '30'))
+)
+
 def check_message_safety(message):
     """Check message for crisis or concern keywords"""
-    message_lower = message.lower()
+    level, matched = safety_scanner.classify(message)
+    safety_levels.inc(level)
     
     # Check for crisis keywords
-    if any(keyword in message_lower for keyword in CRISIS_KEYWORDS):
+    if level == 'CRISIS':
         return {
             'level': 'CRISIS',
+            'matched': matched,
             'response': """I'm really concerned about what you're sharing. Your life has value and there are people who want to help.
 
 Please reach out RIGHT NOW to:
@@ -74,9 +361,10 @@ You don't have to go through this alone. Please talk to someone today. Would you
         }
     
     # Check for concern keywords
-    elif any(keyword in message_lower for keyword in CONCERN_KEYWORDS):
+    elif level == 'CONCERN':
         return {
             'level': 'CONCERN',
+            'matched': matched,
             'add_to_response': "\n\nI notice you're going through a difficult time. Remember, it's always okay to talk to your school counselor or a trusted adult about these feelings. They can provide additional support that goes beyond what I can offer here."
         }
     
@@ -84,50 +372,75 @@ You don't have to go through this alone. Please talk to someone today. Would you
 
 def log_if_concerning(student_id, message, response, safety_level):
     """Log concerning conversations for counselor review"""
-    # Check if safety logging is enabled
-    enable_safety_logging = os.getenv('ENABLE_SAFETY_LOGGING', 'True').lower() == 'true'
-    if not enable_safety_logging:
+    if not ENABLE_SAFETY_LOGGING:
         return
         
     if safety_level in ['CRISIS', 'CONCERN']:
-        log_dir = os.getenv('SAFETY_LOG_DIR', 'wellbeing_logs')
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        
-        log_file = os.path.join(log_dir, 'wellbeing_alerts.log')
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(f"{datetime.now().isoformat()} | Student: {student_id} | Level: {safety_level} | Message: {message[:100]}...\n")
+        # Queued for the background writer so the reply isn't held up by disk I/O
+        alert_writer.write(f"{datetime.now().isoformat()} | Student: {student_id} | Level: {safety_level} | Message: {message[:100]}...\n")
         
-        logger.warning(f"Concerning message logged - Student: {student_id}, Level: {safety_level}")
+        logger.warning("Concerning message logged - Student: %s, Level: %s", student_id, safety_level)
 
 def test_ollama_connection():
-    """Test if Ollama is running and accessible"""
-    try:
-        response = requests.get(f"{OLLAMA_URL}", timeout=2)
-        if response.status_code == 200 and "Ollama is running" in response.text:
-            logger.info("Ollama is running")
-            return True
-        else:
-            logger.error(f"Ollama returned unexpected response: {response.status_code}")
-            return False
-    except requests.exceptions.ConnectionError:
-        logger.error(f"Cannot connect to Ollama at {OLLAMA_URL}")
+    """Test if Ollama is running and accessible on at least one node"""
+    running = False
+    for node in ollama.nodes:
+        try:
+            response = node.client.get(timeout=2)
+            if response.status_code == 200 and "Ollama is running" in response.text:
+                logger.info("Ollama is running at %s", node.base_url)
+                running = True
+            else:
+                logger.error("Ollama at %s returned unexpected response: %s", node.base_url, response.status_code)
+        except requests.exceptions.ConnectionError:
+            logger.error("Cannot connect to Ollama at %s", node.base_url)
+        except Exception as e:
+            logger.error("Error checking Ollama at %s: %s", node.base_url, e)
+    if not running:
         logger.error("Make sure Ollama is running: ollama serve")
-        return False
-    except Exception as e:
-        logger.error(f"Error checking Ollama: {str(e)}")
-        return False
+    return running
+
+def ollama_available():
+    """Cheap pre-flight check: is any node healthy, not ejected and serving the model?"""
+    return ollama.available(MODEL_NAME)
+
+def record_generation_status(status_code):
+    """Count a generation's HTTP error status (nodes track their own breaker state)"""
+    if status_code != 200:
+        ollama_errors.inc('api_error')
+
+def record_generation_error(error, connection_lost=False, timed_out=False):
+    """Count a failed generation (nodes track their own health and breaker state)"""
+    ollama_errors.inc('timeout' if timed_out else 'connection' if connection_lost else 'error')
+
+def ollama_read_timeout(deadline):
+    """OLLAMA_TIMEOUT, or the time left before the request's deadline if that is sooner"""
+    return OLLAMA_TIMEOUT if deadline is None else deadline.cap(OLLAMA_TIMEOUT)
+
+def record_abandoned(persona, reason, started):
+    """Count a generation stopped because nobody is waiting for its reply any more"""
+    seconds = time.perf_counter() - started
+    abandoned_generations.record(persona.kind, reason, seconds)
+    abandoned_generation_count.inc(persona.kind, reason)
+    abandoned_generation_seconds.inc(persona.kind, reason, amount=seconds)
+    logger.info("Abandoned %s generation after %.2fs (%s)", persona.label, seconds, reason)
+
+def record_skipped(persona, reason):
+    """Count a generation not started because nobody is waiting for its reply any more"""
+    abandoned_generations.skip(persona.kind, reason)
+    skipped_generation_count.inc(persona.kind, reason)
+    logger.info("Skipped %s generation (%s)", persona.label, reason)
 
 def test_model_availability():
-    """Test if the model is available"""
+    """Test the model with a short generation; returns its reply, or None if it failed"""
     try:
-        logger.info(f"Testing model {MODEL_NAME}...")
-        response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
+        logger.info("Testing model %s...", MODEL_NAME)
+        response = ollama.generate(
+            {
                 "model": MODEL_NAME,
-                "prompt": "Say 'Hello, I'm working!'",
-                "stream": False
+                "prompt": "Say 'Hello, I'm working!' in a friendly way.",
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE
             },
             timeout=10
         )
@@ -135,31 +448,27 @@ def test_model_availability():
         if response.status_code == 200:
             result = response.json().get('response', '')
             if result:
-                logger.info(f"Model {MODEL_NAME} is working")
-                logger.debug(f"Test response: {result[:50]}...")
-                return True
+                logger.info("Model %s is working", MODEL_NAME)
+                logger.debug("Test response: %.50s...", result)
+                return result
             else:
-                logger.error(f"Model {MODEL_NAME} returned empty response")
-                return False
+                logger.error("Model %s returned empty response", MODEL_NAME)
+                return None
         else:
-            logger.error(f"Model {MODEL_NAME} error: Status {response.status_code}")
+            logger.error("Model %s error: Status %s", MODEL_NAME, response.status_code)
             error_text = response.text
             if "model" in error_text.lower() and "not found" in error_text.lower():
-                logger.error(f"Model {MODEL_NAME} is not installed. Run: ollama pull {MODEL_NAME}")
-            return False
+                logger.error("Model %s is not installed. Run: ollama pull %s", MODEL_NAME, MODEL_NAME)
+            return None
             
     except requests.exceptions.Timeout:
-        logger.error(f"Model {MODEL_NAME} timeout - model may be loading")
-        return False
+        logger.error("Model %s timeout - model may be loading", MODEL_NAME)
+        return None
     except Exception as e:
-        logger.error(f"Error testing model: {str(e)}")
-        return False
+        logger.error("Error testing model: %s", e)
+        return None
 
-def get_ollama_response(message, conversation_history=None):
-    """Get response from Ollama model - no templates, pure AI"""
-    
-    # Build a simple, supportive prompt
-    system_prompt = """You are a caring and supportive friend providing wellbeing support to students.
+WELLBEING_SYSTEM_PROMPT = """You are a caring and supportive friend providing wellbeing support to students.
 
 Be warm, empathetic, and understanding. Listen to what they're saying and respond naturally. Ask gentle questions to help them talk through their feelings, but keep your responses conversational and supportive.
 
@@ -171,74 +480,26 @@ Focus on:
 - Responding naturally like a caring friend would
 
 Keep your responses genuine and conversational. Don't analyze your own responses or explain your approach."""
-    
-    try:
-        # First check if Ollama is running
-        if not test_ollama_connection():
-            return "I'm having trouble connecting to my system right now. Please make sure the support service is running, or talk to your school counselor for immediate help."
-        
-        # Build the conversation context
-        full_prompt = f"{system_prompt}\n\n"
-        
-        # Add conversation history if available
-        if conversation_history:
-            for msg in conversation_history[-4:]:  # Last 4 messages for context
-                role = "Student" if msg.get("role") == "user" else "Assistant"
-                full_prompt += f"{role}: {msg.get('content', '')}\n"
-        
-        full_prompt += f"Student: {message}\nAssistant:"
-        
-        logger.debug(f"Sending request to Ollama with model {MODEL_NAME}")
-        
-        # Call Ollama API
-        response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": MODEL_NAME,
-                "prompt": full_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.8,
-                    "top_p": 0.9,
-                    "max_tokens": 500
-                }
-            },
-            timeout=30
-        )
-        
-        logger.debug(f"Ollama response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            response_json = response.json()
-            ai_response = response_json.get('response', '')
-            
-            if ai_response:
-                logger.info("Successfully got AI response")
-                return ai_response.strip()
-            else:
-                logger.error("Empty response from Ollama")
-                return "I'm here to listen. Can you tell me more about how you're feeling?"
-        else:
-            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-            return "I'm having some technical issues, but I'm still here for you. Please continue sharing, or consider talking to your school counselor."
-            
-    except requests.exceptions.Timeout:
-        logger.error("Ollama request timed out")
-        return "The response is taking longer than expected. Please try again, and remember you can always talk to your school counselor for immediate support."
-        
-    except requests.exceptions.ConnectionError:
-        logger.error("Could not connect to Ollama server")
-        return "I can't connect to my support system right now. Please make sure the service is running (ollama serve), or talk to a trusted adult for help."
-    
-    except Exception as e:
-        logger.error(f"Unexpected error getting Ollama response: {str(e)}")
-        return "I'm experiencing technical difficulties, but your feelings are important. Please talk to your school counselor or a trusted adult for support."
 
-def get_holden_response(message, conversation_history=None):
-    """Get response from Ollama model as Holden Caulfield"""
-    
-    # Build the prompt for Holden Caulfield
-    system_prompt = """You are Holden Caulfield from "The Catcher in the Rye." You're helping a student write an essay about the book, but you're not going to write it for them - that would be phony, and you hate phonies.
+WELLBEING_OPTIONS = {
+    "temperature": 0.8,
+    "top_p": 0.9,
+    # Longest reply in tokens (Ollama ignores max_tokens); budgeted personas get less under load
+    "num_predict": 500
+}
+
+WELLBEING_FALLBACKS = {
+    'unavailable': "I'm having trouble connecting to my system right now. Please make sure the support service is running, or talk to your school counselor for immediate help.",
+    'empty': "I'm here to listen. Can you tell me more about how you're feeling?",
+    'api_error': "I'm having some technical issues, but I'm still here for you. Please continue sharing, or consider talking to your school counselor.",
+    'timeout': "The response is taking longer than expected. Please try again, and remember you can always talk to your school counselor for immediate support.",
+    'connection': "I can't connect to my support system right now. Please make sure the service is running (ollama serve), or talk to a trusted adult for help.",
+    'error': "I'm experiencing technical difficulties, but your feelings are important. Please talk to your school counselor or a trusted adult for support.",
+    'busy': "A lot of students are chatting with me right now, so please try again in a few seconds. If you need to talk to someone straight away, your school counselor or Kids Helpline (1800 55 1800) are there for you.",
+    'rate_limited': "You've sent me a lot of messages in a short time, so let's take a short pause before the next one. If you need to talk to someone straight away, your school counselor or Kids Helpline (1800 55 1800) are there for you."
+}
+
+HOLDEN_SYSTEM_PROMPT = """You are Holden Caulfield from "The Catcher in the Rye." You're helping a student write an essay about the book, but you're not going to write it for them - that would be phony, and you hate phonies.
 
 Your personality:
 - Speak in your distinctive voice with your unique expressions ("goddam," "old," "if you want to know the truth," etc.)
@@ -264,93 +525,93 @@ Essay guidance approach:
 - "That's not the point - dig deeper. What's really going on there?"
 
 Remember: You're still a teenager who struggles with his own problems. Sometimes you might get distracted or go on tangents about things that bug you. But you genuinely want to help students understand the story - just not by doing their work for them."""
+
+HOLDEN_OPTIONS = {
+    "temperature": 0.9,
+    "top_p": 0.95,
+    "num_predict": 600
+}
+
+HOLDEN_FALLBACKS = {
+    'unavailable': "Goddam it, I can't connect to the service. Tell whoever's running this thing to fix it. It really kills me when stuff doesn't work.",
+    'empty': "If you want to know the truth, I'm having trouble thinking right now. Ask me something else about the book.",
+    'api_error': "The stupid computer's acting up again. I hate all this phony technical stuff. Try asking me again.",
+    'timeout': "Hold on a second, I'm thinking... Actually, this is taking too long. Ask me something else.",
+    'connection': "I can't connect to the goddam server. Make sure it's running (ollama serve), or just ask me in person or something.",
+    'error': "Something's wrong with this phony computer system. But look, just ask me about what you really want to know about the book.",
+    'busy': "Boy, everybody and their brother is asking me stuff right now. Give me a second and ask me again.",
+    'rate_limited': "Hold your horses. You're asking me about a million questions a minute. Take a breather and think about what you really want to know."
+}
+
+CUSTOM_STYLE_PROMPTS = {
+    'friendly': 'You are friendly, warm, and encouraging. Use a supportive tone and show enthusiasm for learning.',
+    'professional': 'You are professional and informative. Provide clear, structured responses with appropriate formality.',
+    'casual': 'You are relaxed and conversational. Use casual language and be approachable and easy-going.',
+    'academic': 'You are scholarly and thorough. Provide detailed explanations with academic rigor and precision.',
+    'encouraging': 'You are motivational and inspiring. Focus on building confidence and celebrating progress.'
+}
+
+CUSTOM_STYLE_ERRORS = {
+    'friendly': "I'm having trouble connecting to my learning service right now. Give me a moment and try again!",
+    'professional': "I am currently experiencing connectivity issues. Please retry your request momentarily.",
+    'casual': "Oops! Connection's acting up. Try again in a sec?",
+    'academic': "I regret to inform you of current technical difficulties. Please attempt your inquiry again shortly.",
+    'encouraging': "Don't worry! Even the best tutors have technical hiccups. Let's try again in just a moment!"
+}
+
+CUSTOM_OPTIONS = {
+    "temperature": 0.8,
+    "top_p": 0.9,
+    "num_predict": 600
+}
+
+CUSTOM_FALLBACKS = {
+    'empty': "I'm thinking about your question. Could you try asking it in a different way?",
+    'api_error': "I'm having some technical difficulties right now. Please try asking your question again.",
+    'timeout': "I'm taking a bit longer to think about this. Please try asking again.",
+    'connection': "I can't connect to my knowledge service right now. Please make sure the service is running or try again later.",
+    'error': "I encountered an unexpected issue. Please try asking your question again.",
+    'busy': "I'm helping a lot of students right now. Please try asking again in a few seconds.",
+    'rate_limited': "You've asked a lot of questions in a short time. Please take a moment before asking the next one."
+}
+
+# The built-in personas; custom chatbots are compiled into their own with compile_chatbot
+WELLBEING = Persona('wellbeing', WELLBEING_SYSTEM_PROMPT, WELLBEING_OPTIONS, WELLBEING_FALLBACKS,
+                    label="Assistant", history_tokens=HISTORY_TOKEN_BUDGETS['wellbeing'])
+HOLDEN = Persona('holden', HOLDEN_SYSTEM_PROMPT, HOLDEN_OPTIONS, HOLDEN_FALLBACKS,
+                 label="Holden", history_tokens=HISTORY_TOKEN_BUDGETS['holden'])
+
+def reference_fits_prompt(chatbot_config):
+    """Whether a chatbot's reference materials are short enough to send in full every turn"""
+    materials = chatbot_config.get('referenceMaterials')
+    return bool(materials) and estimate_tokens(materials) <= REFERENCE_TOKEN_BUDGET
+
+def reference_excerpts(chatbot_config, message, conversation_history=None):
+    """Chunks of long reference materials relevant to this turn, or None"""
+    materials = chatbot_config.get('referenceMaterials')
+    if not materials or reference_fits_prompt(chatbot_config):
+        return None
     
-    try:
-        # First check if Ollama is running
-        if not test_ollama_connection():
-            return "Goddam it, I can't connect to the service. Tell whoever's running this thing to fix it. It really kills me when stuff doesn't work."
-        
-        # Build the conversation context
-        full_prompt = f"{system_prompt}\n\n"
-        
-        # Add conversation history if available
-        if conversation_history:
-            for msg in conversation_history[-4:]:  # Last 4 messages for context
-                role = "Student" if msg.get("role") == "user" else "Holden"
-                full_prompt += f"{role}: {msg.get('content', '')}\n"
-        
-        full_prompt += f"Student: {message}\nHolden:"
-        
-        logger.debug(f"Sending request to Ollama with model {MODEL_NAME} as Holden")
-        
-        # Call Ollama API
-        response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": MODEL_NAME,
-                "prompt": full_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.9,
-                    "top_p": 0.95,
-                    "max_tokens": 600
-                }
-            },
-            timeout=30
-        )
-        
-        logger.debug(f"Ollama response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            response_json = response.json()
-            ai_response = response_json.get('response', '')
-            
-            if ai_response:
-                logger.info("Successfully got Holden response")
-                return ai_response.strip()
-            else:
-                logger.error("Empty response from Ollama")
-                return "If you want to know the truth, I'm having trouble thinking right now. Ask me something else about the book."
-        else:
-            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-            return "The stupid computer's acting up again. I hate all this phony technical stuff. Try asking me again."
-            
-    except requests.exceptions.Timeout:
-        logger.error("Ollama request timed out")
-        return "Hold on a second, I'm thinking... Actually, this is taking too long. Ask me something else."
-        
-    except requests.exceptions.ConnectionError:
-        logger.error("Could not connect to Ollama server")
-        return "I can't connect to the goddam server. Make sure it's running (ollama serve), or just ask me in person or something."
-    
-    except Exception as e:
-        logger.error(f"Unexpected error getting Holden response: {str(e)}")
-        return "Something's wrong with this phony computer system. But look, just ask me about what you really want to know about the book."
-
-def get_custom_chatbot_response(message, conversation_history=None, chatbot_config=None):
-    """Get response from Ollama model as a custom chatbot"""
-    
-    if not chatbot_config:
-        return "I don't have any configuration set up. Please create a custom chatbot first."
-    
-    # Build the system prompt from the custom configuration
-    style_prompts = {
-        'friendly': 'You are friendly, warm, and encouraging. Use a supportive tone and show enthusiasm for learning.',
-        'professional': 'You are professional and informative. Provide clear, structured responses with appropriate formality.',
-        'casual': 'You are relaxed and conversational. Use casual language and be approachable and easy-going.',
-        'academic': 'You are scholarly and thorough. Provide detailed explanations with academic rigor and precision.',
-        'encouraging': 'You are motivational and inspiring. Focus on building confidence and celebrating progress.'
-    }
+    # Follow-up questions often only make sense with the previous one
+    query = message
+    previous = [msg.get('content', '') for msg in conversation_history or [] if msg.get('role') == 'user']
+    if previous:
+        query = f"{previous[-1]} {message}"
     
-    style_instruction = style_prompts.get(chatbot_config.get('conversationStyle', 'friendly'), style_prompts['friendly'])
+    chunks = reference_indexes.get(materials).select(query, REFERENCE_TOP_K, REFERENCE_TOKEN_BUDGET)
+    return '\n\n'.join(chunks) or None
+
+def build_custom_system_prompt(chatbot_config):
+    """Build the system prompt for a teacher-defined chatbot"""
+    style_instruction = CUSTOM_STYLE_PROMPTS.get(chatbot_config.get('conversationStyle', 'friendly'), CUSTOM_STYLE_PROMPTS['friendly'])
     
-    system_prompt = f"""You are {chatbot_config.get('name', 'Custom AI Tutor')}.
+    return f"""You are {chatbot_config.get('name', 'Custom AI Tutor')}.
 
 Personality and role: {chatbot_config.get('personality', 'A helpful AI tutor')}
 
 Communication style: {style_instruction}
 
-{f"Additional knowledge and reference materials: {chatbot_config.get('referenceMaterials', '')}" if chatbot_config.get('referenceMaterials') else ""}
+{f"Additional knowledge and reference materials: {chatbot_config.get('referenceMaterials', '')}" if reference_fits_prompt(chatbot_config) else ""}
 
 Remember to:
 - Stay in character based on the personality description
@@ -358,131 +619,730 @@ Remember to:
 - Encourage critical thinking
 - Adapt your responses to match the specified conversation style
 - Use the reference materials when relevant to provide accurate information"""
+
+def custom_fallbacks(chatbot_config):
+    """Fallback messages for a custom chatbot, with the outage message matching its style"""
+    fallbacks = dict(CUSTOM_FALLBACKS)
+    fallbacks['unavailable'] = CUSTOM_STYLE_ERRORS.get(chatbot_config.get('conversationStyle', 'friendly'), CUSTOM_STYLE_ERRORS['friendly'])
+    return fallbacks
+
+def conversation_key(persona, student_id):
+    """Key for per-conversation generation state; anonymous students share none"""
+    if not CONTEXT_REUSE_ENABLED or not student_id or student_id == 'unknown':
+        return None
+    return f"{persona}:{student_id}"
+
+def plan_turn(persona, message, conversation_history=None, student_id=None):
+    """Choose the prompt for this turn, returning (conversation key, prompt, context).
+    
+    When Ollama's context from the previous turn of this exact conversation
+    is known, only the new student turn is sent and the rest is reused from
+    Ollama's KV cache. Otherwise the full prompt is rebuilt from as much
+    recent history as fits the persona's token budget, plus a summary of
+    anything older, after the persona's fixed prefix.
+    """
+    reference = reference_excerpts(persona.config, message, conversation_history) if persona.config else None
+    key = conversation_key(persona.name, student_id)
+    context = conversation_contexts.get(key, conversation_history) if key else None
+    if context is not None:
+        return key, persona.student_turn(message, reference), context
+    
+    conversation_history = conversation_history or []
+    start, window = select_history(conversation_history, persona.history_tokens)
+    summary = None
+    if HISTORY_SUMMARIES_ENABLED and persona.summaries and student_id and student_id != 'unknown':
+        summary = history_summaries.get(f"{persona.name}:{student_id}", conversation_history, start, persona.label)
+    return key, persona.render(message, window, reference, summary), None
+
+def request_student_id(data):
+    """A chat request's student_id as a string, or 'unknown' if it is missing or malformed"""
+    student_id = data.get('student_id')
+    if student_id is None:
+        return 'unknown'
+    if isinstance(student_id, bool) or not isinstance(student_id, (str, int)):
+        # Ignored rather than rejected, so a crisis message is still answered
+        logger.warning("Ignoring malformed student_id (%s)", type(student_id).__name__)
+        return 'unknown'
+    return str(student_id)
+
+def valid_history(conversation_history):
+    """Whether a client's conversation_history is a list of {role, content} messages"""
+    return isinstance(conversation_history, list) and all(
+        isinstance(msg, dict) and isinstance(msg.get('role', ''), str) and isinstance(msg.get('content', ''), str)
+        for msg in conversation_history
+    )
+
+def chat_history(persona, data, student_id):
+    """Conversation history for a chat request, and the session key to record the turn under.
     
+    Without a session_id the history is whatever the client sent. With one,
+    history sent by the client replaces the stored conversation (starting or
+    restoring a session); otherwise the stored conversation is used, and the
+    history is None if the session is unknown or has expired. Malformed
+    history is ignored, so a crisis message is still answered.
+    """
+    session_id = data.get('session_id')
+    conversation_history = data.get('conversation_history')
+    if conversation_history is not None and not valid_history(conversation_history):
+        logger.warning("Ignoring malformed conversation_history (%s)", type(conversation_history).__name__)
+        conversation_history = None
+    if not CONVERSATION_STORE_ENABLED or not session_id:
+        return None, conversation_history or []
+    key = f"{persona}:{student_id}:{session_id}"
+    if conversation_history is not None:
+        conversation_store.replace(key, conversation_history)
+        return key, conversation_history
+    return key, conversation_store.get(key)
+
+def unknown_session_error(data):
+    """Error body and status for a session the store doesn't hold; the client should resend its history"""
+    return {'error': 'Unknown session_id', 'session_id': data.get('session_id')}, 404
+
+def record_session_turn(session_key, message, reply):
+    """Add a completed turn to the stored conversation in session mode"""
+    if session_key and not conversation_store.append(session_key, message, reply):
+        logger.info("Session %s ended while its turn was generated; the client will resend its history", session_key)
+
+def recorded_tokens(tokens, session_key, message):
+    """Pass streamed tokens through, then record what was sent as the session's reply"""
+    if not session_key:
+        yield from tokens
+        return
+    reply = []
     try:
-        # First check if Ollama is running
-        if not test_ollama_connection():
-            style_errors = {
-                'friendly': "I'm having trouble connecting to my learning service right now. Give me a moment and try again!",
-                'professional': "I am currently experiencing connectivity issues. Please retry your request momentarily.",
-                'casual': "Oops! Connection's acting up. Try again in a sec?",
-                'academic': "I regret to inform you of current technical difficulties. Please attempt your inquiry again shortly.",
-                'encouraging': "Don't worry! Even the best tutors have technical hiccups. Let's try again in just a moment!"
-            }
-            return style_errors.get(chatbot_config.get('conversationStyle', 'friendly'), style_errors['friendly'])
+        for token in tokens:
+            reply.append(token)
+            yield token
+    finally:
+        # Also runs if the student disconnects, keeping the part they saw
+        record_session_turn(session_key, message, ''.join(reply))
+
+def remember_turn(key, conversation_history, message, response_json):
+    """Keep the context Ollama returned so the next turn can reuse it"""
+    if key:
+        conversation_contexts.put(key, conversation_history, message, response_json.get('context'))
+
+def response_cacheable(persona, conversation_history):
+    """Whether this turn's reply can come from, or go into, the shared response cache"""
+    if not RESPONSE_CACHE_ENABLED or persona.split(':', 1)[0] not in RESPONSE_CACHE_PERSONAS:
+        return False
+    # Follow-up turns depend on the conversation so far; only opening questions are shared
+    return not conversation_history
+
+def cached_reply(persona, message, conversation_history):
+    """Cached reply to the same (or a near-identical) opening question, or None"""
+    if not response_cacheable(persona, conversation_history):
+        return None
+    return response_cache.get(persona, message)
+
+def cache_reply(persona, conversation_history, message, response_json):
+    """Share a successful reply to an opening question with later students"""
+    reply = response_json.get('response', '').strip()
+    if reply and response_cacheable(persona, conversation_history):
+        response_cache.put(persona, message, reply)
+
+def finish_turn(key, persona, conversation_history, message, response_json):
+    """Record a completed generation: Ollama's context and the cacheable reply"""
+    remember_turn(key, conversation_history, message, response_json)
+    cache_reply(persona, conversation_history, message, response_json)
+
+def custom_persona(chatbot_config):
+    """Persona name for a custom chatbot; editing the chatbot gives it a new one"""
+    # Long reference materials aren't in the system prompt, so hash them separately
+    identity = build_custom_system_prompt(chatbot_config) + (chatbot_config.get('referenceMaterials') or '')
+    return 'custom:' + hashlib.sha1(identity.encode('utf-8')).hexdigest()[:12]
+
+def compile_chatbot(chatbot_config):
+    """A custom chatbot's Persona, built once from its config"""
+    return Persona(
+        custom_persona(chatbot_config),
+        build_custom_system_prompt(chatbot_config),
+        CUSTOM_OPTIONS,
+        custom_fallbacks(chatbot_config),
+        label=chatbot_config.get('name', 'Tutor'),
+        history_tokens=HISTORY_TOKEN_BUDGETS['custom'],
+        config=chatbot_config
+    )
+
+# Registered custom chatbots, so chat requests can send an ID instead of the whole config
+CHATBOT_WARM_ON_REGISTER = os.getenv('CHATBOT_WARM_ON_REGISTER', 'True').lower() == 'true'
+# Workers under serve.py each keep their own compiled chatbots and share them through the directory
+chatbot_registry = ChatbotRegistry(
+    compile_chatbot,
+    max_chatbots=int(os.getenv('CHATBOT_REGISTRY_SIZE', '500')),
+    path=os.getenv('CHATBOT_REGISTRY_DIR') or None,
+    check_disk=state_shared()
+)
+
+def resolve_chatbot(data):
+    """Compiled chatbot for a custom chat request, from its chatbot_id or inline chatbot_config"""
+    if data.get('chatbot_id'):
+        return chatbot_registry.get(data['chatbot_id'])
+    if data.get('chatbot_config'):
+        return compile_chatbot(chatbot_fields(data['chatbot_config']))
+    return None
+
+def warm_chatbot_payload(chatbot):
+    """Request that has Ollama evaluate a chatbot's prompt prefix and generate one token"""
+    return generation_payload(chatbot.prefix, dict(chatbot.options, num_predict=1))
+
+def missing_chatbot_error(data):
+    """Error body and status for a custom chat request without a usable chatbot"""
+    if data.get('chatbot_id'):
+        # Unknown or evicted: the client should register the config again
+        return {'error': 'Unknown chatbot_id', 'chatbot_id': data['chatbot_id']}, 404
+    return {'error': 'No chatbot configuration provided'}, 400
+
+def generation_options(persona, scheduler):
+    """The persona's Ollama options, with a reply budget for the current load if it is budgeted.
+    
+    Only chat requests have a student waiting (and a deadline); other
+    generations, such as batch evaluations, keep the persona's full
+    num_predict. The budget is logged with the request's ID.
+    """
+    options = persona.options
+    deadline = current_deadline()
+    if not GENERATION_BUDGET_ENABLED or deadline is None or not generation_budget.applies(persona.kind):
+        return options
+    queue_depth = scheduler.queue_depth()
+    num_predict = generation_budget.choose(persona.kind, options['num_predict'], queue_depth,
+                                           deadline.elapsed(), deadline.remaining())
+    reply_budget_tokens.observe(num_predict, persona.kind)
+    logger.info("Reply budget for %s: %s tokens (queue depth %s)", persona.label, num_predict, queue_depth,
+                extra={'num_predict': num_predict, 'queue_depth': queue_depth})
+    return dict(options, num_predict=num_predict)
+
+def generation_payload(prompt, options, context=None, stream=False):
+    """Request body for /api/generate"""
+    payload = {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "stream": stream,
+        "options": dict(options, num_ctx=OLLAMA_NUM_CTX),
+        "keep_alive": OLLAMA_KEEP_ALIVE
+    }
+    if context is not None:
+        payload["context"] = context
+    return payload
+
+def ollama_chunks(response, deadline=None):
+    """Parsed chunks of a streamed Ollama reply, up to the final one with the context and timings.
+    
+    Raises GenerationAbandoned between chunks once `deadline` says nobody
+    is waiting for the reply.
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if chunk.get('error'):
+            raise RuntimeError(chunk['error'])
+        yield chunk
+        if chunk.get('done'):
+            return
+        reason = deadline.abandoned() if deadline is not None else None
+        if reason:
+            raise GenerationAbandoned(reason)
+
+def get_persona_response(persona, message, conversation_history=None, student_id=None,
+                         use_cache=True, on_complete=None):
+    """Get a persona's reply from Ollama, or one of its fallback messages
+    
+    `use_cache=False` always generates and leaves the response cache alone.
+    `on_complete` is called with Ollama's response JSON. The reply is
+    streamed from Ollama so the generation can be abandoned between tokens
+    when the request's deadline passes or its student disconnects.
+    """
+    fallbacks = persona.fallbacks
+    
+    # Serve repeated opening questions without generating
+    cached = cached_reply(persona.name, message, conversation_history) if use_cache else None
+    if cached is not None:
+        logger.info("Serving %s response from cache", persona.label)
+        return cached
+    
+    deadline = current_deadline()
+    started = time.perf_counter()
+    response = None
+    try:
+        # Fail fast if Ollama is known to be down or the breaker is open
+        if not ollama_available():
+            return fallbacks['unavailable']
+        reason = deadline.abandoned() if deadline is not None else None
+        if reason:
+            record_skipped(persona, reason)
+            return fallbacks['timeout']
         
         # Build the conversation context
-        full_prompt = f"{system_prompt}\n\n"
+        key, prompt, context = plan_turn(persona, message, conversation_history, student_id)
         
-        # Add conversation history if available
-        if conversation_history:
-            for msg in conversation_history[-6:]:  # Last 6 messages for context
-                role = "Student" if msg.get("role") == "user" else chatbot_config.get('name', 'Tutor')
-                full_prompt += f"{role}: {msg.get('content', '')}\n"
+        logger.debug("Sending request to Ollama with model %s as %s", MODEL_NAME, persona.label)
         
-        full_prompt += f"Student: {message}\n{chatbot_config.get('name', 'Tutor')}:"
+        # Call Ollama API; a timeout cut short by the deadline isn't the node's fault
+        read_timeout = ollama_read_timeout(deadline)
+        response = ollama.generate(
+            generation_payload(prompt, generation_options(persona, generation_scheduler), context, stream=True),
+            timeout=read_timeout,
+            stream=True,
+            expected_errors=(requests.exceptions.Timeout,) if read_timeout < OLLAMA_TIMEOUT else ()
+        )
         
-        logger.debug(f"Sending request to Ollama for custom chatbot: {chatbot_config.get('name')}")
+        logger.debug("Ollama response status: %s", response.status_code)
+        record_generation_status(response.status_code)
         
-        # Call Ollama API
-        response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": MODEL_NAME,
-                "prompt": full_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.8,
-                    "top_p": 0.9,
-                    "max_tokens": 600
-                }
-            },
-            timeout=30
-        )
+        if response.status_code != 200:
+            logger.error("Ollama API error: %s - %.500s", response.status_code, response.text)
+            return fallbacks['api_error']
         
-        logger.debug(f"Ollama response status: {response.status_code}")
+        reply = []
+        response_json = {}
+        for chunk in ollama_chunks(response, deadline):
+            reply.append(chunk.get('response', ''))
+            if chunk.get('done'):
+                response_json = dict(chunk, response=''.join(reply))
+        if not response_json:
+            raise RuntimeError("Ollama ended the reply without its final chunk")
+        response.finish()
         
-        if response.status_code == 200:
-            response_json = response.json()
-            ai_response = response_json.get('response', '')
-            
-            if ai_response:
-                logger.info(f"Successfully got custom chatbot response from {chatbot_config.get('name')}")
-                return ai_response.strip()
-            else:
-                logger.error("Empty response from Ollama")
-                return "I'm thinking about your question. Could you try asking it in a different way?"
+        ai_response = response_json['response']
+        observe_generation(persona, response_json, continued=context is not None)
+        if use_cache:
+            finish_turn(key, persona.name, conversation_history, message, response_json)
         else:
-            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-            return "I'm having some technical difficulties right now. Please try asking your question again."
-            
-    except requests.exceptions.Timeout:
-        logger.error("Ollama request timed out")
-        return "I'm taking a bit longer to think about this. Please try asking again."
+            remember_turn(key, conversation_history, message, response_json)
+        if on_complete:
+            on_complete(response_json)
         
-    except requests.exceptions.ConnectionError:
+        if ai_response.strip():
+            logger.info("Successfully got %s response", persona.label)
+            return ai_response.strip()
+        else:
+            logger.error("Empty response from Ollama")
+            return fallbacks['empty']
+    
+    except GenerationAbandoned as abandoned:
+        record_abandoned(persona, abandoned.reason, started)
+        return fallbacks['timeout']
+    
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        if deadline is not None and deadline.expired():
+            # Cut short by the request's deadline, not by Ollama failing
+            record_abandoned(persona, 'deadline', started)
+            return fallbacks['timeout']
+        if response is not None:
+            response.finish(e)
+        if isinstance(e, requests.exceptions.Timeout):
+            logger.error("Ollama request timed out")
+            record_generation_error(e, timed_out=True)
+            return fallbacks['timeout']
         logger.error("Could not connect to Ollama server")
-        return "I can't connect to my knowledge service right now. Please make sure the service is running or try again later."
+        record_generation_error(e, connection_lost=True)
+        return fallbacks['connection']
     
     except Exception as e:
-        logger.error(f"Unexpected error getting custom chatbot response: {str(e)}")
-        return "I encountered an unexpected issue. Please try asking your question again."
+        logger.error("Unexpected error getting %s response: %s", persona.label, e)
+        record_generation_error(e)
+        if response is not None:
+            response.finish(e)
+        return fallbacks['error']
+    
+    finally:
+        if response is not None:
+            response.close()
+
+def stream_ollama_response(persona, prompt, context=None, on_complete=None):
+    """Yield a persona's response text from Ollama as it is generated.
+    
+    On any failure the persona's fallback message is yielded instead, so the
+    caller always receives some text. `on_complete` is called with Ollama's
+    final chunk (which carries the conversation context and timings) when
+    generation finishes. Closing the generator (e.g. when the
+    browser disconnects) closes the upstream connection, which stops Ollama
+    generating a response nobody will read; so does the request's deadline
+    passing.
+    
+    The request's deadline and reply budget are taken when this is called,
+    not when the stream is first read: a shared stream may be read first on
+    another request's thread.
+    """
+    # Writing the stream notices a disconnect, so only the deadline is checked
+    deadline = current_deadline()
+    deadline = deadline.detached() if deadline is not None else None
+    return ollama_tokens(persona, prompt, context, on_complete, deadline,
+                         generation_options(persona, generation_scheduler))
 
-@app.route('/api/chat/holden', methods=['POST'])
+def ollama_tokens(persona, prompt, context, on_complete, deadline, options):
+    """The generator behind stream_ollama_response"""
+    fallbacks = persona.fallbacks
+    if not ollama_available():
+        yield fallbacks['unavailable']
+        return
+    
+    if deadline is not None and deadline.expired():
+        record_skipped(persona, 'deadline')
+        yield fallbacks['timeout']
+        return
+    
+    started = time.perf_counter()
+    response = None
+    produced = False
+    generating = False
+    try:
+        read_timeout = ollama_read_timeout(deadline)
+        response = ollama.generate(
+            generation_payload(prompt, options, context, stream=True),
+            timeout=read_timeout,
+            stream=True,
+            expected_errors=(requests.exceptions.Timeout,) if read_timeout < OLLAMA_TIMEOUT else ()
+        )
+        record_generation_status(response.status_code)
+        
+        if response.status_code != 200:
+            logger.error("Ollama API error: %s - %.500s", response.status_code, response.text)
+            yield fallbacks['api_error']
+            return
+        
+        generating = True
+        reply = []
+        for chunk in ollama_chunks(response, deadline):
+            token = chunk.get('response', '')
+            reply.append(token)
+            if token:
+                # Drop leading whitespace like the non-streaming path's strip()
+                if not produced:
+                    token = token.lstrip()
+                if token:
+                    produced = True
+                    yield token
+            if chunk.get('done'):
+                response.finish()
+                observe_generation(persona, chunk, continued=context is not None)
+                if on_complete:
+                    # Like a non-streamed reply, the final chunk passed on carries the whole text
+                    on_complete(dict(chunk, response=''.join(reply)))
+        generating = False
+        
+        if not produced:
+            logger.error("Empty response from Ollama")
+            yield fallbacks['empty']
+    
+    except GeneratorExit:
+        # The student disconnected (or everyone sharing the stream did)
+        if generating:
+            record_abandoned(persona, 'disconnected', started)
+        raise
+    
+    except GenerationAbandoned as abandoned:
+        record_abandoned(persona, abandoned.reason, started)
+        if not produced:
+            yield fallbacks['timeout']
+    
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        if deadline is not None and deadline.expired():
+            record_abandoned(persona, 'deadline', started)
+            if not produced:
+                yield fallbacks['timeout']
+        else:
+            if response is not None:
+                response.finish(e)
+            if isinstance(e, requests.exceptions.Timeout):
+                logger.error("Ollama streaming request timed out")
+                record_generation_error(e, timed_out=True)
+                yield fallbacks['timeout']
+            else:
+                logger.error("Could not connect to Ollama server")
+                record_generation_error(e, connection_lost=True)
+                yield fallbacks['connection']
+    
+    except Exception as e:
+        logger.error("Unexpected error streaming Ollama response: %s", e)
+        record_generation_error(e)
+        if response is not None:
+            response.finish(e)
+        yield fallbacks['error']
+    
+    finally:
+        if response is not None:
+            response.close()
+
+def busy_response(busy, message, **extra):
+    """429 reply for a generation the scheduler couldn't admit in time"""
+    logger.warning("Generation queue busy (%s), queue depth %s", busy.reason, busy.queue_depth)
+    response = jsonify({
+        'error': 'busy',
+        'response': message,
+        'queue_depth': busy.queue_depth,
+        'retry_after': busy.retry_after,
+        **extra
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(busy.retry_after)
+    return response
+
+def client_ip(remote_addr, headers):
+    """The requesting client's IP, from X-Forwarded-For if the proxy is trusted"""
+    if RATE_LIMIT_TRUST_FORWARDED_FOR and headers.get('X-Forwarded-For'):
+        return headers['X-Forwarded-For'].split(',')[0].strip()
+    return remote_addr
+
+def admit_request(endpoint, student_id, remote_addr, headers):
+    """Apply the endpoint's rate limits, raising RateLimited.
+    
+    Returns who the request's generation counts against for fair-share
+    admission: the student, or their IP if the student is anonymous.
+    """
+    ip = client_ip(remote_addr, headers)
+    student = student_id if student_id and student_id != 'unknown' else None
+    if RATE_LIMIT_ENABLED:
+        try:
+            rate_limiter.check(endpoint, student, ip)
+        except RateLimited as limited:
+            rate_limited_requests.inc(endpoint, limited.scope)
+            raise
+    if not GENERATION_FAIR_SHARE:
+        return None
+    return f"student:{student}" if student else f"ip:{ip}"
+
+
+def rate_limited_response(limited, message, **extra):
+    """429 reply for a request over its student's or IP's rate limit"""
+    logger.warning("Rate limited %s request (%s limit), retry in %ss", limited.endpoint, limited.scope, limited.retry_after)
+    response = jsonify({
+        'error': 'rate_limited',
+        'response': message,
+        'limit': limited.scope,
+        'retry_after': limited.retry_after,
+        **extra
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(limited.retry_after)
+    return response
+
+def sse_event(payload, event=None):
+    """Format one Server-Sent Event carrying a JSON payload"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+def sse_response(events):
+    """Wrap an event generator in a streaming text/event-stream response"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Stop reverse proxies buffering the stream
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def cached_sse(text):
+    """Send a cached reply as a single-token stream"""
+    return sse_response(iter([sse_event({'token': text}), sse_event({}, event='done')]))
+
+def scheduled_sse(priority, events, owner=None):
+    """Take a generation slot, then stream events(), freeing the slot however the stream ends.
+    
+    The slot is taken before the response starts so a full queue can still
+    be answered with a 429, and before `events` is called so the generation
+    is planned for the load it starts under. It is freed when the stream
+    finishes or when the server closes the response, even if the stream was
+    never read.
+    """
+    generation_scheduler.acquire(priority, owner, time_left())
+    events = events()
+    released = []
+    
+    def release():
+        if not released:
+            released.append(True)
+            generation_scheduler.release()
+    
+    def guarded():
+        try:
+            yield from events
+        finally:
+            release()
+    
+    response = sse_response(guarded())
+    response.call_on_close(release)
+    return response
+
+def claim_generation(flights, persona, message, conversation_history, student_id=None):
+    """Join an identical in-flight generation or lead a new one; None if the persona isn't coalesced.
+    
+    A turn with history is planned from its student's stored Ollama context
+    and summary, so it is only shared with the same student's requests.
+    Opening questions are shared across students.
+    """
+    private = conversation_history and student_id and student_id != 'unknown'
+    key = coalescing_key(persona, message, conversation_history, student_id if private else None)
+    subscription = flights.claim(persona, key)
+    if subscription is not None and not subscription.leader:
+        coalesced_requests.inc(persona.split(':', 1)[0])
+        logger.info("Sharing an in-flight %s generation", persona)
+    return subscription
+
+def scheduled_call(priority, generate, owner=None, deadline=None):
+    """Call generate() in a generation slot, as a one-item iterator a flight can share.
+    
+    It runs under `deadline`, whichever request's thread reads the flight first.
+    """
+    with deadline_scope(deadline):
+        with generation_scheduler.slot(priority, owner, time_left()):
+            reply = generate()
+    yield reply
+
+def coalesced_reply(persona, message, conversation_history, priority, generate, owner=None, student_id=None):
+    """Call generate() in a generation slot, or share the reply of an identical request in flight.
+    
+    Followers don't queue for a slot of their own. If the generation
+    couldn't get one, every request sharing it gets the SchedulerBusy.
+    The slot counts against `owner`'s fair share. A shared generation keeps
+    the leader's deadline but not its connection, so it outlives the leader's
+    student leaving.
+    """
+    subscription = claim_generation(in_flight, persona, message, conversation_history, student_id)
+    if subscription is None:
+        with generation_scheduler.slot(priority, owner, time_left()):
+            return generate()
+    if subscription.leader:
+        deadline = current_deadline()
+        subscription.start(scheduled_call(priority, generate, owner, deadline.detached() if deadline else None))
+    try:
+        for reply in subscription:
+            return reply
+    finally:
+        subscription.close()
+
+def shared_tokens(subscription, fallbacks):
+    """A coalesced generation's tokens, or a fallback if it never started"""
+    try:
+        yield from subscription
+    except SchedulerBusy:
+        yield fallbacks['busy']
+    except Exception as e:
+        logger.error("Shared generation failed: %s", e)
+        yield fallbacks['error']
+
+def coalesced_sse(persona, message, conversation_history, priority, tokens, events, fallbacks, owner=None,
+                  student_id=None):
+    """Stream events(tokens()) like scheduled_sse, sharing the tokens with identical requests in flight.
+    
+    Only the leader calls `tokens` to start the generation, once it has the
+    slot. It takes the slot before the response starts, so a full queue is
+    still a 429, and frees it when the generation ends. Followers stream the
+    same tokens as they arrive without a slot of their own.
+    """
+    subscription = claim_generation(in_flight, persona, message, conversation_history, student_id)
+    if subscription is None:
+        return scheduled_sse(priority, lambda: events(tokens()), owner)
+    if subscription.leader:
+        try:
+            generation_scheduler.acquire(priority, owner, time_left())
+        except SchedulerBusy as busy:
+            subscription.fail(busy)
+            subscription.close()
+            raise
+        subscription.start(tokens(), on_close=generation_scheduler.release)
+    
+    response = sse_response(events(shared_tokens(subscription, fallbacks)))
+    # Leave the flight even if the stream is never read
+    response.call_on_close(subscription.close)
+    return response
+
+@api.route('/api/chat/holden', methods=['POST'])
 def chat_holden():
     """Handle Holden Caulfield chat messages"""
     try:
         data = request.json
         message = data.get('message', '')
-        student_id = data.get('student_id', 'unknown')
-        conversation_history = data.get('conversation_history', [])
+        student_id = request_student_id(data)
         
-        logger.info(f"Received message for Holden from student {student_id}: {message[:50]}...")
+        logger.info("Received message for Holden from student %s: %.50s...", student_id, message)
         
         if not message:
             return jsonify({'error': 'No message provided'}), 400
         
-        # Get Holden's response
-        holden_response = get_holden_response(message, conversation_history)
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history('holden', data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return jsonify(error), status
+        
+        # Per-student and per-IP limits; the owner is who the generation counts against
+        owner = admit_request('holden', student_id, request.remote_addr, request.headers)
+        
+        # Get Holden's response once a generation slot is free, or share an identical one in flight
+        holden_response = coalesced_reply('holden', message, conversation_history, PRIORITY_HOLDEN,
+                                          partial(get_persona_response, HOLDEN, message, conversation_history, student_id),
+                                          owner=owner, student_id=student_id)
+        record_session_turn(session_key, message, holden_response)
         
         return jsonify({
             'response': holden_response
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy, HOLDEN_FALLBACKS['busy'])
+    
+    except RateLimited as limited:
+        return rate_limited_response(limited, HOLDEN_FALLBACKS['rate_limited'])
+        
     except Exception as e:
-        logger.error(f"Error in Holden chat endpoint: {str(e)}", exc_info=True)
+        logger.error("Error in Holden chat endpoint: %s", e, exc_info=True)
         return jsonify({
             'error': 'An error occurred',
             'response': 'Goddam it, something went wrong. This whole computer thing really kills me. Try asking your question again.'
         }), 500
 
-@app.route('/api/chat/wellbeing', methods=['POST'])
+@api.route('/api/chat/wellbeing', methods=['POST'])
 def chat_wellbeing():
     """Handle wellbeing chat messages"""
     try:
         data = request.json
         message = data.get('message', '')
-        student_id = data.get('student_id', 'unknown')
-        conversation_history = data.get('conversation_history', [])
+        student_id = request_student_id(data)
         
-        logger.info(f"Received message from student {student_id}: {message[:50]}...")
+        logger.info("Received message from student %s: %.50s...", student_id, message)
         
         if not message:
             return jsonify({'error': 'No message provided'}), 400
         
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history('wellbeing', data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return jsonify(error), status
+        
         # Check message safety
         safety_check = check_message_safety(message)
         
         # If crisis detected, return crisis response immediately
         if safety_check['level'] == 'CRISIS':
             log_if_concerning(student_id, message, safety_check['response'], 'CRISIS')
+            record_session_turn(session_key, message, safety_check['response'])
             return jsonify({
                 'response': safety_check['response'],
                 'safety_level': 'CRISIS'
             })
         
-        # Get AI response
-        ai_response = get_ollama_response(message, conversation_history)
+        # Get AI response, letting students showing concern jump the queue
+        priority = PRIORITY_WELLBEING_CONCERN if safety_check['level'] == 'CONCERN' else PRIORITY_WELLBEING
+        try:
+            # Rate limits apply only once a crisis has been ruled out
+            owner = admit_request('wellbeing', student_id, request.remote_addr, request.headers)
+            ai_response = coalesced_reply('wellbeing', message, conversation_history, priority,
+                                          partial(get_persona_response, WELLBEING, message, conversation_history, student_id),
+                                          owner=owner, student_id=student_id)
+        except RateLimited as limited:
+            if safety_check['level'] == 'CONCERN':
+                log_if_concerning(student_id, message, WELLBEING_FALLBACKS['rate_limited'], 'CONCERN')
+            return rate_limited_response(limited, WELLBEING_FALLBACKS['rate_limited'], safety_level=safety_check['level'])
+        except SchedulerBusy as busy:
+            if safety_check['level'] == 'CONCERN':
+                log_if_concerning(student_id, message, WELLBEING_FALLBACKS['busy'], 'CONCERN')
+            return busy_response(busy, WELLBEING_FALLBACKS['busy'], safety_level=safety_check['level'])
+        record_session_turn(session_key, message, ai_response)
         
         # Add concern note if needed
         if safety_check['level'] == 'CONCERN':
@@ -495,54 +1355,501 @@ def chat_wellbeing():
         })
         
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
+        logger.error("Error in chat endpoint: %s", e, exc_info=True)
         return jsonify({
             'error': 'An error occurred',
             'response': 'I\'m having some technical difficulties, but I\'m still here for you. If you need immediate support, please talk to a trusted adult or call Kids Helpline at 1800 55 1800.'
         }), 500
 
-@app.route('/api/chat/custom', methods=['POST'])
+@api.route('/api/chat/custom', methods=['POST'])
 def chat_custom():
     """Handle custom chatbot chat messages"""
     try:
         data = request.json
         message = data.get('message', '')
-        student_id = data.get('student_id', 'unknown')
-        conversation_history = data.get('conversation_history', [])
-        chatbot_config = data.get('chatbot_config', {})
+        student_id = request_student_id(data)
+        # A registered chatbot_id, or the full chatbot_config for unregistered chatbots
+        chatbot = resolve_chatbot(data)
         
-        logger.info(f"Received message for custom chatbot '{chatbot_config.get('name', 'Unknown')}' from student {student_id}: {message[:50]}...")
+        logger.info("Received message for custom chatbot '%s' from student %s: %.50s...", chatbot.label if chatbot else 'Unknown', student_id, message)
         
         if not message:
             return jsonify({'error': 'No message provided'}), 400
         
-        if not chatbot_config:
-            return jsonify({'error': 'No chatbot configuration provided'}), 400
+        if not chatbot:
+            error, status = missing_chatbot_error(data)
+            return jsonify(error), status
+        
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history(chatbot.name, data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return jsonify(error), status
         
-        # Get custom chatbot response
-        custom_response = get_custom_chatbot_response(message, conversation_history, chatbot_config)
+        # Per-student and per-IP limits; the owner is who the generation counts against
+        owner = admit_request('custom', student_id, request.remote_addr, request.headers)
+        
+        # Get custom chatbot response once a generation slot is free, or share an identical one in flight
+        custom_response = coalesced_reply(chatbot.name, message, conversation_history, PRIORITY_CUSTOM,
+                                          partial(get_persona_response, chatbot, message, conversation_history, student_id),
+                                          owner=owner, student_id=student_id)
+        record_session_turn(session_key, message, custom_response)
         
         return jsonify({
             'response': custom_response
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy, CUSTOM_FALLBACKS['busy'])
+    
+    except RateLimited as limited:
+        return rate_limited_response(limited, CUSTOM_FALLBACKS['rate_limited'])
+        
     except Exception as e:
-        logger.error(f"Error in custom chat endpoint: {str(e)}", exc_info=True)
+        logger.error("Error in custom chat endpoint: %s", e, exc_info=True)
         return jsonify({
             'error': 'An error occurred',
             'response': 'I apologize, but I encountered a technical issue. Please try asking your question again.'
         }), 500
 
-@app.route('/api/test', methods=['GET'])
-def test_connection():
-    """Test endpoint to verify Ollama connection and model"""
-    logger.info("Running connection test...")
+@api.route('/api/chat/holden/stream', methods=['POST'])
+def chat_holden_stream():
+    """Stream Holden Caulfield's reply to the browser as Server-Sent Events"""
+    try:
+        data = request.json
+        message = data.get('message', '')
+        student_id = request_student_id(data)
+        
+        logger.info("Received streaming message for Holden from student %s: %.50s...", student_id, message)
+        
+        if not message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history('holden', data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return jsonify(error), status
+        
+        # Per-student and per-IP limits; the owner is who the generation counts against
+        owner = admit_request('holden', student_id, request.remote_addr, request.headers)
+        
+        # Serve repeated opening questions without queueing for a generation
+        cached = cached_reply('holden', message, conversation_history)
+        if cached is not None:
+            record_session_turn(session_key, message, cached)
+            return cached_sse(cached)
+        
+        key, prompt, context = plan_turn(HOLDEN, message, conversation_history, student_id)
+        remember = partial(finish_turn, key, 'holden', conversation_history, message)
+        
+        tokens = partial(stream_ollama_response, HOLDEN, prompt, context, remember)
+        
+        def events(tokens):
+            for token in recorded_tokens(tokens, session_key, message):
+                yield sse_event({'token': token})
+            yield sse_event({}, event='done')
+        
+        return coalesced_sse('holden', message, conversation_history, PRIORITY_HOLDEN, tokens, events, HOLDEN_FALLBACKS,
+                             owner=owner, student_id=student_id)
+        
+    except SchedulerBusy as busy:
+        return busy_response(busy, HOLDEN_FALLBACKS['busy'])
+    
+    except RateLimited as limited:
+        return rate_limited_response(limited, HOLDEN_FALLBACKS['rate_limited'])
+        
+    except Exception as e:
+        logger.error("Error in Holden streaming endpoint: %s", e, exc_info=True)
+        return jsonify({
+            'error': 'An error occurred',
+            'response': 'Goddam it, something went wrong. This whole computer thing really kills me. Try asking your question again.'
+        }), 500
+
+@api.route('/api/chat/wellbeing/stream', methods=['POST'])
+def chat_wellbeing_stream():
+    """Stream a wellbeing reply as Server-Sent Events, keeping the safety checks"""
+    try:
+        data = request.json
+        message = data.get('message', '')
+        student_id = request_student_id(data)
+        
+        logger.info("Received streaming message from student %s: %.50s...", student_id, message)
+        
+        if not message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history('wellbeing', data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return jsonify(error), status
+        
+        # Check message safety before anything is generated
+        safety_check = check_message_safety(message)
+        safety_level = safety_check['level']
+        
+        # If crisis detected, send the crisis response immediately without generating
+        if safety_level == 'CRISIS':
+            log_if_concerning(student_id, message, safety_check['response'], 'CRISIS')
+            record_session_turn(session_key, message, safety_check['response'])
+            
+            def crisis_events():
+                yield sse_event({'token': safety_check['response']})
+                yield sse_event({'safety_level': 'CRISIS'}, event='done')
+            
+            return sse_response(crisis_events())
+        
+        # Log concerns up front so an abandoned stream can't skip the alert
+        if safety_level == 'CONCERN':
+            log_if_concerning(student_id, message, safety_check.get('add_to_response', ''), 'CONCERN')
+        
+        key, prompt, context = plan_turn(WELLBEING, message, conversation_history, student_id)
+        remember = partial(finish_turn, key, 'wellbeing', conversation_history, message)
+        
+        tokens = partial(stream_ollama_response, WELLBEING, prompt, context, remember)
+        
+        def events(tokens):
+            for token in recorded_tokens(tokens, session_key, message):
+                yield sse_event({'token': token})
+            
+            # Add concern note once the reply is complete
+            if safety_level == 'CONCERN':
+                yield sse_event({'token': safety_check.get('add_to_response', '')})
+            
+            yield sse_event({'safety_level': safety_level}, event='done')
+        
+        priority = PRIORITY_WELLBEING_CONCERN if safety_level == 'CONCERN' else PRIORITY_WELLBEING
+        try:
+            # Rate limits apply only once a crisis has been ruled out
+            owner = admit_request('wellbeing', student_id, request.remote_addr, request.headers)
+            return coalesced_sse('wellbeing', message, conversation_history, priority, tokens, events, WELLBEING_FALLBACKS,
+                                 owner=owner, student_id=student_id)
+        except RateLimited as limited:
+            return rate_limited_response(limited, WELLBEING_FALLBACKS['rate_limited'], safety_level=safety_level)
+        except SchedulerBusy as busy:
+            return busy_response(busy, WELLBEING_FALLBACKS['busy'], safety_level=safety_level)
+        
+    except Exception as e:
+        logger.error("Error in streaming chat endpoint: %s", e, exc_info=True)
+        return jsonify({
+            'error': 'An error occurred',
+            'response': 'I\'m having some technical difficulties, but I\'m still here for you. If you need immediate support, please talk to a trusted adult or call Kids Helpline at 1800 55 1800.'
+        }), 500
+
+@api.route('/api/chat/custom/stream', methods=['POST'])
+def chat_custom_stream():
+    """Stream a custom chatbot reply as Server-Sent Events"""
+    try:
+        data = request.json
+        message = data.get('message', '')
+        student_id = request_student_id(data)
+        # A registered chatbot_id, or the full chatbot_config for unregistered chatbots
+        chatbot = resolve_chatbot(data)
+        
+        logger.info("Received streaming message for custom chatbot '%s' from student %s: %.50s...", chatbot.label if chatbot else 'Unknown', student_id, message)
+        
+        if not message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        if not chatbot:
+            error, status = missing_chatbot_error(data)
+            return jsonify(error), status
+        
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history(chatbot.name, data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return jsonify(error), status
+        
+        # Per-student and per-IP limits; the owner is who the generation counts against
+        owner = admit_request('custom', student_id, request.remote_addr, request.headers)
+        
+        # Serve repeated opening questions without queueing for a generation
+        cached = cached_reply(chatbot.name, message, conversation_history)
+        if cached is not None:
+            record_session_turn(session_key, message, cached)
+            return cached_sse(cached)
+        
+        key, prompt, context = plan_turn(chatbot, message, conversation_history, student_id)
+        remember = partial(finish_turn, key, chatbot.name, conversation_history, message)
+        fallbacks = chatbot.fallbacks
+        
+        tokens = partial(stream_ollama_response, chatbot, prompt, context, remember)
+        
+        def events(tokens):
+            for token in recorded_tokens(tokens, session_key, message):
+                yield sse_event({'token': token})
+            yield sse_event({}, event='done')
+        
+        return coalesced_sse(chatbot.name, message, conversation_history, PRIORITY_CUSTOM, tokens, events, fallbacks,
+                             owner=owner, student_id=student_id)
+        
+    except SchedulerBusy as busy:
+        return busy_response(busy, CUSTOM_FALLBACKS['busy'])
+    
+    except RateLimited as limited:
+        return rate_limited_response(limited, CUSTOM_FALLBACKS['rate_limited'])
+        
+    except Exception as e:
+        logger.error("Error in custom streaming endpoint: %s", e, exc_info=True)
+        return jsonify({
+            'error': 'An error occurred',
+            'response': 'I apologize, but I encountered a technical issue. Please try asking your question again.'
+        }), 500
+
+def warm_chatbot(chatbot):
+    """Prime Ollama's prompt cache with a newly registered chatbot's prefix, when it's idle"""
+    try:
+        with generation_scheduler.slot(PRIORITY_BACKGROUND):
+            if not ollama_available():
+                return
+            response = ollama.generate(warm_chatbot_payload(chatbot), timeout=60)
+            record_generation_status(response.status_code)
+        logger.info("Warmed prompt prefix for custom chatbot '%s'", chatbot.label)
+    except SchedulerBusy:
+        logger.info("Skipped warming custom chatbot '%s', generation queue busy", chatbot.label)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Could not warm custom chatbot '%s': %s", chatbot.label, e)
+
+SUMMARY_OPTIONS = {
+    "temperature": 0.2,
+    "num_predict": 160
+}
+
+def summarize_history(previous_summary, messages, assistant_label, slot=None):
+    """Fold older messages into a conversation's rolling summary (runs on the summary worker)
+
+    `slot` holds a generation slot around the call, generation_scheduler's
+    by default; async_app.py passes one from its own scheduler.
+    """
+    earlier = f"Summary so far: {previous_summary}\n\n" if previous_summary else ""
+    prompt = (
+        f"Update the summary of a conversation between a student and {assistant_label}. "
+        "In at most 100 words, keep what the student shared about themselves, how they feel, "
+        "what has been discussed and any open questions.\n\n"
+        f"{earlier}New messages:\n{format_history(messages, assistant_label)}\nUpdated summary:"
+    )
+    with (slot or generation_scheduler.slot)(PRIORITY_BACKGROUND):
+        if not ollama_available():
+            return None
+        response = ollama.generate(generation_payload(prompt, SUMMARY_OPTIONS), timeout=60)
+        record_generation_status(response.status_code)
+    if response.status_code != 200:
+        return None
+    return response.json().get('response', '').strip() or None
+
+history_summaries = RollingSummaries(
+    summarize_history,
+    max_conversations=int(os.getenv('HISTORY_SUMMARY_MAX_CONVERSATIONS', '1000')),
+    idle_timeout=float(os.getenv('HISTORY_SUMMARY_IDLE_TIMEOUT', '1800'))
+)
+
+def required_context_tokens():
+    """Estimated tokens of the longest prompt plus reply any persona can send, for sizing OLLAMA_NUM_CTX"""
+    # Room for the student's message and a custom chatbot's personality, which have no length limit
+    allowance = 512
+    summary = SUMMARY_OPTIONS['num_predict']
+    full_prompts = [
+        estimate_tokens(WELLBEING.prefix) + WELLBEING.history_tokens + WELLBEING_OPTIONS['num_predict'],
+        estimate_tokens(HOLDEN.prefix) + HOLDEN.history_tokens + HOLDEN_OPTIONS['num_predict'],
+        estimate_tokens(build_custom_system_prompt({})) + REFERENCE_TOKEN_BUDGET
+        + HISTORY_TOKEN_BUDGETS['custom'] + CUSTOM_OPTIONS['num_predict']
+    ]
+    # A turn continuing a kept context adds to up to CONTEXT_MAX_TOKENS already in it
+    continued = CONTEXT_MAX_TOKENS + REFERENCE_TOKEN_BUDGET + max(
+        WELLBEING_OPTIONS['num_predict'], HOLDEN_OPTIONS['num_predict'], CUSTOM_OPTIONS['num_predict'])
+    return max(max(full_prompts) + summary, continued) + allowance
+
+if required_context_tokens() > OLLAMA_NUM_CTX:
+    logger.warning("OLLAMA_NUM_CTX=%s is smaller than the history, reference and reply budgets need; "
+                   "Ollama will cut long prompts short. Consider OLLAMA_NUM_CTX=%s",
+                   OLLAMA_NUM_CTX, context_size(required_context_tokens()))
+
+@api.route('/api/chatbots', methods=['POST'])
+def register_chatbot():
+    """Register a custom chatbot so chat requests can send its chatbot_id instead of the config"""
+    try:
+        data = request.json or {}
+        chatbot_config = data.get('chatbot_config')
+        
+        if not isinstance(chatbot_config, dict) or not chatbot_config:
+            return jsonify({'error': 'No chatbot configuration provided'}), 400
+        
+        chatbot_id, chatbot, created = chatbot_registry.register(chatbot_config)
+        if created:
+            logger.info("Registered custom chatbot '%s' as %s", chatbot.label, chatbot_id)
+            if CHATBOT_WARM_ON_REGISTER:
+                threading.Thread(target=warm_chatbot, args=(chatbot,), daemon=True).start()
+        
+        return jsonify({'chatbot_id': chatbot_id, 'name': chatbot.label}), 201 if created else 200
+        
+    except Exception as e:
+        logger.error("Error registering custom chatbot: %s", e, exc_info=True)
+        return jsonify({'error': 'An error occurred'}), 500
+
+@api.route('/api/chatbots/<chatbot_id>', methods=['GET', 'DELETE'])
+def registered_chatbot(chatbot_id):
+    """Look up or remove a registered custom chatbot"""
+    if request.method == 'DELETE':
+        if not chatbot_registry.remove(chatbot_id):
+            return jsonify({'error': 'Unknown chatbot_id'}), 404
+        return jsonify({'chatbot_id': chatbot_id, 'removed': True})
     
-    results = {
+    chatbot = chatbot_registry.get(chatbot_id)
+    if chatbot is None:
+        return jsonify({'error': 'Unknown chatbot_id'}), 404
+    return jsonify({'chatbot_id': chatbot_id, 'chatbot_config': chatbot.config})
+
+def batch_messages_error(messages):
+    """Error body and status for a batch evaluation's messages, or None if they're usable"""
+    if not isinstance(messages, list) or not messages:
+        return {'error': 'No messages provided'}, 400
+    if len(messages) > BATCH_MAX_MESSAGES:
+        return {'error': f'At most {BATCH_MAX_MESSAGES} messages per batch', 'max_messages': BATCH_MAX_MESSAGES}, 400
+    if not all(isinstance(message, str) and message.strip() for message in messages):
+        return {'error': 'Every message must be non-empty text'}, 400
+    return None
+
+def evaluation_result(index, message, reply, started, queue_seconds, response_json=None, status=None):
+    """One batch evaluation result: the reply, a safety scan of both sides and timings"""
+    response_json = response_json or {}
+    level, matched = safety_scanner.classify(message)
+    response_level, response_matched = safety_scanner.classify(reply)
+    return {
+        'index': index,
+        'message': message,
+        'response': reply,
+        # 'ok', or why the reply is a fallback message ('fallback', 'busy', 'error')
+        'status': status or ('ok' if response_json.get('response', '').strip() else 'fallback'),
+        'safety_level': level,
+        'safety_matched': matched,
+        'response_safety_level': response_level,
+        'response_safety_matched': response_matched,
+        'queue_seconds': round(queue_seconds, 3),
+        'seconds': round(time.perf_counter() - started, 3),
+        'prompt_tokens': response_json.get('prompt_eval_count'),
+        'tokens': response_json.get('eval_count')
+    }
+
+def evaluation_summary(results, started):
+    """Closing event of a batch evaluation"""
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    return {
+        'count': len(results),
+        'statuses': statuses,
+        'flagged': sorted(result['index'] for result in results
+                          if result['safety_level'] != 'SAFE' or result['response_safety_level'] != 'SAFE'),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+def evaluation_owner(chatbot):
+    """A batch's generations share one fair share, however many messages it has"""
+    return f"evaluate:{chatbot.name}"
+
+def evaluate_message(chatbot, index, message):
+    """Generate a custom chatbot's reply to one batch message as an opening question"""
+    started = time.perf_counter()
+    queue_seconds = 0.0
+    completed = {}
+    try:
+        with generation_scheduler.slot(PRIORITY_CUSTOM, evaluation_owner(chatbot)):
+            queue_seconds = time.perf_counter() - started
+            reply = get_persona_response(chatbot, message, [], use_cache=False, on_complete=completed.update)
+    except SchedulerBusy:
+        return evaluation_result(index, message, chatbot.fallbacks['busy'], started,
+                                 time.perf_counter() - started, status='busy')
+    except Exception as e:
+        logger.error("Error evaluating batch message %s: %s", index, e, exc_info=True)
+        return evaluation_result(index, message, chatbot.fallbacks['error'], started, queue_seconds, status='error')
+    return evaluation_result(index, message, reply, started, queue_seconds, completed)
+
+def evaluation_events(chatbot, messages):
+    """Evaluate messages BATCH_PARALLELISM at a time, yielding each result as it completes"""
+    started = time.perf_counter()
+    results = []
+    pool = ThreadPoolExecutor(max_workers=min(BATCH_PARALLELISM, len(messages)), thread_name_prefix='batch')
+    try:
+        futures = [pool.submit(evaluate_message, chatbot, index, message) for index, message in enumerate(messages)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            yield sse_event(result, event='result')
+        yield sse_event(evaluation_summary(results, started), event='done')
+    finally:
+        # Drop messages not started yet if the teacher disconnects
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@api.route('/api/chatbots/evaluate', methods=['POST'])
+def evaluate_chatbot():
+    """Run a custom chatbot over a list of sample messages, streaming each result as it completes"""
+    try:
+        data = request.json or {}
+        chatbot = resolve_chatbot(data)
+        if not chatbot:
+            error, status = missing_chatbot_error(data)
+            return jsonify(error), status
+        
+        messages = data.get('messages')
+        error = batch_messages_error(messages)
+        if error:
+            return jsonify(error[0]), error[1]
+        
+        if not ollama_available():
+            return jsonify({'error': 'Ollama is not available', 'response': chatbot.fallbacks['unavailable']}), 503
+        
+        # Teachers have no student_id, so batches are limited per IP
+        admit_request('evaluate', None, request.remote_addr, request.headers)
+        
+        logger.info("Evaluating custom chatbot '%s' on %s messages", chatbot.label, len(messages))
+        return sse_response(evaluation_events(chatbot, messages))
+        
+    except RateLimited as limited:
+        return rate_limited_response(limited, CUSTOM_FALLBACKS['rate_limited'])
+        
+    except Exception as e:
+        logger.error("Error in batch evaluation endpoint: %s", e, exc_info=True)
+        return jsonify({'error': 'An error occurred'}), 500
+
+def test_results():
+    """Fields common to every /api/test answer"""
+    return {
         'timestamp': datetime.now().isoformat(),
         'ollama_url': OLLAMA_URL,
+        'ollama_nodes': [node.base_url for node in ollama.nodes],
         'model': MODEL_NAME
     }
+
+def readiness_results():
+    """Readiness from cached node health, /api/tags and /api/ps state, without generating"""
+    results = test_results()
+    results.update(ollama.readiness(MODEL_NAME))
+    results['startup'] = startup.snapshot()['status']
+    if not startup.ready:
+        # Node state is unknown (and counted as up) until the startup check has confirmed Ollama
+        results['ready'] = False
+        results['error'] = 'Starting up: waiting to confirm Ollama and the model'
+    elif results['ollama_status'] == 'disconnected':
+        results['error'] = 'Ollama is not running. Run: ollama serve'
+    elif not results['ready']:
+        results['error'] = f'Model {MODEL_NAME} not available. Run: ollama pull {MODEL_NAME}'
+    return results
+
+def deep_test_requested(args):
+    """/api/test only generates when asked to with ?deep=true"""
+    return args.get('deep', 'false').lower() == 'true'
+
+@api.route('/api/test', methods=['GET'])
+def test_connection():
+    """Readiness from cached Ollama state; ?deep=true also checks each node and generates"""
+    if not deep_test_requested(request.args):
+        results = readiness_results()
+        return jsonify(results), 200 if results['ready'] else 503
+    
+    logger.info("Running connection test...")
+    results = test_results()
     
     # Test Ollama connection
     ollama_running = test_ollama_connection()
@@ -553,57 +1860,102 @@ def test_connection():
         results['error'] = 'Ollama is not running. Run: ollama serve'
         return jsonify(results), 503
     
-    # Test model availability
-    model_working = test_model_availability()
-    results['model_status'] = 'available' if model_working else 'not found'
+    # Test the model with a single short generation
+    test_response = test_model_availability()
+    results['model_status'] = 'available' if test_response else 'not found'
     
-    if not model_working:
+    if not test_response:
         results['ready'] = False
         results['error'] = f'Model {MODEL_NAME} not available. Run: ollama pull {MODEL_NAME}'
         return jsonify(results), 503
     
-    # Try a test generation
-    try:
-        test_response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": MODEL_NAME,
-                "prompt": "Say 'Hello, I'm working!' in a friendly way.",
-                "stream": False
-            },
-            timeout=10
-        )
-        
-        if test_response.status_code == 200:
-            results['test_response'] = test_response.json().get('response', '')[:100]
-            results['ready'] = True
-        else:
-            results['ready'] = False
-            results['error'] = f'Generation failed: {test_response.status_code}'
-            
-    except Exception as e:
-        results['ready'] = False
-        results['error'] = f'Test generation failed: {str(e)}'
-    
+    results['test_response'] = test_response[:100]
+    results['ready'] = True
     return jsonify(results)
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Simple health check endpoint"""
-    return jsonify({
-        'status': 'running',
+def health_status():
+    """Cached Ollama node, scheduler and store state, shared by both serving modes"""
+    return {
+        'status': 'running' if startup.ready else 'starting',
         'timestamp': datetime.now().isoformat(),
-        'model': MODEL_NAME
-    })
+        'model': MODEL_NAME,
+        'startup': startup.snapshot(),
+        'worker': {'pid': os.getpid(), 'shared_state': state_shared()},
+        'ollama': ollama.snapshot(),
+        'conversation_contexts': conversation_contexts.stats(),
+        'conversation_store': conversation_store.stats(),
+        'scheduler': generation_scheduler.stats(),
+        'response_cache': response_cache.stats(),
+        'reference_indexes': reference_indexes.stats(),
+        'chatbot_registry': chatbot_registry.stats(),
+        'history_summaries': history_summaries.stats(),
+        'safety_alerts': alert_writer.stats(),
+        'coalescing': in_flight.stats(),
+        'rate_limits': dict(rate_limiter.stats(), enabled=RATE_LIMIT_ENABLED),
+        'prefix_reuse': prefix_reuse.stats(),
+        'abandoned_generations': abandoned_generations.stats(),
+        'generation_budget': dict(generation_budget.snapshot(), enabled=GENERATION_BUDGET_ENABLED,
+                                  num_ctx=OLLAMA_NUM_CTX),
+        'logging': request_logs.stats()
+    }
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, safety and Ollama timing metrics in the Prometheus text format, summed over the workers"""
+    return Response(metrics.render(other_workers_metrics()), content_type=METRICS_CONTENT_TYPE)
+
+def log_request(endpoint, method, status, seconds):
+    """One structured access log record per request, once its response (or stream) has been sent"""
+    if logger.isEnabledFor(logging.INFO):
+        duration_ms = round(seconds * 1000, 1)
+        logger.info("%s %s %s in %sms", method, endpoint, status, duration_ms,
+                    extra={'endpoint': endpoint, 'method': method, 'status': status, 'duration_ms': duration_ms})
+
+def start_deadline(path, headers, connection=None):
+    """Set a chat request's deadline from its X-Request-Timeout header, or REQUEST_TIMEOUT; other requests get none"""
+    if not path.startswith('/api/chat/'):
+        return set_deadline(None)
+    seconds = parse_timeout(headers.get(DEADLINE_HEADER), REQUEST_TIMEOUT, REQUEST_TIMEOUT_MAX)
+    return set_deadline(Deadline(seconds, connection))
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request_logs.start_request(request.headers.get('X-Request-ID'))
+    connection = next((request.environ[key] for key in CLIENT_SOCKET_KEYS if key in request.environ), None)
+    start_deadline(request.path, request.headers, connection)
+
+@api.after_app_request
+def record_request_metrics(response):
+    """Count the request and time it once the response (or stream) has been sent"""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    started = g.get('request_started', time.perf_counter())
+    
+    def observe():
+        seconds = time.perf_counter() - started
+        http_requests.inc(endpoint, method, str(response.status_code))
+        http_latency.observe(seconds, endpoint)
+        log_request(endpoint, method, response.status_code, seconds)
+    
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    response.call_on_close(observe)
+    return response
+
+@api.route('/api/health', methods=['GET'])
+def health_check():
+    """Simple health check endpoint with cached Ollama and circuit breaker state"""
+    return jsonify(health_status())
 
 def startup_check():
-    """Run comprehensive startup checks"""
+    """Check Ollama and the model, printing what to fix if either is missing"""
     print("\n" + "=" * 60)
     print("WELLBEING CHATBOT STARTUP CHECK")
     print("=" * 60)
     
     print(f"Configuration:")
-    print(f"  Ollama URL: {OLLAMA_URL}")
+    for node in ollama.nodes:
+        print(f"  Ollama node: {node.base_url}")
     print(f"  Model: {MODEL_NAME}")
     print("-" * 60)
     
@@ -612,43 +1964,65 @@ def startup_check():
     if not test_ollama_connection():
         print("\nFAILED: Ollama is not running")
         print("   Solution: Run 'ollama serve' in a terminal")
+        print(f"   The API stays up and reports not-ready; retrying in {STARTUP_RETRY_INTERVAL:g}s")
         return False
     
-    # Check model
+    # Check the model is installed from /api/tags; probing also starts the warm-up
     print(f"Checking model {MODEL_NAME}...")
-    if not test_model_availability():
+    ollama.check()
+    if not ollama.readiness(MODEL_NAME)['ready']:
         print(f"\nFAILED: Model {MODEL_NAME} is not available")
         print(f"   Solution: Run 'ollama pull {MODEL_NAME}'")
+        print(f"   The API stays up and reports not-ready; retrying in {STARTUP_RETRY_INTERVAL:g}s")
         return False
+    if OLLAMA_WARM_UP:
+        print(f"Loading {MODEL_NAME} in the background (keep_alive {OLLAMA_KEEP_ALIVE})")
     
     print("-" * 60)
-    print("ALL SYSTEMS READY")
-    print(f"Server will run on http://localhost:5000")
-    print(f"Test endpoint: http://localhost:5000/api/test")
+    print(f"ALL SYSTEMS READY (pid {os.getpid()})")
+    print(f"Test endpoint: /api/test")
     print("=" * 60 + "\n")
     return True
 
+# Startup checks run in the background so the server takes requests at once;
+# /api/test and /api/health report not-ready until Ollama and the model are confirmed
+STARTUP_RETRY_INTERVAL = float(os.getenv('STARTUP_RETRY_INTERVAL', '10'))
+startup = StartupCheck(startup_check, retry_interval=STARTUP_RETRY_INTERVAL)
+
+# Under serve.py each worker publishes its metrics so whichever answers /api/metrics can sum them
+metrics_publisher = MetricsPublisher(metrics, interval=float(os.getenv('METRICS_PUBLISH_INTERVAL', '5')))
+
+def start_background():
+    """Start a serving process's background work: node health probes, the startup check and metrics publishing"""
+    # Keep the cached Ollama node health and models fresh in the background
+    ollama.start()
+    startup.start()
+    metrics_publisher.start()
+
+def create_app(start=True):
+    """Build the Flask app; unless start is False, also start its background work"""
+    flask_app = Flask(__name__)
+    CORS(flask_app, origins=cors_origins)
+    flask_app.register_blueprint(api)
+    if start:
+        start_background()
+    return flask_app
+
 if __name__ == '__main__':
     # Create logs directory if it doesn't exist
-    safety_log_dir = os.getenv('SAFETY_LOG_DIR', 'wellbeing_logs')
-    if not os.path.exists(safety_log_dir):
-        os.makedirs(safety_log_dir)
-    
-    # Run startup checks
-    if startup_check():
-        # Get configuration from environment
-        debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
-        host = os.getenv('HOST', '127.0.0.1')
-        port = int(os.getenv('PORT', '5000'))
-        
-        logger.info(f"Starting Wellbeing Support API server...")
-        logger.info(f"Debug mode: {debug_mode}")
-        logger.info(f"Host: {host}")
-        logger.info(f"Port: {port}")
-        logger.info(f"CORS origins: {cors_origins}")
-        
-        app.run(debug=debug_mode, host=host, port=port)
-    else:
-        print("\nPlease fix the issues above and try again")
-        print("After fixing, run: python app.py")
-        sys.exit(1)
\ No newline at end of file
+    os.makedirs(SAFETY_LOG_DIR, exist_ok=True)
+    # Exit normally on SIGTERM so queued safety alerts are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    # Get configuration from environment
+    debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+    host = os.getenv('HOST', '127.0.0.1')
+    port = int(os.getenv('PORT', '5000'))
+    
+    logger.info("Starting Wellbeing Support API server (development server; use serve.py in production)...")
+    logger.info("Debug mode: %s", debug_mode)
+    logger.info("Host: %s", host)
+    logger.info("Port: %s", port)
+    logger.info("CORS origins: %s", cors_origins)
+    
+    create_app().run(debug=debug_mode, host=host, port=port)
@@ -0,0 +1,922 @@
+"""
+Asyncio serving mode for the chat API.
+
+Serves the same routes as app.py on aiohttp and talks to Ollama through an
+async HTTP client, so a student waiting on a slow generation costs a
+coroutine instead of a whole thread. Prompts, safety checks, the circuit
+breaker and the conversation context store are shared with app.py, which
+remains the default (sync) serving mode.
+
+Run: python async_app.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from functools import partial
+
+import aiohttp
+from aiohttp import web
+
+from app import (
+    BATCH_PARALLELISM, CHATBOT_WARM_ON_REGISTER, COALESCE_PERSONAS, CUSTOM_FALLBACKS,
+    GENERATION_MAX_CONCURRENT, GENERATION_QUEUE_SIZE, GENERATION_QUEUE_TIMEOUT, HOLDEN,
+    HOLDEN_FALLBACKS, METRICS_CONTENT_TYPE, MODEL_NAME, OLLAMA_KEEP_ALIVE, OLLAMA_TIMEOUT,
+    SAFETY_LOG_DIR, WELLBEING, WELLBEING_FALLBACKS, admit_request, batch_messages_error,
+    cached_reply, chat_history, chatbot_registry, check_message_safety, claim_generation,
+    cors_origins, deep_test_requested, evaluation_owner, evaluation_result, evaluation_summary,
+    finish_turn, generation_options, generation_payload, health_status, history_summaries,
+    http_latency, http_requests, log_if_concerning, log_request, metrics, missing_chatbot_error,
+    observe_generation, ollama, ollama_available, ollama_read_timeout, plan_turn, readiness_results,
+    record_abandoned, record_generation_error, record_generation_status, record_session_turn,
+    record_skipped, request_logs, request_student_id, resolve_chatbot, sse_event, start_background,
+    start_deadline, summarize_history, test_results, unknown_session_error, warm_chatbot_payload
+)
+from deadlines import current_deadline, deadline_scope, time_left
+from ollama_pool import NoOllamaNode
+from rate_limiter import RateLimited
+from single_flight import AsyncFlight, SingleFlight
+from generation_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_CUSTOM, PRIORITY_HOLDEN, PRIORITY_WELLBEING,
+    PRIORITY_WELLBEING_CONCERN, AsyncGenerationScheduler, SchedulerBusy
+)
+
+logger = logging.getLogger(__name__)
+
+# Connections to Ollama; extra requests wait cheaply for a free connection
+ASYNC_OLLAMA_MAX_CONNECTIONS = int(os.getenv('ASYNC_OLLAMA_MAX_CONNECTIONS', '100'))
+# Pending TCP connections the listening socket will queue
+ASYNC_LISTEN_BACKLOG = int(os.getenv('ASYNC_LISTEN_BACKLOG', '2048'))
+
+OLLAMA_SESSION = web.AppKey('ollama_session', aiohttp.ClientSession)
+
+# Same limits as the sync app's scheduler, but waiting costs a future, not a thread
+generation_scheduler = AsyncGenerationScheduler(
+    max_concurrent=GENERATION_MAX_CONCURRENT,
+    max_queue=GENERATION_QUEUE_SIZE,
+    max_wait=GENERATION_QUEUE_TIMEOUT
+)
+
+# Same coalescing as the sync app, with flights shared between tasks
+in_flight = SingleFlight(COALESCE_PERSONAS, AsyncFlight)
+
+# Fire-and-forget work such as prompt warming
+background_tasks = set()
+
+
+def threadsafe_slot(loop):
+    """generation_scheduler.slot for code on another thread (the history summary worker)"""
+    @contextmanager
+    def slot(priority, owner=None, timeout=None):
+        asyncio.run_coroutine_threadsafe(generation_scheduler.acquire(priority, owner, timeout), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(generation_scheduler.release)
+
+    return slot
+
+
+def ollama_timeout(read_timeout, deadline=None):
+    """Per-call timeout matching the sync client's (connect, read) semantics, ending at `deadline`"""
+    total = deadline.remaining() if deadline is not None else None
+    return aiohttp.ClientTimeout(total=total, sock_connect=2, sock_read=read_timeout)
+
+
+def ollama_node(deadline=None):
+    """Hold the least-loaded healthy Ollama node serving the model for one request"""
+    # A timeout cut short by the request's deadline isn't the node's fault
+    cut_short = deadline is not None and deadline.remaining() < OLLAMA_TIMEOUT
+    return ollama.lease(MODEL_NAME, connection_errors=(aiohttp.ClientConnectionError,),
+                        expected_errors=(asyncio.TimeoutError,) if cut_short else ())
+
+
+async def generate_reply(session, persona, prompt, context=None, on_complete=None):
+    """Async counterpart of get_persona_response in app.py.
+
+    The student disconnecting cancels the task, which closes the upstream
+    connection; the deadline ends the call through its timeout.
+    """
+    fallbacks = persona.fallbacks
+    if not ollama_available():
+        return fallbacks['unavailable']
+    deadline = current_deadline()
+    if deadline is not None and deadline.expired():
+        record_skipped(persona, 'deadline')
+        return fallbacks['timeout']
+
+    started = time.perf_counter()
+    try:
+        with ollama_node(deadline) as node:
+            async with session.post(
+                node.url('/api/generate'),
+                json=generation_payload(prompt, generation_options(persona, generation_scheduler), context),
+                timeout=ollama_timeout(ollama_read_timeout(deadline), deadline)
+            ) as response:
+                logger.debug("Ollama response status: %s", response.status)
+                record_generation_status(response.status)
+
+                if response.status == 200:
+                    response_json = await response.json()
+                    # Only a reply read in full counts as the node's success
+                    node.record_status(response.status)
+                    ai_response = response_json.get('response', '')
+                    observe_generation(persona, response_json, continued=context is not None)
+                    if on_complete:
+                        on_complete(response_json)
+
+                    if ai_response:
+                        return ai_response.strip()
+                    logger.error("Empty response from Ollama")
+                    return fallbacks['empty']
+
+                node.record_status(response.status)
+                logger.error("Ollama API error: %s - %.500s", response.status, await response.text())
+                return fallbacks['api_error']
+
+    except asyncio.CancelledError:
+        # The student disconnected, or everyone sharing the generation did
+        record_abandoned(persona, 'disconnected', started)
+        raise
+
+    except asyncio.TimeoutError as e:
+        if deadline is not None and deadline.expired():
+            record_abandoned(persona, 'deadline', started)
+        else:
+            logger.error("Ollama request timed out")
+            record_generation_error(e, timed_out=True)
+        return fallbacks['timeout']
+
+    except (aiohttp.ClientConnectionError, NoOllamaNode) as e:
+        logger.error("Could not connect to Ollama server")
+        record_generation_error(e, connection_lost=True)
+        return fallbacks['connection']
+
+    except Exception as e:
+        logger.error("Unexpected error getting Ollama response: %s", e)
+        record_generation_error(e)
+        return fallbacks['error']
+
+
+def stream_reply(session, persona, prompt, context=None, on_complete=None):
+    """Async counterpart of stream_ollama_response in app.py"""
+    return ollama_tokens(session, persona, prompt, context, on_complete, current_deadline(),
+                         generation_options(persona, generation_scheduler))
+
+
+async def ollama_tokens(session, persona, prompt, context, on_complete, deadline, options):
+    """The async generator behind stream_reply"""
+    fallbacks = persona.fallbacks
+    if not ollama_available():
+        yield fallbacks['unavailable']
+        return
+    if deadline is not None and deadline.expired():
+        record_skipped(persona, 'deadline')
+        yield fallbacks['timeout']
+        return
+
+    started = time.perf_counter()
+    produced = False
+    generating = False
+    try:
+        with ollama_node(deadline) as node:
+            async with session.post(
+                node.url('/api/generate'),
+                json=generation_payload(prompt, options, context, stream=True),
+                timeout=ollama_timeout(ollama_read_timeout(deadline), deadline)
+            ) as response:
+                record_generation_status(response.status)
+
+                if response.status != 200:
+                    node.record_status(response.status)
+                    logger.error("Ollama API error: %s - %.500s", response.status, await response.text())
+                    yield fallbacks['api_error']
+                    return
+
+                generating = True
+                reply = []
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise RuntimeError(chunk['error'])
+                    token = chunk.get('response', '')
+                    reply.append(token)
+                    if token:
+                        # Drop leading whitespace like the non-streaming path's strip()
+                        if not produced:
+                            token = token.lstrip()
+                        if token:
+                            produced = True
+                            yield token
+                    if chunk.get('done'):
+                        # Errors and stalls mid-stream count against the node through the lease
+                        node.record_status(response.status)
+                        observe_generation(persona, chunk, continued=context is not None)
+                        if on_complete:
+                            on_complete(dict(chunk, response=''.join(reply)))
+                        break
+                generating = False
+
+        if not produced:
+            logger.error("Empty response from Ollama")
+            yield fallbacks['empty']
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # The student disconnected (or everyone sharing the stream did)
+        if generating:
+            record_abandoned(persona, 'disconnected', started)
+        raise
+
+    except asyncio.TimeoutError as e:
+        if deadline is not None and deadline.expired():
+            record_abandoned(persona, 'deadline', started)
+            if not produced:
+                yield fallbacks['timeout']
+        else:
+            logger.error("Ollama streaming request timed out")
+            record_generation_error(e, timed_out=True)
+            yield fallbacks['timeout']
+
+    except (aiohttp.ClientConnectionError, NoOllamaNode) as e:
+        logger.error("Could not connect to Ollama server")
+        record_generation_error(e, connection_lost=True)
+        yield fallbacks['connection']
+
+    except Exception as e:
+        logger.error("Unexpected error streaming Ollama response: %s", e)
+        record_generation_error(e)
+        yield fallbacks['error']
+
+
+async def recorded_tokens(tokens, session_key, message):
+    """Async counterpart of recorded_tokens in app.py"""
+    reply = []
+    try:
+        async for token in tokens:
+            reply.append(token)
+            yield token
+    finally:
+        # Also runs if the student disconnects, keeping the part they saw
+        record_session_turn(session_key, message, ''.join(reply))
+
+
+async def sse_response(request, events):
+    """Write an async event generator to the client as Server-Sent Events"""
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    try:
+        async for event in events:
+            await response.write(event.encode('utf-8'))
+    finally:
+        # Close the generators now, not when collected, if the student disconnected
+        await events.aclose()
+    await response.write_eof()
+    return response
+
+
+async def scheduled_call(priority, generate, owner=None, deadline=None):
+    """Async counterpart of scheduled_call in app.py"""
+    with deadline_scope(deadline):
+        async with generation_scheduler.slot(priority, owner, time_left()):
+            reply = await generate()
+    yield reply
+
+
+async def coalesced_reply(persona, message, conversation_history, priority, generate, owner=None, student_id=None):
+    """Async counterpart of coalesced_reply in app.py"""
+    subscription = claim_generation(in_flight, persona, message, conversation_history, student_id)
+    if subscription is None:
+        async with generation_scheduler.slot(priority, owner, time_left()):
+            return await generate()
+    if subscription.leader:
+        subscription.start(scheduled_call(priority, generate, owner, current_deadline()))
+    try:
+        async for reply in subscription:
+            return reply
+    finally:
+        await subscription.aclose()
+
+
+async def shared_tokens(subscription, fallbacks):
+    """Async counterpart of shared_tokens in app.py"""
+    try:
+        async for token in subscription:
+            yield token
+    except SchedulerBusy:
+        yield fallbacks['busy']
+    except Exception as e:
+        logger.error("Shared generation failed: %s", e)
+        yield fallbacks['error']
+    finally:
+        await subscription.aclose()
+
+
+async def coalesced_sse(request, persona, message, conversation_history, priority, tokens, events, fallbacks,
+                        owner=None, student_id=None):
+    """Async counterpart of coalesced_sse in app.py"""
+    subscription = claim_generation(in_flight, persona, message, conversation_history, student_id)
+    if subscription is None:
+        async with generation_scheduler.slot(priority, owner, time_left()):
+            return await sse_response(request, events(tokens()))
+    if subscription.leader:
+        try:
+            await generation_scheduler.acquire(priority, owner, time_left())
+        except SchedulerBusy as busy:
+            subscription.fail(busy)
+            await subscription.aclose()
+            raise
+        except asyncio.CancelledError:
+            # The leader's student left while queued; anyone sharing the flight gets a fallback
+            subscription.fail(RuntimeError("Shared generation abandoned before it started"))
+            await subscription.aclose()
+            raise
+        subscription.start(tokens(), on_close=generation_scheduler.release)
+    return await sse_response(request, events(shared_tokens(subscription, fallbacks)))
+
+
+async def cached_response(request, text):
+    """Answer from the response cache, as JSON or a single-token stream"""
+    if request.path.endswith('/stream'):
+        async def events():
+            yield sse_event({'token': text})
+            yield sse_event({}, event='done')
+
+        return await sse_response(request, events())
+    return web.json_response({'response': text})
+
+
+async def read_chat_request(request):
+    data = await request.json()
+    return data, data.get('message', ''), request_student_id(data)
+
+
+def error_response(response_text):
+    return web.json_response({'error': 'An error occurred', 'response': response_text}, status=500)
+
+
+def busy_response(busy, message, **extra):
+    """429 reply for a generation the scheduler couldn't admit in time"""
+    logger.warning("Generation queue busy (%s), queue depth %s", busy.reason, busy.queue_depth)
+    return web.json_response(
+        {
+            'error': 'busy',
+            'response': message,
+            'queue_depth': busy.queue_depth,
+            'retry_after': busy.retry_after,
+            **extra
+        },
+        status=429,
+        headers={'Retry-After': str(busy.retry_after)}
+    )
+
+
+def rate_limited_response(limited, message, **extra):
+    """429 reply for a request over its student's or IP's rate limit"""
+    logger.warning("Rate limited %s request (%s limit), retry in %ss", limited.endpoint, limited.scope, limited.retry_after)
+    return web.json_response(
+        {
+            'error': 'rate_limited',
+            'response': message,
+            'limit': limited.scope,
+            'retry_after': limited.retry_after,
+            **extra
+        },
+        status=429,
+        headers={'Retry-After': str(limited.retry_after)}
+    )
+
+
+async def chat_holden(request):
+    """Handle Holden Caulfield chat messages"""
+    try:
+        data, message, student_id = await read_chat_request(request)
+        logger.info("Received message for Holden from student %s: %.50s...", student_id, message)
+
+        if not message:
+            return web.json_response({'error': 'No message provided'}, status=400)
+
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history('holden', data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return web.json_response(error, status=status)
+
+        # Per-student and per-IP limits; the owner is who the generation counts against
+        owner = admit_request('holden', student_id, request.remote, request.headers)
+
+        # Serve repeated opening questions without queueing for a generation
+        cached = cached_reply('holden', message, conversation_history)
+        if cached is not None:
+            record_session_turn(session_key, message, cached)
+            return await cached_response(request, cached)
+
+        key, prompt, context = plan_turn(HOLDEN, message, conversation_history, student_id)
+        remember = partial(finish_turn, key, 'holden', conversation_history, message)
+        session = request.app[OLLAMA_SESSION]
+
+        if request.path.endswith('/stream'):
+            tokens = partial(stream_reply, session, HOLDEN, prompt, context, remember)
+
+            async def events(tokens):
+                async for token in recorded_tokens(tokens, session_key, message):
+                    yield sse_event({'token': token})
+                yield sse_event({}, event='done')
+
+            return await coalesced_sse(request, 'holden', message, conversation_history, PRIORITY_HOLDEN,
+                                       tokens, events, HOLDEN_FALLBACKS, owner, student_id)
+
+        holden_response = await coalesced_reply(
+            'holden', message, conversation_history, PRIORITY_HOLDEN,
+            partial(generate_reply, session, HOLDEN, prompt, context, remember),
+            owner, student_id
+        )
+        record_session_turn(session_key, message, holden_response)
+        return web.json_response({'response': holden_response})
+
+    except SchedulerBusy as busy:
+        return busy_response(busy, HOLDEN_FALLBACKS['busy'])
+
+    except RateLimited as limited:
+        return rate_limited_response(limited, HOLDEN_FALLBACKS['rate_limited'])
+
+    except Exception as e:
+        logger.error("Error in Holden chat endpoint: %s", e, exc_info=True)
+        return error_response('Goddam it, something went wrong. This whole computer thing really kills me. Try asking your question again.')
+
+
+async def chat_wellbeing(request):
+    """Handle wellbeing chat messages"""
+    try:
+        data, message, student_id = await read_chat_request(request)
+        logger.info("Received message from student %s: %.50s...", student_id, message)
+
+        if not message:
+            return web.json_response({'error': 'No message provided'}, status=400)
+
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history('wellbeing', data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return web.json_response(error, status=status)
+
+        streaming = request.path.endswith('/stream')
+
+        # Check message safety
+        safety_check = check_message_safety(message)
+        safety_level = safety_check['level']
+
+        # If crisis detected, return crisis response immediately
+        if safety_level == 'CRISIS':
+            log_if_concerning(student_id, message, safety_check['response'], 'CRISIS')
+            record_session_turn(session_key, message, safety_check['response'])
+            if streaming:
+                async def crisis_events():
+                    yield sse_event({'token': safety_check['response']})
+                    yield sse_event({'safety_level': 'CRISIS'}, event='done')
+
+                return await sse_response(request, crisis_events())
+
+            return web.json_response({'response': safety_check['response'], 'safety_level': 'CRISIS'})
+
+        concern_note = safety_check.get('add_to_response', '')
+        key, prompt, context = plan_turn(WELLBEING, message, conversation_history, student_id)
+        remember = partial(finish_turn, key, 'wellbeing', conversation_history, message)
+        session = request.app[OLLAMA_SESSION]
+
+        # Log streamed concerns up front so an abandoned stream can't skip the alert
+        if streaming and safety_level == 'CONCERN':
+            log_if_concerning(student_id, message, concern_note, 'CONCERN')
+
+        # Students showing concern jump the generation queue
+        priority = PRIORITY_WELLBEING_CONCERN if safety_level == 'CONCERN' else PRIORITY_WELLBEING
+        try:
+            # Rate limits apply only once a crisis has been ruled out
+            owner = admit_request('wellbeing', student_id, request.remote, request.headers)
+            if streaming:
+                tokens = partial(stream_reply, session, WELLBEING, prompt, context, remember)
+
+                async def events(tokens):
+                    async for token in recorded_tokens(tokens, session_key, message):
+                        yield sse_event({'token': token})
+                    if safety_level == 'CONCERN':
+                        yield sse_event({'token': concern_note})
+                    yield sse_event({'safety_level': safety_level}, event='done')
+
+                return await coalesced_sse(request, 'wellbeing', message, conversation_history, priority,
+                                           tokens, events, WELLBEING_FALLBACKS, owner, student_id)
+
+            # Serve repeated opening questions without queueing for a generation
+            ai_response = cached_reply('wellbeing', message, conversation_history)
+            if ai_response is None:
+                ai_response = await coalesced_reply(
+                    'wellbeing', message, conversation_history, priority,
+                    partial(generate_reply, session, WELLBEING, prompt, context,
+                            partial(finish_turn, key, 'wellbeing', conversation_history, message)),
+                    owner, student_id
+                )
+        except RateLimited as limited:
+            if safety_level == 'CONCERN' and not streaming:
+                log_if_concerning(student_id, message, WELLBEING_FALLBACKS['rate_limited'], 'CONCERN')
+            return rate_limited_response(limited, WELLBEING_FALLBACKS['rate_limited'], safety_level=safety_level)
+        except SchedulerBusy as busy:
+            if safety_level == 'CONCERN' and not streaming:
+                log_if_concerning(student_id, message, WELLBEING_FALLBACKS['busy'], 'CONCERN')
+            return busy_response(busy, WELLBEING_FALLBACKS['busy'], safety_level=safety_level)
+        except asyncio.CancelledError:
+            # The student left before the reply; counselors still hear about the concern
+            if safety_level == 'CONCERN' and not streaming:
+                log_if_concerning(student_id, message, concern_note, 'CONCERN')
+            raise
+        record_session_turn(session_key, message, ai_response)
+
+        # Add concern note if needed
+        if safety_level == 'CONCERN':
+            ai_response += concern_note
+            log_if_concerning(student_id, message, ai_response, 'CONCERN')
+
+        return web.json_response({'response': ai_response, 'safety_level': safety_level})
+
+    except Exception as e:
+        logger.error("Error in chat endpoint: %s", e, exc_info=True)
+        return error_response('I\'m having some technical difficulties, but I\'m still here for you. If you need immediate support, please talk to a trusted adult or call Kids Helpline at 1800 55 1800.')
+
+
+async def chat_custom(request):
+    """Handle custom chatbot chat messages"""
+    try:
+        data, message, student_id = await read_chat_request(request)
+        # A registered chatbot_id, or the full chatbot_config for unregistered chatbots
+        chatbot = resolve_chatbot(data)
+        logger.info("Received message for custom chatbot '%s' from student %s: %.50s...", chatbot.label if chatbot else 'Unknown', student_id, message)
+
+        if not message:
+            return web.json_response({'error': 'No message provided'}, status=400)
+
+        if not chatbot:
+            error, status = missing_chatbot_error(data)
+            return web.json_response(error, status=status)
+
+        persona = chatbot.name
+        # The client's history, or the stored one in session mode
+        session_key, conversation_history = chat_history(persona, data, student_id)
+        if conversation_history is None:
+            error, status = unknown_session_error(data)
+            return web.json_response(error, status=status)
+
+        # Per-student and per-IP limits; the owner is who the generation counts against
+        owner = admit_request('custom', student_id, request.remote, request.headers)
+
+        # Serve repeated opening questions without queueing for a generation
+        cached = cached_reply(persona, message, conversation_history)
+        if cached is not None:
+            record_session_turn(session_key, message, cached)
+            return await cached_response(request, cached)
+
+        key, prompt, context = plan_turn(chatbot, message, conversation_history, student_id)
+        remember = partial(finish_turn, key, persona, conversation_history, message)
+        fallbacks = chatbot.fallbacks
+        session = request.app[OLLAMA_SESSION]
+
+        if request.path.endswith('/stream'):
+            tokens = partial(stream_reply, session, chatbot, prompt, context, remember)
+
+            async def events(tokens):
+                async for token in recorded_tokens(tokens, session_key, message):
+                    yield sse_event({'token': token})
+                yield sse_event({}, event='done')
+
+            return await coalesced_sse(request, persona, message, conversation_history, PRIORITY_CUSTOM,
+                                       tokens, events, fallbacks, owner, student_id)
+
+        custom_response = await coalesced_reply(
+            persona, message, conversation_history, PRIORITY_CUSTOM,
+            partial(generate_reply, session, chatbot, prompt, context, remember),
+            owner, student_id
+        )
+        record_session_turn(session_key, message, custom_response)
+        return web.json_response({'response': custom_response})
+
+    except SchedulerBusy as busy:
+        return busy_response(busy, CUSTOM_FALLBACKS['busy'])
+
+    except RateLimited as limited:
+        return rate_limited_response(limited, CUSTOM_FALLBACKS['rate_limited'])
+
+    except Exception as e:
+        logger.error("Error in custom chat endpoint: %s", e, exc_info=True)
+        return error_response('I apologize, but I encountered a technical issue. Please try asking your question again.')
+
+
+async def warm_chatbot(session, chatbot):
+    """Prime Ollama's prompt cache with a newly registered chatbot's prefix, when it's idle"""
+    try:
+        async with generation_scheduler.slot(PRIORITY_BACKGROUND):
+            if not ollama_available():
+                return
+            with ollama_node() as node:
+                async with session.post(
+                    node.url('/api/generate'),
+                    json=warm_chatbot_payload(chatbot),
+                    timeout=ollama_timeout(60)
+                ) as response:
+                    await response.read()
+                    node.record_status(response.status)
+                    record_generation_status(response.status)
+        logger.info("Warmed prompt prefix for custom chatbot '%s'", chatbot.label)
+    except SchedulerBusy:
+        logger.info("Skipped warming custom chatbot '%s', generation queue busy", chatbot.label)
+    except (aiohttp.ClientError, asyncio.TimeoutError, NoOllamaNode) as e:
+        logger.warning("Could not warm custom chatbot '%s': %s", chatbot.label, e)
+
+
+async def register_chatbot(request):
+    """Register a custom chatbot so chat requests can send its chatbot_id instead of the config"""
+    try:
+        data = await request.json()
+        chatbot_config = data.get('chatbot_config')
+
+        if not isinstance(chatbot_config, dict) or not chatbot_config:
+            return web.json_response({'error': 'No chatbot configuration provided'}, status=400)
+
+        chatbot_id, chatbot, created = chatbot_registry.register(chatbot_config)
+        if created:
+            logger.info("Registered custom chatbot '%s' as %s", chatbot.label, chatbot_id)
+            if CHATBOT_WARM_ON_REGISTER:
+                task = asyncio.create_task(warm_chatbot(request.app[OLLAMA_SESSION], chatbot))
+                # Hold a reference so the task isn't garbage collected mid-flight
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+        return web.json_response({'chatbot_id': chatbot_id, 'name': chatbot.label}, status=201 if created else 200)
+
+    except Exception as e:
+        logger.error("Error registering custom chatbot: %s", e, exc_info=True)
+        return web.json_response({'error': 'An error occurred'}, status=500)
+
+
+async def registered_chatbot(request):
+    """Look up or remove a registered custom chatbot"""
+    chatbot_id = request.match_info['chatbot_id']
+    if request.method == 'DELETE':
+        if not chatbot_registry.remove(chatbot_id):
+            return web.json_response({'error': 'Unknown chatbot_id'}, status=404)
+        return web.json_response({'chatbot_id': chatbot_id, 'removed': True})
+
+    chatbot = chatbot_registry.get(chatbot_id)
+    if chatbot is None:
+        return web.json_response({'error': 'Unknown chatbot_id'}, status=404)
+    return web.json_response({'chatbot_id': chatbot_id, 'chatbot_config': chatbot.config})
+
+
+async def evaluate_message(session, chatbot, index, message):
+    """Async counterpart of evaluate_message in app.py"""
+    started = time.perf_counter()
+    queue_seconds = 0.0
+    completed = {}
+    try:
+        async with generation_scheduler.slot(PRIORITY_CUSTOM, evaluation_owner(chatbot)):
+            queue_seconds = time.perf_counter() - started
+            _, prompt, context = plan_turn(chatbot, message, [])
+            reply = await generate_reply(session, chatbot, prompt, context, completed.update)
+    except SchedulerBusy:
+        return evaluation_result(index, message, chatbot.fallbacks['busy'], started,
+                                 time.perf_counter() - started, status='busy')
+    except Exception as e:
+        logger.error("Error evaluating batch message %s: %s", index, e, exc_info=True)
+        return evaluation_result(index, message, chatbot.fallbacks['error'], started, queue_seconds, status='error')
+    return evaluation_result(index, message, reply, started, queue_seconds, completed)
+
+
+async def evaluation_events(session, chatbot, messages):
+    """Async counterpart of evaluation_events in app.py"""
+    started = time.perf_counter()
+    results = []
+    running = asyncio.Semaphore(BATCH_PARALLELISM)
+
+    async def evaluate(index, message):
+        async with running:
+            return await evaluate_message(session, chatbot, index, message)
+
+    tasks = [asyncio.ensure_future(evaluate(index, message)) for index, message in enumerate(messages)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            results.append(result)
+            yield sse_event(result, event='result')
+        yield sse_event(evaluation_summary(results, started), event='done')
+    finally:
+        # Stop the remaining generations if the teacher disconnects
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def evaluate_chatbot(request):
+    """Run a custom chatbot over a list of sample messages, streaming each result as it completes"""
+    try:
+        data = await request.json()
+        chatbot = resolve_chatbot(data)
+        if not chatbot:
+            error, status = missing_chatbot_error(data)
+            return web.json_response(error, status=status)
+
+        messages = data.get('messages')
+        error = batch_messages_error(messages)
+        if error:
+            return web.json_response(error[0], status=error[1])
+
+        if not ollama_available():
+            return web.json_response({'error': 'Ollama is not available',
+                                      'response': chatbot.fallbacks['unavailable']}, status=503)
+
+        # Teachers have no student_id, so batches are limited per IP
+        admit_request('evaluate', None, request.remote, request.headers)
+
+        logger.info("Evaluating custom chatbot '%s' on %s messages", chatbot.label, len(messages))
+        return await sse_response(request, evaluation_events(request.app[OLLAMA_SESSION], chatbot, messages))
+
+    except RateLimited as limited:
+        return rate_limited_response(limited, CUSTOM_FALLBACKS['rate_limited'])
+
+    except Exception as e:
+        logger.error("Error in batch evaluation endpoint: %s", e, exc_info=True)
+        return web.json_response({'error': 'An error occurred'}, status=500)
+
+
+async def test_connection(request):
+    """Readiness from cached Ollama state; ?deep=true also checks each node and generates"""
+    if not deep_test_requested(request.query):
+        results = readiness_results()
+        return web.json_response(results, status=200 if results['ready'] else 503)
+
+    logger.info("Running connection test...")
+    session = request.app[OLLAMA_SESSION]
+    results = test_results()
+
+    # Test Ollama connection on every node
+    ollama_running = False
+    for node in ollama.nodes:
+        try:
+            async with session.get(node.url(), timeout=ollama_timeout(2)) as response:
+                if response.status == 200 and "Ollama is running" in await response.text():
+                    ollama_running = True
+        except Exception as e:
+            logger.error("Error checking Ollama at %s: %s", node.base_url, e)
+    results['ollama_status'] = 'connected' if ollama_running else 'disconnected'
+
+    if not ollama_running:
+        results['ready'] = False
+        results['error'] = 'Ollama is not running. Run: ollama serve'
+        return web.json_response(results, status=503)
+
+    # Test model availability with a short generation
+    try:
+        with ollama_node() as node:
+            async with session.post(
+                node.url('/api/generate'),
+                json={
+                    "model": MODEL_NAME,
+                    "prompt": "Say 'Hello, I'm working!' in a friendly way.",
+                    "stream": False,
+                    "keep_alive": OLLAMA_KEEP_ALIVE
+                },
+                timeout=ollama_timeout(10)
+            ) as response:
+                if response.status == 200:
+                    results['model_status'] = 'available'
+                    results['test_response'] = (await response.json()).get('response', '')[:100]
+                    results['ready'] = True
+                else:
+                    results['model_status'] = 'not found'
+                    results['ready'] = False
+                    results['error'] = f'Model {MODEL_NAME} not available. Run: ollama pull {MODEL_NAME}'
+                    return web.json_response(results, status=503)
+
+    except Exception as e:
+        results['ready'] = False
+        results['error'] = f'Test generation failed: {str(e)}'
+
+    return web.json_response(results)
+
+
+async def health_check(request):
+    """Simple health check endpoint with cached Ollama and circuit breaker state"""
+    status = health_status()
+    status['scheduler'] = generation_scheduler.stats()
+    status['coalescing'] = in_flight.stats()
+    return web.json_response(status)
+
+
+async def metrics_endpoint(request):
+    """Request, safety and Ollama timing metrics in the Prometheus text format"""
+    return web.Response(body=metrics.render().encode('utf-8'), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Count, time and log each request under the same route names as app.py"""
+    started = time.perf_counter()
+    request['request_id'] = request_logs.start_request(request.headers.get('X-Request-ID'))
+    start_deadline(request.path, request.headers)
+    route = request.match_info.route.resource
+    # '/api/chatbots/{chatbot_id}' is reported as Flask's '/api/chatbots/<chatbot_id>'
+    endpoint = route.canonical.replace('{', '<').replace('}', '>') if route else 'unmatched'
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    except asyncio.CancelledError:
+        # Client closed the connection before the response was sent
+        status = 499
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        http_requests.inc(endpoint, request.method, str(status))
+        http_latency.observe(seconds, endpoint)
+        log_request(endpoint, request.method, status, seconds)
+
+
+async def request_id_header(request, response):
+    """Send the request ID back with every response, streamed ones included"""
+    if 'request_id' in request:
+        response.headers['X-Request-ID'] = request['request_id']
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Minimal CORS handling matching flask-cors in app.py"""
+    origin = request.headers.get('Origin')
+    allowed = origin in cors_origins
+
+    if request.method == 'OPTIONS':
+        response = web.Response(status=200)
+        if allowed:
+            response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+            response.headers['Access-Control-Allow-Headers'] = request.headers.get(
+                'Access-Control-Request-Headers', 'Content-Type')
+    else:
+        response = await handler(request)
+
+    if allowed:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Vary'] = 'Origin'
+    return response
+
+
+async def ollama_session(application):
+    """Own one pooled keep-alive aiohttp session to Ollama for the app's lifetime"""
+    connector = aiohttp.TCPConnector(limit=ASYNC_OLLAMA_MAX_CONNECTIONS)
+    application[OLLAMA_SESSION] = aiohttp.ClientSession(connector=connector)
+    # Summaries are generated on a worker thread but queue behind this app's generations
+    history_summaries.summarize = partial(summarize_history, slot=threadsafe_slot(asyncio.get_running_loop()))
+    # Node health probes and the startup check, as in the sync app
+    start_background()
+    yield
+    await application[OLLAMA_SESSION].close()
+
+
+def create_async_app():
+    application = web.Application(middlewares=[metrics_middleware, cors_middleware])
+    application.cleanup_ctx.append(ollama_session)
+    application.on_response_prepare.append(request_id_header)
+    for persona, handler in (('holden', chat_holden), ('wellbeing', chat_wellbeing), ('custom', chat_custom)):
+        application.router.add_post(f'/api/chat/{persona}', handler)
+        application.router.add_post(f'/api/chat/{persona}/stream', handler)
+    application.router.add_post('/api/chatbots', register_chatbot)
+    application.router.add_post('/api/chatbots/evaluate', evaluate_chatbot)
+    application.router.add_get('/api/chatbots/{chatbot_id}', registered_chatbot)
+    application.router.add_delete('/api/chatbots/{chatbot_id}', registered_chatbot)
+    application.router.add_get('/api/test', test_connection)
+    application.router.add_get('/api/health', health_check)
+    application.router.add_get('/api/metrics', metrics_endpoint)
+    return application
+
+
+if __name__ == '__main__':
+    # Create logs directory if it doesn't exist
+    os.makedirs(SAFETY_LOG_DIR, exist_ok=True)
+
+    host = os.getenv('HOST', '127.0.0.1')
+    port = int(os.getenv('PORT', '5000'))
+
+    logger.info("Starting Wellbeing Support API server (async mode)...")
+    logger.info("Host: %s", host)
+    logger.info("Port: %s", port)
+    logger.info("CORS origins: %s", cors_origins)
+
+    # Cancel a request's handler when its client disconnects, which stops its generation
+    web.run_app(create_async_app(), host=host, port=port,
+                backlog=ASYNC_LISTEN_BACKLOG, handler_cancellation=True, print=None)
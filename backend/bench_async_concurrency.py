@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark: how many simultaneous chats the sync and async servers can hold.
+
+Starts a stub Ollama with a slow simulated generation, launches app.py
+(sync) and async_app.py (async) against it in turn, fires a burst of
+concurrent /api/chat/holden requests and reports latency, errors and the
+server process's peak thread count and memory.
+
+Run: python bench_async_concurrency.py --concurrency 1000 --delay 2
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from stub_ollama import start_stub_server, stub_url
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_status(pid):
+    """Current (threads, RSS in MB) of a process, from /proc on Linux"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['Threads']), int(fields['VmRSS'].split()[0]) / 1024
+    except (OSError, KeyError):
+        return 0, 0.0
+
+
+async def wait_until_ready(url, timeout=60):
+    """Wait until /api/test reports Ollama and the model confirmed (the port opens before that)"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{url}/api/test") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+async def burst(url, concurrency, pid):
+    """Send `concurrency` chats at once, sampling the server while they run"""
+    peak = {'threads': 0, 'rss': 0.0}
+    stop = asyncio.Event()
+
+    async def sample():
+        while not stop.is_set():
+            threads, rss = process_status(pid)
+            peak['threads'] = max(peak['threads'], threads)
+            peak['rss'] = max(peak['rss'], rss)
+            await asyncio.sleep(0.05)
+
+    async def one(session, i):
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{url}/api/chat/holden", json={
+                'message': f"Why do you hate phonies? ({i})",
+                'student_id': f"bench-{i}"
+            }) as response:
+                await response.read()
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    sampler = asyncio.create_task(sample())
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(session, i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+    stop.set()
+    await sampler
+    return results, wall, peak
+
+
+def run_mode(name, script, stub, concurrency):
+    port = free_port()
+    env = dict(
+        os.environ,
+        OLLAMA_URL=stub,
+        PORT=str(port),
+        LOG_LEVEL='WARNING',
+        LOG_FILE=os.devnull,
+        SAFETY_LOG_DIR=tempfile.mkdtemp(),
+        # Let the async server open as many upstream connections as the sync one
+        ASYNC_OLLAMA_MAX_CONNECTIONS=str(concurrency),
+        # Every simulated student shares one IP; measure capacity, not the limiter
+        RATE_LIMIT_ENABLED='False'
+    )
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, script)],
+        env=env, cwd=HERE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_until_ready(url))
+        results, wall, peak = asyncio.run(burst(url, concurrency, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    errors = len(results) - len(latencies)
+    p50 = statistics.median(latencies) if latencies else 0
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"  {name:<6} ok={len(latencies):<5} errors={errors:<5} wall={wall:6.2f}s "
+          f"p50={p50:6.2f}s p95={p95:6.2f}s "
+          f"peak_threads={peak['threads']:<5} peak_rss={peak['rss']:6.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async serving concurrency benchmark")
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--delay', type=float, default=2.0,
+                        help='Simulated Ollama generation time in seconds')
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    stub = start_stub_server(delay=args.delay)
+
+    print("=" * 60)
+    print(f"CONCURRENCY BENCHMARK ({args.concurrency} simultaneous chats, "
+          f"{args.delay}s per generation)")
+    print("=" * 60)
+
+    scripts = {'sync': 'app.py', 'async': 'async_app.py'}
+    for mode in args.modes.split(','):
+        run_mode(mode, scripts[mode], stub_url(stub), args.concurrency)
+
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: a class asking Holden the same question at once, with and without coalescing.
+
+Starts the stub Ollama and the sync app on a local port, then sends
+--students identical Holden requests at the same moment (half JSON, half
+streaming) and reports how many generations reached Ollama and the
+p50/max reply latency. The burst runs once with coalescing off and once
+with it on.
+
+Run: python bench_coalescing.py --students 25 --delay 1
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stub_ollama import start_stub_server, stub_url
+
+
+def ask(base_url, index, barrier):
+    path = '/api/chat/holden/stream' if index % 2 else '/api/chat/holden'
+    barrier.wait()
+    start = time.perf_counter()
+    response = requests.post(f"{base_url}{path}", json={
+        'message': "Why does Holden want to be the catcher in the rye?",
+        'student_id': f"bench-student-{index}"
+    })
+    response.content
+    return response.status_code, time.perf_counter() - start
+
+
+def burst(server, base_url, students):
+    generations = server.generations
+    barrier = threading.Barrier(students)
+    with ThreadPoolExecutor(students) as pool:
+        results = list(pool.map(lambda i: ask(base_url, i, barrier), range(students)))
+    latencies = sorted(seconds for _, seconds in results)
+    failed = sum(1 for status, _ in results if status != 200)
+    return server.generations - generations, statistics.median(latencies), latencies[-1], failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure a classroom burst of identical questions")
+    parser.add_argument('--students', type=int, default=25)
+    parser.add_argument('--delay', type=float, default=1.0, help='Stub seconds per generation')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='Stub seconds per token')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, token_delay=args.token_delay,
+                               reply="Boy, if you want to know the truth, I just want to keep kids from falling off some crazy cliff.")
+    # Count generations only, not health probes
+    server.generations = 0
+    handler_post = server.RequestHandlerClass.do_POST
+
+    def counting_post(handler):
+        with server.lock:
+            server.generations += 1
+        handler_post(handler)
+
+    server.RequestHandlerClass.do_POST = counting_post
+    os.environ['OLLAMA_URL'] = stub_url(server)
+    os.environ['OLLAMA_WARM_UP'] = 'False'
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'False'
+    os.environ['GENERATION_QUEUE_SIZE'] = str(max(64, args.students))
+
+    import app
+    from werkzeug.serving import make_server
+    http_server = make_server('127.0.0.1', 0, app.create_app(start=False), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    print("=" * 64)
+    print(f"REQUEST COALESCING BENCHMARK ({args.students} identical questions)")
+    print("=" * 64)
+    print(f"\n{'':<16} {'generations':>12} {'p50 s':>8} {'max s':>8} {'failed':>8}")
+    windows = app.in_flight.windows
+    for label, enabled in (('coalescing off', False), ('coalescing on', True)):
+        app.in_flight.windows = windows if enabled else {}
+        generations, p50, worst, failed = burst(server, base_url, args.students)
+        print(f"{label:<16} {generations:>12} {p50:>8.2f} {worst:>8.2f} {failed:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: prompt-eval work per turn with and without KV context reuse.
+
+Plays a scripted Holden conversation twice - once rebuilding the full prompt
+every turn (the old behaviour) and once reusing Ollama's returned context -
+and prints Ollama's prompt_eval_count and prompt_eval_duration per turn.
+
+Run against a real Ollama (uses OLLAMA_URL / MODEL_NAME from .env):
+    python bench_context_reuse.py
+Or offline against the stub server:
+    python bench_context_reuse.py --stub
+"""
+
+import argparse
+import os
+import uuid
+
+STUDENT_TURNS = [
+    "Why do you hate phonies so much?",
+    "Is Mr. Antolini a phony too?",
+    "What does the catcher in the rye mean to you?",
+    "Why do you care so much about Allie's baseball mitt?",
+    "Why do you keep leaving schools?",
+    "What was going on with you and Jane?",
+    "Why does the carousel scene with Phoebe matter?",
+    "Do you think you grow up by the end?"
+]
+
+
+def play(app, reuse):
+    """Run the scripted conversation, returning Ollama's stats for each turn"""
+    app.CONTEXT_REUSE_ENABLED = reuse
+    student_id = f"bench-{uuid.uuid4()}"
+    history = []
+    results = []
+
+    for message in STUDENT_TURNS:
+        key, prompt, context = app.plan_turn(app.HOLDEN, message, history, student_id)
+        response = app.ollama.generate(
+            app.generation_payload(prompt, app.HOLDEN_OPTIONS, context),
+            timeout=120
+        )
+        response.raise_for_status()
+        response_json = response.json()
+        app.remember_turn(key, history, message, response_json)
+
+        results.append((
+            response_json.get('prompt_eval_count', 0),
+            response_json.get('prompt_eval_duration', 0) / 1e6
+        ))
+        history.append({'role': 'user', 'content': message})
+        history.append({'role': 'assistant', 'content': response_json.get('response', '').strip()})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt-eval time per turn")
+    parser.add_argument('--stub', action='store_true',
+                        help='Run against a local stub Ollama instead of OLLAMA_URL')
+    parser.add_argument('--prompt-token-delay', type=float, default=0.002,
+                        help='Stub only: seconds to evaluate each prompt word')
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_ollama import start_stub_server, stub_url
+        server = start_stub_server(
+            prompt_token_delay=args.prompt_token_delay,
+            reply="Boy, if you want to know the truth, that kind of stuff really kills me."
+        )
+        os.environ['OLLAMA_URL'] = stub_url(server)
+
+    import app
+
+    print("=" * 60)
+    print(f"KV CONTEXT REUSE BENCHMARK ({app.OLLAMA_URL}, {app.MODEL_NAME})")
+    print("=" * 60)
+
+    before = play(app, reuse=False)
+    after = play(app, reuse=True)
+
+    print(f"\n{'turn':>4}  {'full prompt':>22}  {'context reuse':>22}")
+    print(f"{'':>4}  {'tokens':>8} {'eval ms':>13}  {'tokens':>8} {'eval ms':>13}")
+    for turn, ((count_a, ms_a), (count_b, ms_b)) in enumerate(zip(before, after), start=1):
+        print(f"{turn:>4}  {count_a:>8} {ms_a:>13.1f}  {count_b:>8} {ms_b:>13.1f}")
+
+    total_a = sum(ms for _, ms in before)
+    total_b = sum(ms for _, ms in after)
+    print(f"\nTotal prompt-eval: {total_a:.1f}ms -> {total_b:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: chat request size and parse time with the full history vs session mode.
+
+Plays a synthetic conversation and, at each checkpoint turn, builds the
+request body the browser sends today (the whole conversation_history)
+and the session-mode body (session_id and the new message only). For
+each it reports the body size and the time to parse it, including the
+ConversationStore lookup in session mode. It then fills a store with a
+school's worth of active sessions and reports memory per message.
+
+Run: python bench_conversation_store.py --turns 40 --sessions 1500
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from conversation_store import ConversationStore
+
+STUDENT_WORDS = (
+    "i dont really get why holden keeps calling everyone phony and my essay is due friday "
+    "can you explain what the carousel scene means and why he cares about allie so much "
+    "my teacher said to focus on alienation but i think it is more about growing up"
+).split()
+
+ASSISTANT_WORDS = (
+    "boy if you want to know the truth that kind of stuff really kills me it does "
+    "what do you think old phoebe going round and round on that carousel meant to me "
+    "i am not going to write your goddam essay for you but think about why i did that"
+).split()
+
+
+def make_message(rng, words, low, high):
+    return ' '.join(rng.choices(words, k=rng.randint(low, high)))
+
+
+def make_conversation(rng, turns):
+    history = []
+    for _ in range(turns):
+        history.append({'role': 'user', 'content': make_message(rng, STUDENT_WORDS, 8, 40)})
+        history.append({'role': 'assistant', 'content': make_message(rng, ASSISTANT_WORDS, 40, 120)})
+    return history
+
+
+def time_parse(body, store, repeats):
+    """Mean seconds to parse a request body and resolve its history"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        data = json.loads(body)
+        history = data.get('conversation_history')
+        if history is None:
+            history = store.get(data['session_id'])
+    return (time.perf_counter() - start) / repeats
+
+
+def measure_memory(rng, sessions, turns):
+    """Bytes of interpreter memory per stored message for a full store"""
+    conversations = [make_conversation(rng, turns) for _ in range(sessions)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = ConversationStore(max_bytes=1 << 40, max_conversations=sessions)
+    for i, history in enumerate(conversations):
+        store.replace(f"holden:student-{i}:session-{i}", history)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    stats = store.stats()
+    content = sum(len(msg['content']) for history in conversations for msg in history)
+    return stats['messages'], after - before, content
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chat request size and parse time, full history vs session mode")
+    parser.add_argument('--turns', type=int, default=40, help='Conversation length in student turns')
+    parser.add_argument('--sessions', type=int, default=1500, help='Active sessions for the memory measurement')
+    parser.add_argument('--repeats', type=int, default=2000, help='Parses timed per checkpoint')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    history = make_conversation(rng, args.turns)
+    store = ConversationStore()
+    session_key = 'bench-session'
+
+    print("=" * 72)
+    print("CONVERSATION STORE BENCHMARK")
+    print("=" * 72)
+    print(f"\n{'turn':>5}  {'full history':>24}  {'session mode':>24}")
+    print(f"{'':>5}  {'bytes':>10} {'parse us':>13}  {'bytes':>10} {'parse us':>13}")
+
+    checkpoints = sorted({1, 5, 10, 20, args.turns} & set(range(1, args.turns + 1)))
+    for turn in checkpoints:
+        earlier = history[:(turn - 1) * 2]
+        message = history[(turn - 1) * 2]['content']
+        full = json.dumps({
+            'message': message,
+            'student_id': 'student-1',
+            'conversation_history': earlier
+        })
+        session = json.dumps({
+            'message': message,
+            'student_id': 'student-1',
+            'session_id': session_key
+        })
+        store.replace(session_key, earlier)
+
+        full_us = time_parse(full, store, args.repeats) * 1e6
+        session_us = time_parse(session, store, args.repeats) * 1e6
+        print(f"{turn:>5}  {len(full.encode('utf-8')):>10} {full_us:>13.1f}  {len(session.encode('utf-8')):>10} {session_us:>13.1f}")
+
+    messages, used, content = measure_memory(rng, args.sessions, args.turns // 2)
+    print(f"\nStore holding {args.sessions} sessions of {args.turns // 2} turns ({messages} messages):")
+    print(f"  {used / 1024 / 1024:.1f} MiB total, {used / messages:.0f} bytes/message "
+          f"({content / messages:.0f} of which is message text)")
+
+
+if __name__ == "__main__":
+    main()
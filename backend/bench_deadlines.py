@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Ollama time spent on replies nobody waits for.
+
+Starts the stub Ollama and the sync app on a local port. --students
+students each send one wellbeing message at once and give up after
+--client-timeout seconds, like a browser timing out or a closed tab,
+while Ollama can only generate GENERATION_MAX_CONCURRENT replies at a
+time. Reports the replies students received in time, the stub's total
+generation time, and how much of it was abandoned, in three setups:
+
+- no cancellation: the backend doesn't notice students leaving and has no
+  deadline, so every queued generation runs to the end (the old behaviour)
+- disconnects: generations stop when the student's connection closes
+- deadlines: students also send X-Request-Timeout, so requests still
+  queued when it passes are never generated
+
+"never run" counts requests that were dropped before their generation
+started.
+
+Run: python bench_deadlines.py --students 20 --client-timeout 3
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stub_ollama import start_stub_server, stub_url
+
+REPLY = " ".join(["That sounds like a lot to carry, and it makes sense you feel tired."] * 3)
+
+
+def ask(base_url, index, client_timeout, send_deadline):
+    headers = {'X-Request-Timeout': str(client_timeout)} if send_deadline else {}
+    try:
+        response = requests.post(f"{base_url}/api/chat/wellbeing", headers=headers, timeout=client_timeout,
+                                 json={'message': f"Today was long, part {index}", 'student_id': f"student-{index}"})
+        return response.status_code == 200 and response.json()['response'] == REPLY
+    except requests.exceptions.RequestException:
+        return False
+
+
+def settle(base_url):
+    """Wait until the backend has no generation running or queued"""
+    while True:
+        scheduler = requests.get(f"{base_url}/api/health").json()['scheduler']
+        if not scheduler['active'] and not scheduler['queue_depth']:
+            return
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Ollama time wasted on abandoned requests")
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--client-timeout', type=float, default=3.0, help='Seconds each student waits')
+    parser.add_argument('--delay', type=float, default=0.2, help='Stub fixed seconds per generation')
+    parser.add_argument('--token-delay', type=float, default=0.05, help='Stub seconds per generated token')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, token_delay=args.token_delay, reply=REPLY)
+    os.environ['OLLAMA_URL'] = stub_url(server)
+    os.environ['OLLAMA_WARM_UP'] = 'False'
+    os.environ['RATE_LIMIT_ENABLED'] = 'False'
+    os.environ['GENERATION_QUEUE_TIMEOUT'] = '600'
+
+    import app
+    from deadlines import AbandonedGenerations
+    from werkzeug.serving import make_server
+    http_server = make_server('127.0.0.1', 0, app.create_app(start=False), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+    socket_keys = app.CLIENT_SOCKET_KEYS
+
+    print("=" * 72)
+    print(f"DEADLINE BENCHMARK ({args.students} students, {args.client_timeout:g}s client timeout, "
+          f"{app.GENERATION_MAX_CONCURRENT} generation slots)")
+    print("=" * 72)
+    print(f"\n{'':<18} {'in time':>8} {'generated s':>12} {'abandoned s':>12} {'aborted':>8} {'never run':>10}")
+    for label, watch_clients, send_deadline in (('no cancellation', False, False),
+                                                ('disconnects', True, False),
+                                                ('deadlines', True, True)):
+        app.CLIENT_SOCKET_KEYS = socket_keys if watch_clients else ()
+        app.REQUEST_TIMEOUT = args.client_timeout if send_deadline else 3600
+        app.abandoned_generations = AbandonedGenerations()
+        generation_seconds, aborted = server.generation_seconds, server.aborted
+        rejected = requests.get(f"{base_url}/api/health").json()['scheduler']['rejected']['deadline']
+
+        with ThreadPoolExecutor(args.students) as pool:
+            replies = list(pool.map(lambda i: ask(base_url, i, args.client_timeout, send_deadline),
+                                    range(args.students)))
+        settle(base_url)
+
+        health = requests.get(f"{base_url}/api/health").json()
+        reasons = [reason for reasons in health['abandoned_generations'].values() for reason in reasons.values()]
+        abandoned = sum(reason['seconds'] for reason in reasons)
+        # Turned away while queued, or given a slot once nobody was waiting
+        never_run = health['scheduler']['rejected']['deadline'] - rejected + sum(reason['skipped'] for reason in reasons)
+        print(f"{label:<18} {sum(replies):>8} {server.generation_seconds - generation_seconds:>12.1f} "
+              f"{abandoned:>12.1f} {server.aborted - aborted:>8} {never_run:>10}")
+
+
+if __name__ == "__main__":
+    main()
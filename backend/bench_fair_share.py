@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one student flooding the chat API while classmates ask one question each.
+
+Starts the stub Ollama and the sync app on a local port. A single student
+fires --flood requests at once, then --students classmates send one
+each. Reports the classmates' p50/max latency and the flooder's, first
+with first-come-first-served admission, then with fair-share admission,
+and finally with the default rate limits, which turn most of the flood
+away with 429.
+
+Run: python bench_fair_share.py --flood 20 --students 10 --delay 0.5
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stub_ollama import start_stub_server, stub_url
+
+CHATBOT = {'name': 'Study Buddy', 'personality': 'A patient science tutor', 'conversationStyle': 'friendly'}
+
+
+def ask(base_url, student_id, index):
+    start = time.perf_counter()
+    response = requests.post(f"{base_url}/api/chat/custom", json={
+        'message': f"Question {index}: why is the sky blue?",
+        'student_id': student_id,
+        'chatbot_config': CHATBOT
+    })
+    return response.status_code, time.perf_counter() - start
+
+
+def burst(base_url, flood, students):
+    with ThreadPoolExecutor(flood + students) as pool:
+        flooder = [pool.submit(ask, base_url, 'flooder', i) for i in range(flood)]
+        # Let the flood reach the queue first
+        time.sleep(0.05)
+        classmates = [pool.submit(ask, base_url, f"student-{i}", i) for i in range(students)]
+        return [f.result() for f in classmates], [f.result() for f in flooder]
+
+
+def summary(results):
+    latencies = sorted(seconds for status, seconds in results if status == 200)
+    rejected = sum(1 for status, _ in results if status == 429)
+    if not latencies:
+        return f"{'-':>8} {'-':>8} {rejected:>9}"
+    return f"{statistics.median(latencies):>8.2f} {latencies[-1]:>8.2f} {rejected:>9}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure fair-share admission and rate limits under a flood")
+    parser.add_argument('--flood', type=int, default=20, help='Simultaneous requests from one student')
+    parser.add_argument('--students', type=int, default=10, help='Classmates asking one question each')
+    parser.add_argument('--delay', type=float, default=0.5, help='Stub seconds per generation')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, token_delay=0.0, reply="Sunlight scatters off the air, and blue scatters most.")
+    os.environ['OLLAMA_URL'] = stub_url(server)
+    os.environ['OLLAMA_WARM_UP'] = 'False'
+    os.environ['COALESCE_PERSONAS'] = ''
+    os.environ['GENERATION_QUEUE_SIZE'] = str(max(64, args.flood + args.students))
+    os.environ['GENERATION_QUEUE_TIMEOUT'] = '120'
+
+    import app
+    from werkzeug.serving import make_server
+    http_server = make_server('127.0.0.1', 0, app.create_app(start=False), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    print("=" * 72)
+    print(f"FAIR-SHARE BENCHMARK (1 student x {args.flood} requests, {args.students} classmates x 1)")
+    print("=" * 72)
+    print(f"\n{'':<16} {'classmates':^27}   {'flooder':^27}")
+    print(f"{'':<16} {'p50 s':>8} {'max s':>8} {'429s':>9}   {'p50 s':>8} {'max s':>8} {'429s':>9}")
+    for label, fair_share, limited in (('first come', False, False), ('fair share', True, False),
+                                       ('+ rate limits', True, True)):
+        app.GENERATION_FAIR_SHARE = fair_share
+        app.RATE_LIMIT_ENABLED = limited
+        classmates, flooder = burst(base_url, args.flood, args.students)
+        print(f"{label:<16} {summary(classmates)}   {summary(flooder)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: chat latency with fixed and load-adaptive reply budgets.
+
+Starts the stub Ollama, whose replies run to --reply-tokens tokens unless
+num_predict stops them sooner, and the sync app on a local port. For
+--duration seconds --students students each ask Holden a question, wait
+for the reply, think for --think-time seconds and ask again, which is
+more than GENERATION_MAX_CONCURRENT slots can keep up with at full reply
+length. Reports request latency against --target, busy (429) answers and
+the mean reply length in two setups:
+
+- fixed: every reply may use the persona's full num_predict (the old
+  behaviour, except that max_tokens used to be ignored altogether)
+- adaptive: num_predict is chosen per generation from the queue depth and
+  observed speed to hold p95 latency near the target
+
+Run: python bench_generation_budget.py --students 12 --duration 40 --target 8
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import requests
+
+from bench_load import percentile
+from stub_ollama import start_stub_server, stub_url
+
+
+def student(base_url, index, stop_at, think_time, samples):
+    turn = 0
+    while time.monotonic() < stop_at:
+        turn += 1
+        started = time.perf_counter()
+        try:
+            response = requests.post(f"{base_url}/api/chat/holden", timeout=300, json={
+                'message': f"Why did you leave Pencey, really? (student {index}, question {turn})",
+                'student_id': f"student-{index}"
+            })
+            status = response.status_code
+            words = len(response.json().get('response', '').split()) if status == 200 else 0
+        except requests.exceptions.RequestException:
+            status, words = 'error', 0
+        samples.append((status, time.perf_counter() - started, words))
+        time.sleep(think_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure latency with fixed and adaptive reply budgets")
+    parser.add_argument('--students', type=int, default=12)
+    parser.add_argument('--duration', type=float, default=40, help='Seconds of traffic per setup')
+    parser.add_argument('--think-time', type=float, default=2.0, help='Seconds between a reply and the next question')
+    parser.add_argument('--target', type=float, default=8.0, help='GENERATION_LATENCY_TARGET seconds')
+    parser.add_argument('--reply-tokens', type=int, default=600, help='Length of the stub reply, in tokens')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='Stub seconds per generated token')
+    parser.add_argument('--delay', type=float, default=0.2, help='Stub fixed seconds per generation')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, token_delay=args.token_delay,
+                               reply=" ".join(["phony"] * args.reply_tokens))
+    os.environ['OLLAMA_URL'] = stub_url(server)
+    os.environ['OLLAMA_WARM_UP'] = 'False'
+    os.environ['RATE_LIMIT_ENABLED'] = 'False'
+    os.environ['CONTEXT_REUSE_ENABLED'] = 'False'
+    os.environ['GENERATION_LATENCY_TARGET'] = str(args.target)
+
+    import app
+    from generation_budget import GenerationBudget
+    from werkzeug.serving import make_server
+    http_server = make_server('127.0.0.1', 0, app.create_app(start=False), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    print("=" * 72)
+    print(f"REPLY BUDGET BENCHMARK ({args.students} students, {args.duration:g}s, {args.target:g}s p95 target, "
+          f"{app.GENERATION_MAX_CONCURRENT} generation slots)")
+    print("=" * 72)
+    print(f"\n{'':<10} {'replies':>8} {'busy':>6} {'p50 s':>7} {'p95 s':>7} {'max s':>7} "
+          f"{'over target':>12} {'mean words':>11}")
+    for label, enabled in (('fixed', False), ('adaptive', True)):
+        app.GENERATION_BUDGET_ENABLED = enabled
+        app.generation_budget = GenerationBudget(args.target, app.GENERATION_MAX_CONCURRENT,
+                                                 app.generation_budget.min_tokens, app.generation_budget.kinds)
+        samples = []
+        stop_at = time.monotonic() + args.duration
+        threads = [threading.Thread(target=student, args=(base_url, i, stop_at, args.think_time, samples))
+                   for i in range(args.students)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        replies = [(latency, words) for status, latency, words in samples if status == 200]
+        latencies = sorted(latency for latency, _ in replies)
+        over = sum(latency > args.target for latency in latencies)
+        mean_words = sum(words for _, words in replies) / len(replies) if replies else 0
+        print(f"{label:<10} {len(replies):>8} {sum(status == 429 for status, _, _ in samples):>6} "
+              f"{percentile(latencies, 0.5):>7.1f} {percentile(latencies, 0.95):>7.1f} {latencies[-1]:>7.1f} "
+              f"{over / len(latencies):>12.0%} {mean_words:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
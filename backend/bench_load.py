@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Load test: mixed chat traffic against the backend and a stub Ollama.
+
+Starts stub_ollama.py with simulated prompt-eval and per-token latency
+(and optional injected errors and stalls), launches app.py,
+async_app.py or the multi-worker serve.py against it, and runs virtual
+students for a fixed time. Each student holds multi-turn conversations
+with Holden, the wellbeing chatbot (some messages trip the CONCERN and
+CRISIS checks) or a registered custom chatbot, with a mix of JSON and
+streaming requests.
+
+Reports throughput and p50/p95/p99 latency per endpoint. --json writes
+the results to a file, and --baseline compares them with an earlier
+file, exiting non-zero if throughput or p95 latency regressed by more
+than --tolerance.
+
+Run: python bench_load.py --users 50 --duration 30 --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+
+from bench_async_concurrency import free_port, wait_until_ready
+from stub_ollama import start_stub_server, stub_url
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HOLDEN_MESSAGES = [
+    "Why do you hate phonies so much?",
+    "Is Mr. Antolini a phony too?",
+    "What does the catcher in the rye mean to you?",
+    "Why do you care so much about Allie's baseball mitt?",
+    "Why do you keep leaving schools?",
+    "Why does the carousel scene with Phoebe matter?",
+    "Can you just write my essay intro for me?",
+    "Do you think you grow up by the end?"
+]
+
+WELLBEING_MESSAGES = [
+    "I'm stressed about my exams next week",
+    "My friends have been ignoring me at lunch",
+    "I had a fight with my sister this morning",
+    "I don't know what subjects to pick for next year",
+    "I've been staying up really late on my phone",
+    "Sport training is taking up all my time"
+]
+
+# Messages that trip the safety checks, sent occasionally
+CONCERN_MESSAGES = ["I feel so alone at school", "I've been having panic attacks before class"]
+CRISIS_MESSAGES = ["Sometimes I want to end it all"]
+
+CUSTOM_MESSAGES = [
+    "What is photosynthesis?",
+    "Can you explain the water cycle?",
+    "Why do plants need sunlight?",
+    "What's the difference between weather and climate?",
+    "How do I study for the science test?"
+]
+
+CUSTOM_CHATBOT = {
+    'name': 'Science Buddy',
+    'personality': 'A patient Year 8 science tutor',
+    'conversationStyle': 'friendly',
+    'referenceMaterials': ' '.join(
+        f"Section {i}: plants use sunlight, water and carbon dioxide to make glucose and oxygen. "
+        "Water evaporates, condenses into clouds and falls as precipitation. "
+        "Climate is the average weather in a place over many years."
+        for i in range(40)
+    )
+}
+
+REPLY = (
+    "Well, that's a really good question and I think it's worth taking a moment to "
+    "think about it properly. What do you already know about it, and what part of it "
+    "feels the most confusing to you right now?"
+)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        persona, weight = part.split('=')
+        mix[persona.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def pick_message(persona, rng):
+    if persona == 'holden':
+        return rng.choice(HOLDEN_MESSAGES)
+    if persona == 'custom':
+        return rng.choice(CUSTOM_MESSAGES)
+    roll = rng.random()
+    if roll < 0.02:
+        return rng.choice(CRISIS_MESSAGES)
+    if roll < 0.12:
+        return rng.choice(CONCERN_MESSAGES)
+    return rng.choice(WELLBEING_MESSAGES)
+
+
+async def read_stream(response, started):
+    """Reply text and seconds from `started` to the first token of an SSE chat response"""
+    first_token = None
+    tokens = []
+    async for line in response.content:
+        if line.startswith(b'data: '):
+            payload = json.loads(line[6:])
+            if 'token' in payload:
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                tokens.append(payload['token'])
+    return ''.join(tokens), first_token
+
+
+async def student(session, url, user, args, chatbot_id, mix, deadline, samples):
+    """One virtual student holding conversations until the deadline"""
+    rng = random.Random(args.seed * 100003 + user)
+    personas, weights = zip(*mix.items())
+
+    while time.monotonic() < deadline:
+        persona = rng.choices(personas, weights)[0]
+        history = []
+        for _ in range(args.turns):
+            if time.monotonic() >= deadline:
+                return
+            message = pick_message(persona, rng)
+            stream = rng.random() < args.stream_fraction
+            endpoint = f"{persona}/stream" if stream else persona
+            body = {
+                'message': message,
+                'student_id': f"load-{user}",
+                'conversation_history': history
+            }
+            if persona == 'custom':
+                body['chatbot_id'] = chatbot_id
+
+            sample = {'endpoint': endpoint, 'status': None, 'latency': None, 'first_token': None}
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{url}/api/chat/{endpoint}", json=body) as response:
+                    sample['status'] = response.status
+                    if stream and response.status == 200:
+                        reply, sample['first_token'] = await read_stream(response, started)
+                    else:
+                        reply = (await response.json()).get('response', '')
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                sample['status'] = type(e).__name__
+                reply = None
+            sample['latency'] = time.perf_counter() - started
+            samples.append(sample)
+
+            if sample['status'] != 200:
+                break
+            history = history + [
+                {'role': 'user', 'content': message},
+                {'role': 'assistant', 'content': reply}
+            ]
+            await asyncio.sleep(rng.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+
+
+async def drive(url, args, mix):
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with session.post(f"{url}/api/chatbots", json={'chatbot_config': CUSTOM_CHATBOT}) as response:
+            chatbot_id = (await response.json())['chatbot_id']
+
+        samples = []
+        started = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*(
+            student(session, url, user, args, chatbot_id, mix, deadline, samples)
+            for user in range(args.users)
+        ))
+        return samples, time.perf_counter() - started
+
+
+def summarize(samples, wall):
+    """Throughput, status counts and latency percentiles for a group of samples"""
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample['status'])] = statuses.get(str(sample['status']), 0) + 1
+    latencies = sorted(s['latency'] for s in samples if s['status'] == 200)
+    first_tokens = sorted(s['first_token'] for s in samples if s['first_token'] is not None)
+    summary = {
+        'requests': len(samples),
+        'ok': len(latencies),
+        'statuses': statuses,
+        'throughput_rps': len(latencies) / wall if wall else 0.0,
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99)
+    }
+    if first_tokens:
+        summary['first_token_p50'] = percentile(first_tokens, 0.50)
+        summary['first_token_p95'] = percentile(first_tokens, 0.95)
+    return summary
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    stub = start_stub_server(
+        delay=args.delay,
+        token_delay=args.token_delay,
+        prompt_token_delay=args.prompt_token_delay,
+        reply=REPLY,
+        stall_seconds=args.stall_seconds,
+        seed=args.seed
+    )
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        OLLAMA_URL=stub_url(stub),
+        PORT=str(port),
+        LOG_LEVEL='WARNING',
+        LOG_FILE=os.devnull,
+        SAFETY_LOG_DIR=tempfile.mkdtemp(),
+        CHATBOT_REGISTRY_DIR='',
+        # Every virtual student shares one IP; measure capacity, not the limiter
+        RATE_LIMIT_ENABLED='False'
+    )
+    for setting in args.env:
+        key, value = setting.split('=', 1)
+        env[key] = value
+
+    script = {'sync': 'app.py', 'async': 'async_app.py', 'prod': 'serve.py'}[args.mode]
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, script)],
+        env=env, cwd=HERE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_until_ready(url))
+        # Faults start after the startup checks so the server comes up cleanly
+        stub.error_rate = args.error_rate
+        stub.stall_rate = args.stall_rate
+        samples, wall = asyncio.run(drive(url, args, mix))
+    finally:
+        server.terminate()
+        server.wait()
+        stub.shutdown()
+
+    endpoints = sorted({s['endpoint'] for s in samples})
+    return {
+        'benchmark': 'load',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+        'wall_seconds': wall,
+        'overall': summarize(samples, wall),
+        'endpoints': {
+            endpoint: summarize([s for s in samples if s['endpoint'] == endpoint], wall)
+            for endpoint in endpoints
+        },
+        'stub': {'requests': stub.requests, 'aborted': stub.aborted, 'faults': dict(stub.faults)}
+    }
+
+
+def ms(seconds):
+    return f"{seconds * 1000:8.0f}" if seconds is not None else f"{'-':>8}"
+
+
+def report(results):
+    print(f"\n{'endpoint':<18} {'ok':>6} {'other':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft p50':>8}")
+    rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+    for endpoint, summary in rows:
+        print(f"{endpoint:<18} {summary['ok']:>6} {summary['requests'] - summary['ok']:>6} "
+              f"{summary['throughput_rps']:>7.2f} {ms(summary['latency_p50'])} {ms(summary['latency_p95'])} "
+              f"{ms(summary['latency_p99'])} {ms(summary.get('first_token_p50'))}")
+    other = {status: count for status, count in results['overall']['statuses'].items() if status != '200'}
+    if other:
+        print(f"\nNon-200 responses: {other}")
+    print(f"Stub Ollama: {results['stub']}")
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput and p95 changes against a baseline; returns the regressions"""
+    regressions = []
+    print(f"\nAgainst baseline from {baseline.get('timestamp', 'unknown')} (tolerance {tolerance:.0%}):")
+    groups = [('overall', results['overall'], baseline.get('overall'))] + [
+        (endpoint, summary, baseline.get('endpoints', {}).get(endpoint))
+        for endpoint, summary in results['endpoints'].items()
+    ]
+    for name, now, before in groups:
+        if not before:
+            continue
+        line = f"  {name:<18}"
+        if before['throughput_rps']:
+            change = now['throughput_rps'] / before['throughput_rps'] - 1
+            line += f" req/s {change:+7.1%}"
+            if change < -tolerance:
+                regressions.append(f"{name} throughput")
+        if before.get('latency_p95') and now.get('latency_p95'):
+            change = now['latency_p95'] / before['latency_p95'] - 1
+            line += f"  p95 {change:+7.1%}"
+            if change > tolerance:
+                regressions.append(f"{name} p95 latency")
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-traffic load test against a stub Ollama")
+    parser.add_argument('--mode', choices=('sync', 'async', 'prod'), default='sync',
+                        help='prod runs serve.py with SERVER_WORKERS workers (pass it with --env)')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent virtual students')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic')
+    parser.add_argument('--think-time', type=float, default=1.0,
+                        help='Mean seconds a student waits between messages')
+    parser.add_argument('--turns', type=int, default=6, help='Messages per conversation')
+    parser.add_argument('--mix', default='holden=0.35,wellbeing=0.4,custom=0.25',
+                        help='Share of conversations per chatbot')
+    parser.add_argument('--stream-fraction', type=float, default=0.5,
+                        help='Share of requests sent to the /stream endpoints')
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='Stub: fixed seconds per generation')
+    parser.add_argument('--prompt-token-delay', type=float, default=0.0005,
+                        help='Stub: seconds to evaluate each prompt word')
+    parser.add_argument('--token-delay', type=float, default=0.01,
+                        help='Stub: seconds per generated token')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Stub: fraction of generations answered with a 500')
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help='Stub: fraction of generations that stall past the backend timeout')
+    parser.add_argument('--stall-seconds', type=float, default=35.0)
+    parser.add_argument('--request-timeout', type=float, default=120.0)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra backend setting, e.g. --env GENERATION_MAX_CONCURRENT=4')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Earlier --json results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative drop in throughput or rise in p95 latency')
+    args = parser.parse_args()
+
+    print("=" * 72)
+    print(f"LOAD TEST ({args.mode} server, {args.users} students, {args.duration:.0f}s, mix {args.mix})")
+    print("=" * 72)
+
+    results = run(args)
+    report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSION: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
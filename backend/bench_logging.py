@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark: logging cost per chat request, on the request's own thread.
+
+--threads threads each log what a chat request logs (the received
+message, two debug lines, the reply and the access log) --requests
+times. Reports the mean time a request spends in logging calls:
+
+- sync handlers: the old setup, a stream and a file handler on the root
+  logger, with f-string messages
+- queue + JSON: the RequestLogPipeline from request_logging.py, with
+  %-style messages, and with 10% of requests sampled
+- WARNING level: INFO disabled, with f-strings and %-style messages
+
+--write-delay adds a pause to every write, like a slow or busy disk.
+
+Run: python bench_logging.py --threads 32 --requests 500 --write-delay 0.0002
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from request_logging import TEXT_FORMAT, RequestLogPipeline
+
+logger = logging.getLogger('bench')
+MESSAGE = "I've been reading chapter 7 and I don't get why Holden keeps calling everyone a phony. " * 3
+
+
+class SlowFile:
+    """A file whose writes take at least `delay` seconds"""
+
+    def __init__(self, path, delay):
+        self.file = open(path, 'a', encoding='utf-8')
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def fstring_request(student_id, status):
+    logger.info(f"Received message for Holden from student {student_id}: {MESSAGE[:50]}...")
+    logger.debug(f"Sending request to Ollama with model llama3.2:3b as Holden")
+    logger.debug(f"Ollama response status: {status}")
+    logger.info(f"Successfully got Holden response")
+    logger.info(f"POST /api/chat/holden {status} in {12.3}ms")
+
+
+def lazy_request(student_id, status):
+    logger.info("Received message for Holden from student %s: %.50s...", student_id, MESSAGE)
+    logger.debug("Sending request to Ollama with model %s as %s", 'llama3.2:3b', 'Holden')
+    logger.debug("Ollama response status: %s", status)
+    logger.info("Successfully got %s response", 'Holden')
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s %s %s in %sms", 'POST', '/api/chat/holden', status, 12.3,
+                    extra={'endpoint': '/api/chat/holden', 'method': 'POST', 'status': status, 'duration_ms': 12.3})
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def run(threads, requests, log_request, pipeline=None):
+    """Mean seconds per request spent in logging calls, across all threads"""
+    per_request = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        barrier.wait()
+        spent = 0.0
+        for i in range(requests):
+            if pipeline:
+                pipeline.start_request()
+            start = time.perf_counter()
+            log_request(f"student-{index}", 200)
+            spent += time.perf_counter() - start
+        with lock:
+            per_request.append(spent / requests)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return statistics.mean(per_request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-request logging overhead")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per thread')
+    parser.add_argument('--write-delay', type=float, default=0.0, help='Seconds added to every log write')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    def handlers():
+        return [logging.StreamHandler(SlowFile(os.path.join(directory, 'stdout.log'), args.write_delay)),
+                logging.StreamHandler(SlowFile(os.path.join(directory, 'app.log'), args.write_delay))]
+
+    print("=" * 64)
+    print(f"LOGGING OVERHEAD ({args.threads} threads x {args.requests} requests, "
+          f"write delay {args.write_delay * 1000:g}ms)")
+    print("=" * 64)
+    print(f"\n{'':<34} {'us/request':>12} {'drain s':>9} {'dropped':>8}")
+
+    # Old setup: handlers write on the calling thread
+    reset_logging()
+    logging.basicConfig(level=logging.INFO, format=TEXT_FORMAT, handlers=handlers())
+    print(f"{'sync handlers, f-strings':<34} {run(args.threads, args.requests, fstring_request) * 1e6:>12.1f}")
+
+    for label, sample_rate in (('queue + JSON, lazy', 1.0), ('queue + JSON, lazy, 10% sampled', 0.1)):
+        reset_logging()
+        pipeline = RequestLogPipeline(handlers(), level=logging.INFO, sample_rate=sample_rate)
+        pipeline.install()
+        seconds = run(args.threads, args.requests, lazy_request, pipeline)
+        start = time.perf_counter()
+        pipeline.stop()
+        drain = time.perf_counter() - start
+        print(f"{label:<34} {seconds * 1e6:>12.1f} {drain:>9.2f} {pipeline.stats()['dropped']:>8}")
+
+    for label, log_request in (('WARNING level, f-strings', fstring_request), ('WARNING level, lazy', lazy_request)):
+        reset_logging()
+        logging.basicConfig(level=logging.WARNING, format=TEXT_FORMAT, handlers=handlers())
+        print(f"{label:<34} {run(args.threads, args.requests, log_request) * 1e6:>12.1f}")
+    reset_logging()
+
+
+if __name__ == "__main__":
+    main()
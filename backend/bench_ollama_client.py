@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bare requests.post vs the pooled OllamaClient.
+
+Runs against a local stub Ollama server so no model is needed, and reports
+how many TCP connections each approach opens and the per-call latency.
+Run: python bench_ollama_client.py --requests 500 --threads 30
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ollama_client import OllamaClient
+from stub_ollama import MODEL_NAME, start_stub_server, stub_url
+
+PAYLOAD = {"model": MODEL_NAME, "prompt": "Student: hi\nAssistant:", "stream": False}
+
+
+def run(call, total, threads):
+    """Issue `total` calls across `threads` workers, return per-call latencies"""
+    def timed(_):
+        start = time.perf_counter()
+        response = call()
+        response.content
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(timed, range(total)))
+
+
+def report(name, server, before, latencies, wall):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"  {name:<8} connections={server.connections - before:<5} "
+          f"mean={statistics.mean(latencies) * 1000:6.2f}ms "
+          f"p95={p95 * 1000:6.2f}ms "
+          f"throughput={len(latencies) / wall:7.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=30)
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Simulated generation time in seconds')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay)
+    url = stub_url(server)
+    client = OllamaClient(url, pool_size=args.threads)
+
+    bare = lambda: requests.post(f"{url}/api/generate", json=PAYLOAD, timeout=30)
+    pooled = lambda: client.generate(PAYLOAD, timeout=30)
+
+    print("=" * 60)
+    print(f"OLLAMA CLIENT BENCHMARK ({args.requests} requests)")
+    print("=" * 60)
+
+    for threads in (1, args.threads):
+        print(f"\n{threads} thread(s):")
+        for name, call in (('bare', bare), ('pooled', pooled)):
+            before = server.connections
+            start = time.perf_counter()
+            latencies = run(call, args.requests, threads)
+            report(name, server, before, latencies, time.perf_counter() - start)
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
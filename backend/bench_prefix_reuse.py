@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark: how much of each persona's prompts Ollama can reuse from its prompt cache.
+
+Starts the stub Ollama, with its prompt cache emulation, and the sync app
+on a local port. --students students each open a conversation with
+Holden, the wellbeing persona and a custom chatbot, in turn, each asking
+one of a few different questions. Reports the prefix reuse the app
+measured (from /api/health) and the mean reply latency, with the stub
+caching no prompts, one (like a single Ollama slot shared by every
+persona) and one per persona.
+
+Run: python bench_prefix_reuse.py --students 20
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+
+import requests
+
+from stub_ollama import start_stub_server, stub_url
+
+CHATBOT = {'name': 'Study Buddy', 'personality': 'A patient science tutor who explains with everyday examples',
+           'conversationStyle': 'friendly'}
+QUESTIONS = [
+    ('/api/chat/holden', ["Why do you hate phonies so much?", "What does the carousel scene mean?",
+                          "Why do you keep leaving schools?"]),
+    ('/api/chat/wellbeing', ["I had a fight with my best friend.", "I'm nervous about the school camp.",
+                             "My little brother keeps annoying me."]),
+    ('/api/chat/custom', ["Why is the sky blue?", "How do plants make food?", "What makes thunder?"])
+]
+
+
+def ask(base_url, path, message, student_id):
+    body = {'message': message, 'student_id': student_id}
+    if path.endswith('custom'):
+        body['chatbot_config'] = CHATBOT
+    start = time.perf_counter()
+    response = requests.post(f"{base_url}{path}", json=body)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt prefix reuse across students and personas")
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--delay', type=float, default=0.05, help='Stub fixed seconds per generation')
+    parser.add_argument('--prompt-token-delay', type=float, default=0.004, help='Stub seconds per evaluated prompt word')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, prompt_token_delay=args.prompt_token_delay,
+                               reply="Well, that's a good question to think about.")
+    os.environ['OLLAMA_URL'] = stub_url(server)
+    os.environ['OLLAMA_WARM_UP'] = 'False'
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'False'
+    os.environ['RATE_LIMIT_ENABLED'] = 'False'
+
+    import app
+    from personas import PrefixReuse
+    from werkzeug.serving import make_server
+    http_server = make_server('127.0.0.1', 0, app.create_app(start=False), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    print("=" * 72)
+    print(f"PREFIX REUSE BENCHMARK ({args.students} students x {len(QUESTIONS)} personas)")
+    print("=" * 72)
+    kinds = ('holden', 'wellbeing', 'custom')
+    print(f"\n{'cached prompts':<16}" + ''.join(f"{kind + ' reuse':>16}" for kind in kinds) + f"{'mean s':>10}")
+    for slots in (0, 1, len(QUESTIONS)):
+        server.prompt_cache_slots = slots
+        server.prompt_cache.clear()
+        app.prefix_reuse = PrefixReuse()
+        latencies = [ask(base_url, path, messages[student % len(messages)], f"bench-{slots}-{student}")
+                     for student in range(args.students) for path, messages in QUESTIONS]
+        reuse = requests.get(f"{base_url}/api/health").json()['prefix_reuse']
+        print(f"{slots:<16}" + ''.join(f"{reuse[kind]['reuse_rate']:>16.0%}" for kind in kinds)
+              + f"{statistics.mean(latencies):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
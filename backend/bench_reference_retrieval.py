@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pasting all reference materials vs retrieving relevant chunks.
+
+Builds a custom chatbot whose reference materials are a long synthetic
+study guide (one section per topic), then asks one question per topic
+twice: once with the whole guide in the system prompt (the old
+behaviour) and once with only the BM25-selected chunks. Prints prompt
+size, generation latency and whether the relevant section was included.
+
+Run against a real Ollama (uses OLLAMA_URL / MODEL_NAME from .env):
+    python bench_reference_retrieval.py
+Or offline against the stub server:
+    python bench_reference_retrieval.py --stub
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+
+TOPICS = [
+    'Pencey Prep', 'Stradlater', 'Ackley', 'Allie and the baseball mitt', 'Phoebe',
+    'the ducks in the Central Park lagoon', 'Mr. Antolini', 'Sunny and Maurice',
+    'Jane Gallagher', 'Sally Hayes', 'the Museum of Natural History', 'the carousel',
+    'Mr. Spencer', 'the red hunting hat', 'the Edmont Hotel', 'D.B. in Hollywood',
+    'the nuns at breakfast', 'Carl Luce', 'the record for Phoebe', 'the fencing team'
+]
+
+FILLER = (
+    "the narrator describes his feelings about people and places in long digressions "
+    "students should consider how tone voice and unreliable narration shape the reader's "
+    "view of events and note where the text contrasts innocence with adult phoniness"
+).split()
+
+
+def study_guide(words_per_section, rng):
+    sections = []
+    for topic in TOPICS:
+        words = rng.choices(FILLER, k=words_per_section)
+        for _ in range(4):
+            words.insert(rng.randrange(len(words)), topic)
+        sections.append(f"Section on {topic}.\n{' '.join(words)}.")
+    return '\n\n'.join(sections)
+
+
+def ask(app, chatbot_config, message):
+    """Generate one reply, returning (prompt, seconds)"""
+    key, prompt, context = app.plan_turn(app.compile_chatbot(chatbot_config), message, [])
+    start = time.perf_counter()
+    response = app.ollama.generate(app.generation_payload(prompt, app.CUSTOM_OPTIONS, context), timeout=300)
+    response.raise_for_status()
+    return prompt, time.perf_counter() - start
+
+
+def run(app, chatbot_config, full_paste):
+    # A budget larger than the guide makes the chatbot paste it in full
+    budget = app.REFERENCE_TOKEN_BUDGET
+    if full_paste:
+        app.REFERENCE_TOKEN_BUDGET = 10 ** 9
+    try:
+        results = []
+        for topic in TOPICS:
+            prompt, seconds = ask(app, chatbot_config, f"What is important about {topic}?")
+            # Did any of the topic's section reach the model (ignoring the question itself)?
+            results.append((app.estimate_tokens(prompt), seconds, topic in prompt.rsplit('Student:', 1)[0]))
+        return results
+    finally:
+        app.REFERENCE_TOKEN_BUDGET = budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reference materials: full paste vs retrieval")
+    parser.add_argument('--stub', action='store_true',
+                        help='Run against a local stub Ollama instead of OLLAMA_URL')
+    parser.add_argument('--prompt-token-delay', type=float, default=0.0005,
+                        help='Stub only: seconds to evaluate each prompt word')
+    parser.add_argument('--words-per-section', type=int, default=400)
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_ollama import start_stub_server, stub_url
+        server = start_stub_server(prompt_token_delay=args.prompt_token_delay,
+                                   reply="Here's what matters about that part of the book.")
+        os.environ['OLLAMA_URL'] = stub_url(server)
+    # Measure every turn from scratch, without KV context reuse
+    os.environ['CONTEXT_REUSE_ENABLED'] = 'False'
+
+    import app
+
+    guide = study_guide(args.words_per_section, random.Random(7))
+    chatbot_config = {
+        'name': 'Study Buddy',
+        'personality': 'A patient English tutor helping with The Catcher in the Rye',
+        'conversationStyle': 'friendly',
+        'referenceMaterials': guide
+    }
+
+    start = time.perf_counter()
+    app.reference_indexes.get(guide)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    print("=" * 60)
+    print(f"REFERENCE RETRIEVAL BENCHMARK ({app.OLLAMA_URL}, {app.MODEL_NAME})")
+    print(f"Reference materials: {len(guide)} chars, ~{app.estimate_tokens(guide)} tokens, "
+          f"indexed in {build_ms:.1f}ms")
+    print("=" * 60)
+
+    for label, full_paste in (('full paste', True), ('retrieval', False)):
+        results = run(app, chatbot_config, full_paste)
+        tokens = [tokens for tokens, _, _ in results]
+        latencies = [seconds * 1000 for _, seconds, _ in results]
+        found = sum(1 for _, _, hit in results if hit)
+        print(f"  {label:<11} prompt ~{statistics.mean(tokens):7.0f} tokens  "
+              f"mean {statistics.mean(latencies):8.1f}ms  max {max(latencies):8.1f}ms  "
+              f"relevant section included {found}/{len(results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: legacy substring keyword scan vs the compiled SafetyScanner.
+
+Builds a synthetic corpus of student messages and scans it with both the
+old `any(keyword in message_lower ...)` approach and the Aho-Corasick
+scanner, at the current phrase list size and with hundreds of extra
+counsellor phrases added.
+
+Run: python bench_safety_scanner.py --messages 20000 --extra-phrases 500
+"""
+
+import argparse
+import random
+import time
+
+from safety_scanner import SafetyScanner
+
+CRISIS_KEYWORDS = [
+    'suicide', 'kill myself', 'want to die', 'end my life',
+    'self harm', 'cutting', 'nobody would care if',
+    'better off without me', 'end it all', 'no point living',
+    'overdose', 'overdosed', 'overdoses', 'suicides',
+    'jump off', 'hang myself', 'shoot myself'
+]
+
+CONCERN_KEYWORDS = [
+    'depressed', 'anxiety', 'panic attack', 'can\'t cope',
+    'panic attacks', 'worthless', 'worthlessness', 'hopeless', 'hopelessness',
+    'nobody likes me', 'bullied', 'scared', 'alone', 'hate myself', 'stupid',
+    'failure', 'failures', 'cant sleep', 'cant eat', 'throwing up', 'hurting'
+]
+
+FILLER = (
+    "i have a maths test tomorrow and my friends want to go to the park after school "
+    "but mum says i need to study first which is fair i guess the essay on holden is due "
+    "friday and i still dont get what the carousel means my sister borrowed my charger "
+    "again and the bus was late so i missed the start of science class today"
+).split()
+
+
+def legacy_check(message, crisis, concern):
+    """The original check_message_safety keyword scan"""
+    message_lower = message.lower()
+    if any(keyword in message_lower for keyword in crisis):
+        return 'CRISIS'
+    elif any(keyword in message_lower for keyword in concern):
+        return 'CONCERN'
+    return 'SAFE'
+
+
+def make_corpus(count, phrases, rng):
+    corpus = []
+    for _ in range(count):
+        words = rng.choices(FILLER, k=rng.randint(5, 60))
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(phrases))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def extra_phrases(count, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [
+        ' '.join(''.join(rng.choices(letters, k=rng.randint(4, 9))) for _ in range(rng.randint(1, 3)))
+        for _ in range(count)
+    ]
+
+
+def timed(fn, corpus):
+    start = time.perf_counter()
+    for message in corpus:
+        fn(message)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Safety keyword scanner micro-benchmark")
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--extra-phrases', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    extra = extra_phrases(args.extra_phrases, rng)
+
+    print("=" * 60)
+    print(f"SAFETY SCANNER BENCHMARK ({args.messages} messages)")
+    print("=" * 60)
+
+    for label, crisis, concern in (
+        ('built-in phrases', CRISIS_KEYWORDS, CONCERN_KEYWORDS),
+        (f'+{len(extra)} phrases', CRISIS_KEYWORDS, CONCERN_KEYWORDS + extra)
+    ):
+        corpus = make_corpus(args.messages, crisis + concern, rng)
+        start = time.perf_counter()
+        scanner = SafetyScanner({'CRISIS': crisis, 'CONCERN': concern})
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        legacy = timed(lambda m: legacy_check(m, crisis, concern), corpus)
+        compiled = timed(scanner.classify, corpus)
+
+        print(f"\n{label} ({len(crisis) + len(concern)} total, compiled in {compile_ms:.1f}ms):")
+        print(f"  legacy substring scan  {legacy / len(corpus) * 1e6:8.2f} us/message")
+        print(f"  compiled scanner       {compiled / len(corpus) * 1e6:8.2f} us/message "
+              f"({legacy / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: readiness probe cost and first-reply latency after a model eviction.
+
+Runs against the stub Ollama, which takes --load-seconds to load its model
+whenever it is not in memory. First it polls /api/test the way a load
+balancer would, with the cached readiness check and with ?deep=true, and
+reports the time and Ollama requests per probe. Then it evicts the model
+and times the next student's reply with the background warm-up off and on.
+
+Run: python bench_warm_up.py --load-seconds 2 --probes 20
+"""
+
+import argparse
+import os
+import time
+
+from stub_ollama import start_stub_server, stub_url
+
+
+def poll(client, server, path, probes):
+    """Mean seconds and stub requests per /api/test probe"""
+    requests_before = server.requests
+    start = time.perf_counter()
+    for _ in range(probes):
+        client.get(path)
+    elapsed = time.perf_counter() - start
+    return elapsed / probes, (server.requests - requests_before) / probes
+
+
+def first_reply_after_eviction(app, client, server, warm_up, idle_seconds):
+    """Seconds to answer the first chat after Ollama unloaded the model"""
+    node = app.ollama.nodes[0]
+    node.warm_model = app.MODEL_NAME if warm_up else None
+    server.loaded = False
+    # The next health probe sees the eviction; give a warm-up time to finish
+    app.ollama.check()
+    time.sleep(idle_seconds)
+    start = time.perf_counter()
+    client.post('/api/chat/holden', json={
+        'message': f"Why did you leave Pencey? ({time.time()})",
+        'student_id': 'bench-student'
+    })
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /api/test cost and first-reply latency after an eviction")
+    parser.add_argument('--load-seconds', type=float, default=2.0, help='Stub model load time')
+    parser.add_argument('--generate-seconds', type=float, default=0.3, help='Stub time per generation')
+    parser.add_argument('--probes', type=int, default=20, help='/api/test polls per mode')
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.generate_seconds, load_seconds=args.load_seconds,
+                               reply="Boy, that kind of stuff really kills me.")
+    os.environ['OLLAMA_URL'] = stub_url(server)
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'False'
+
+    import app
+    client = app.create_app(start=False).test_client()
+    app.ollama.check()
+    while not app.ollama.nodes[0].has_loaded(app.MODEL_NAME):
+        time.sleep(0.05)
+
+    print("=" * 60)
+    print(f"WARM-UP AND READINESS BENCHMARK (stub load {args.load_seconds}s)")
+    print("=" * 60)
+
+    print(f"\n{'/api/test':<18} {'ms/probe':>10} {'Ollama requests/probe':>24}")
+    for label, path in (('cached', '/api/test'), ('deep=true', '/api/test?deep=true')):
+        seconds, requests_per_probe = poll(client, server, path, args.probes)
+        print(f"{label:<18} {seconds * 1000:>10.1f} {requests_per_probe:>24.1f}")
+
+    idle = args.load_seconds + 0.5
+    print(f"\nFirst reply after the model was evicted ({idle:.1f}s idle before the student asks):")
+    for label, warm_up in (('warm-up off', False), ('warm-up on', True)):
+        seconds = first_reply_after_eviction(app, client, server, warm_up, idle)
+        print(f"  {label:<12} {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
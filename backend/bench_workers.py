@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Benchmark: startup and throughput of app.py against the multi-worker serve.py.
+
+Startup: launches each server while Ollama is still down and brings the
+stub up --ollama-after seconds later. Reports when the port answered and
+when /api/test first reported ready. (Before background startup checks,
+app.py exited at once when Ollama was down.)
+
+Throughput: with a stub that answers instantly, --concurrency students
+send multi-turn chats for --duration seconds, so the backend's own work
+per request (safety checks, prompt building, JSON) is the bottleneck.
+Reports requests per second and p50/p95 latency for app.py and for
+serve.py with 1 and --workers workers.
+
+Run: python bench_workers.py --workers 4 --concurrency 32 --duration 10
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench_async_concurrency import free_port, wait_until_ready
+from bench_load import percentile
+from stub_ollama import start_stub_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HISTORY = [
+    {'role': 'user', 'content': "I've had a rough week with exams and my friends."},
+    {'role': 'assistant', 'content': "That sounds like a lot at once. What has been the hardest part?"}
+] * 6
+
+
+def launch(script, ollama_url, workers=None, **settings):
+    port = free_port()
+    env = dict(
+        os.environ,
+        OLLAMA_URL=ollama_url,
+        PORT=str(port),
+        LOG_LEVEL='WARNING',
+        LOG_FILE=os.devnull,
+        SAFETY_LOG_DIR=tempfile.mkdtemp(),
+        CHATBOT_REGISTRY_DIR='',
+        OLLAMA_WARM_UP='False',
+        # Every simulated student shares one IP; measure capacity, not the limiter
+        RATE_LIMIT_ENABLED='False',
+        **settings
+    )
+    if workers:
+        env['SERVER_WORKERS'] = str(workers)
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, script)], env=env, cwd=HERE,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def stop(server):
+    server.terminate()
+    server.wait()
+
+
+async def time_startup(url, server, ollama_after, ollama_port):
+    """Seconds until the port answered and until /api/test was ready, starting the stub part-way"""
+    started = time.perf_counter()
+    bound = ready = stub = None
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+        while ready is None and time.perf_counter() - started < 60:
+            if stub is None and time.perf_counter() - started >= ollama_after:
+                stub = start_stub_server(port=ollama_port)
+            if server.poll() is not None:
+                break
+            try:
+                async with session.get(f"{url}/api/test") as response:
+                    bound = bound or time.perf_counter() - started
+                    if response.status == 200:
+                        ready = time.perf_counter() - started
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.02)
+    if stub is not None:
+        stub.shutdown()
+    return bound, ready, server.poll()
+
+
+async def drive(url, concurrency, duration):
+    latencies = []
+    errors = 0
+
+    async def student(session, index):
+        nonlocal errors
+        turn = 0
+        while time.monotonic() < deadline:
+            turn += 1
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{url}/api/chat/wellbeing", json={
+                    'message': f"Exams are stressing me out, day {turn} ({index})",
+                    'student_id': f"bench-{index}",
+                    'conversation_history': HISTORY
+                }) as response:
+                    await response.read()
+                    if response.status == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        deadline = time.monotonic() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*(student(session, i) for i in range(concurrency)))
+        wall = time.perf_counter() - started
+    return sorted(latencies), errors, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup and throughput of app.py against serve.py")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32, help='Students chatting at once')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of traffic per server')
+    parser.add_argument('--ollama-after', type=float, default=2.0,
+                        help='Seconds after launch before the stub Ollama comes up')
+    args = parser.parse_args()
+
+    setups = [('app.py', 'app.py', None), ('serve.py x1', 'serve.py', 1),
+              (f"serve.py x{args.workers}", 'serve.py', args.workers)]
+
+    print("=" * 72)
+    print(f"STARTUP (Ollama down for the first {args.ollama_after:g}s)")
+    print("=" * 72)
+    for label, script, workers in setups[::2]:
+        ollama_port = free_port()
+        server, url = launch(script, f"http://127.0.0.1:{ollama_port}", workers, STARTUP_RETRY_INTERVAL='0.5')
+        try:
+            bound, ready, exited = asyncio.run(time_startup(url, server, args.ollama_after, ollama_port))
+        finally:
+            stop(server)
+        if exited is not None:
+            print(f"  {label:<14} exited with status {exited}")
+        else:
+            print(f"  {label:<14} port open {bound:5.2f}s   ready {ready:5.2f}s")
+
+    print("\n" + "=" * 72)
+    print(f"THROUGHPUT ({args.concurrency} students, {args.duration:g}s, instant stub Ollama)")
+    print("=" * 72)
+    stub_port = free_port()
+    stub = subprocess.Popen([sys.executable, os.path.join(HERE, 'stub_ollama.py'), '--port', str(stub_port)],
+                            cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        print(f"\n  {'':<14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+        for label, script, workers in setups:
+            server, url = launch(script, f"http://127.0.0.1:{stub_port}", workers,
+                                 # Ollama isn't the bottleneck here
+                                 GENERATION_MAX_CONCURRENT=str(args.concurrency))
+            try:
+                asyncio.run(wait_until_ready(url))
+                latencies, errors, wall = asyncio.run(drive(url, args.concurrency, args.duration))
+            finally:
+                stop(server)
+            print(f"  {label:<14} {len(latencies) / wall:>8.1f} {percentile(latencies, 0.50) * 1000:>8.0f} "
+                  f"{percentile(latencies, 0.95) * 1000:>8.0f} {errors:>7}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
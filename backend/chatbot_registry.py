@@ -0,0 +1,173 @@
+"""
+Server-side registry of teacher-defined chatbots.
+
+A chatbot config is registered once and gets back a stable ID derived
+from its contents, so registering the same config again returns the same
+ID. Chat requests can then send just that ID instead of the whole
+config. The registry keeps each chatbot in its compiled form (system
+prompt, persona, fallbacks), so a turn doesn't rebuild them. The
+in-memory store is a bounded LRU. If a directory is configured, each
+config is also saved there as <id>.json and is reloaded transparently
+after eviction or a restart. Several processes can share the directory;
+with check_disk each lookup also confirms the file is still there, so a
+chatbot one process removes is gone for all of them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# The parts of a config that shape the chatbot; anything else the client sends is ignored
+CHATBOT_FIELDS = ('name', 'personality', 'conversationStyle', 'referenceMaterials')
+
+_CHATBOT_ID = re.compile(r'^[0-9a-f]{16}$')
+
+
+def chatbot_fields(config):
+    """The config reduced to the fields that affect replies"""
+    return {field: config[field] for field in CHATBOT_FIELDS if config.get(field)}
+
+
+def chatbot_id(config):
+    """Content-derived ID for a chatbot config"""
+    canonical = json.dumps(chatbot_fields(config), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class ChatbotRegistry:
+    """Bounded LRU of compiled chatbots with optional on-disk configs"""
+
+    def __init__(self, compile_chatbot, max_chatbots=500, path=None, check_disk=False):
+        self.compile_chatbot = compile_chatbot
+        self.max_chatbots = max_chatbots
+        self.path = path
+        self.check_disk = bool(path) and check_disk
+        self._chatbots = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def register(self, config):
+        """Compile and store a config.
+
+        Returns (chatbot ID, compiled chatbot, created), where created is
+        False if the same config was already registered and in memory.
+        """
+        config = chatbot_fields(config)
+        key = chatbot_id(config)
+        with self._lock:
+            compiled = self._chatbots.get(key)
+            if compiled is not None:
+                self._chatbots.move_to_end(key)
+                return key, compiled, False
+        compiled = self.compile_chatbot(config)
+        self._insert(key, compiled)
+        if self.path:
+            self._save(key, config)
+        return key, compiled, True
+
+    def get(self, key):
+        """Compiled chatbot for an ID, or None if it isn't registered"""
+        if not _CHATBOT_ID.match(key or ''):
+            return None
+        if self.check_disk and not os.path.exists(self._file(key)):
+            # Removed by another process
+            with self._lock:
+                self._chatbots.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            compiled = self._chatbots.get(key)
+            if compiled is not None:
+                self._chatbots.move_to_end(key)
+                self.hits += 1
+                return compiled
+
+        config = self._load(key)
+        if config is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        compiled = self.compile_chatbot(config)
+        self._insert(key, compiled)
+        with self._lock:
+            self.loads += 1
+        return compiled
+
+    def remove(self, key):
+        """Forget a chatbot; returns False if it wasn't registered"""
+        if not _CHATBOT_ID.match(key or ''):
+            return False
+        with self._lock:
+            found = self._chatbots.pop(key, None) is not None
+        if self.path:
+            try:
+                os.remove(self._file(key))
+                found = True
+            except FileNotFoundError:
+                pass
+        return found
+
+    def _insert(self, key, compiled):
+        with self._lock:
+            self._chatbots[key] = compiled
+            self._chatbots.move_to_end(key)
+            while len(self._chatbots) > self.max_chatbots:
+                self._chatbots.popitem(last=False)
+                self.evictions += 1
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def _save(self, key, config):
+        # Write then rename so a crash never leaves a half-written config. Each save has its
+        # own temporary file, as other workers sharing the directory may save the same chatbot.
+        tmp = None
+        try:
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.path, prefix=f"{key}.",
+                                             suffix='.tmp', delete=False) as f:
+                tmp = f.name
+                json.dump(config, f, ensure_ascii=False)
+            os.replace(tmp, self._file(key))
+        except OSError as e:
+            logger.error("Could not save chatbot %s: %s", key, e)
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def _load(self, key):
+        if not self.path:
+            return None
+        try:
+            with open(self._file(key), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error("Could not load chatbot %s: %s", key, e)
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'chatbots': len(self._chatbots),
+                'max_chatbots': self.max_chatbots,
+                'hits': self.hits,
+                'misses': self.misses,
+                'loaded_from_disk': self.loads,
+                'evictions': self.evictions,
+                'persisted': bool(self.path)
+            }
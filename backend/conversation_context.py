@@ -0,0 +1,113 @@
+"""
+Per-conversation Ollama KV context store.
+
+/api/generate returns a `context` array encoding the conversation so far.
+Sending it back with the next turn lets Ollama reuse its cached prompt
+evaluation, so only the new student message has to be prompt-evaluated
+instead of the whole system prompt and history again.
+"""
+
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+def history_fingerprint(conversation_history):
+    """Fingerprint a conversation by its length and the student's turns.
+
+    Assistant turns are left out on purpose: the client may decorate them
+    (e.g. the wellbeing concern note) and they came from Ollama anyway.
+    """
+    digest = hashlib.sha1(str(len(conversation_history)).encode('utf-8'))
+    for msg in conversation_history:
+        if msg.get('role') == 'user':
+            digest.update(b'\x1f')
+            digest.update(str(msg.get('content', '')).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ConversationContextStore:
+    """Bounded LRU of Ollama context vectors keyed by conversation.
+
+    Contexts are kept as compact int arrays. Conversations whose context
+    grows past max_tokens are dropped (the next turn rebuilds the prompt
+    from recent history), and conversations idle for longer than
+    idle_timeout seconds are evicted.
+    """
+
+    def __init__(self, max_conversations=500, max_tokens=1536, idle_timeout=900):
+        self.max_conversations = max_conversations
+        self.max_tokens = max_tokens
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (fingerprint, context array, last_used)
+        self._tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, conversation_history):
+        """Return the stored context if it continues exactly this history"""
+        fingerprint = history_fingerprint(conversation_history or [])
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self._entries[key] = (entry[0], entry[1], time.monotonic())
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1].tolist()
+
+    def put(self, key, conversation_history, message, context):
+        """Store the context returned for the turn that answered `message`"""
+        if not context or len(context) > self.max_tokens:
+            self.discard(key)
+            return
+
+        history = list(conversation_history or [])
+        history.append({'role': 'user', 'content': message})
+        history.append({'role': 'assistant'})
+        entry = (history_fingerprint(history), array('l', context), time.monotonic())
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._tokens += len(entry[1])
+            while len(self._entries) > self.max_conversations:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._tokens -= len(entry[1])
+
+    def _evict_idle(self):
+        # Entries are in least-recently-used order, so idle ones are at the front
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[2] > cutoff:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle()
+            return {
+                'conversations': len(self._entries),
+                'context_tokens': self._tokens,
+                'approx_bytes': self._tokens * array('l').itemsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,147 @@
+"""
+Server-side conversation store for session mode.
+
+Normally the browser sends the whole conversation with every message. In
+session mode the client sends a session_id and only the new message, and
+the backend keeps the conversation here, keyed by persona, student and
+session. Each message is held as a single bytes object (a role byte
+followed by the UTF-8 content), so a message costs its text plus a few
+dozen bytes. The store is bounded by total bytes and conversation count,
+evicting least-recently-used conversations, and drops conversations left
+idle for longer than idle_timeout seconds.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_USER = b'u'
+_ASSISTANT = b'a'
+
+# Interpreter cost of each stored message beyond its content: the bytes
+# object header and its slot in the conversation's list
+MESSAGE_OVERHEAD = sys.getsizeof(b'') + 8
+
+
+def encode_message(role, content, max_chars):
+    marker = _USER if role == 'user' else _ASSISTANT
+    return marker + str(content or '')[:max_chars].encode('utf-8')
+
+
+def decode_message(entry):
+    role = 'user' if entry[0] == _USER[0] else 'assistant'
+    return {'role': role, 'content': entry[1:].decode('utf-8')}
+
+
+class ConversationStore:
+    """Bounded LRU of conversations stored as compact encoded messages.
+
+    Conversations longer than max_messages lose their oldest messages,
+    and any single message is cut to max_message_chars.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_conversations=20000,
+                 max_messages=200, max_message_chars=8000, idle_timeout=3600):
+        self.max_bytes = max_bytes
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.max_message_chars = max_message_chars
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (messages, size, last_used)
+        self._bytes = 0
+        self._messages = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """The stored conversation as a list of {'role', 'content'} dicts, or None"""
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = (entry[0], entry[1], time.monotonic())
+            self._entries.move_to_end(key)
+            self.hits += 1
+            messages = list(entry[0])
+        return [decode_message(message) for message in messages]
+
+    def replace(self, key, conversation_history):
+        """Store a whole conversation sent by the client, starting or restoring a session"""
+        messages = [
+            encode_message(msg.get('role'), msg.get('content', ''), self.max_message_chars)
+            for msg in (conversation_history or [])[-self.max_messages:]
+            if isinstance(msg, dict)
+        ]
+        with self._lock:
+            self._remove(key)
+            self._insert(key, messages)
+
+    def append(self, key, message, reply):
+        """Add a completed turn: the student's message and the reply they were sent.
+
+        Returns False, storing nothing, if the conversation was evicted or
+        expired while the turn was generated. Its next request then gets an
+        unknown session, so the client resends the whole history instead of
+        carrying on from this turn alone.
+        """
+        new = [
+            encode_message('user', message, self.max_message_chars),
+            encode_message('assistant', reply, self.max_message_chars)
+        ]
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            messages = entry[0]
+            self._remove(key)
+            messages.extend(new)
+            self._insert(key, messages[-self.max_messages:])
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _insert(self, key, messages):
+        # Caller holds the lock and has removed any previous entry for key
+        size = sum(len(message) for message in messages) + MESSAGE_OVERHEAD * len(messages)
+        self._entries[key] = (messages, size, time.monotonic())
+        self._bytes += size
+        self._messages += len(messages)
+        while self._entries and (len(self._entries) > self.max_conversations or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            self._messages -= len(entry[0])
+
+    def _evict_idle(self):
+        # Entries are in least-recently-used order, so idle ones are at the front
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[2] > cutoff:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle()
+            return {
+                'conversations': len(self._entries),
+                'messages': self._messages,
+                'approx_bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
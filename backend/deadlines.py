@@ -0,0 +1,160 @@
+"""
+End-to-end deadlines for chat requests, and the generations abandoned when they pass.
+
+A client says how long it will wait for a reply with the X-Request-Timeout
+header (seconds); chat requests without one get the server's default. The
+Deadline is held in a context variable for the request, like its request
+ID, so the generation queue and the Ollama calls can size their waits and
+timeouts from the time that is left without it being passed around.
+
+A generation is abandoned when its deadline passes or its student
+disconnects: the upstream connection is closed, which stops Ollama
+generating a reply nobody will read. One whose student is already gone
+by the time it gets a generation slot is skipped. AbandonedGenerations
+counts both, and the Ollama time abandoned generations used, so wasted
+capacity shows up in /api/health.
+"""
+
+import contextvars
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+# Timers can fire a moment before the deadline they were set from
+_SLACK = 0.01
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class GenerationAbandoned(Exception):
+    """Raised between reply chunks once nobody is waiting for the reply"""
+
+    def __init__(self, reason):
+        super().__init__(f"Generation abandoned ({reason})")
+        self.reason = reason
+
+
+def parse_timeout(value, default, maximum):
+    """Seconds a client will wait, from its header value, capped at `maximum`"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return default
+    if seconds != seconds or seconds <= 0:
+        return default
+    return min(seconds, maximum)
+
+
+def socket_closed(sock):
+    """Whether the client has closed the connection a reply is still due on"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A closed connection reads as end of file; anything else is still open
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        # e.g. TLS sockets, which can't be peeked; assume still connected
+        return False
+    except OSError:
+        return True
+
+
+class Deadline:
+    """When a request's client stops waiting, and optionally its connection to watch"""
+
+    def __init__(self, seconds, connection=None):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self.connection = connection
+
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def elapsed(self):
+        """Seconds since the request started"""
+        return time.monotonic() - (self.expires - self.seconds)
+
+    def expired(self):
+        return time.monotonic() >= self.expires - _SLACK
+
+    def cap(self, timeout):
+        """`timeout`, or the time left if that is shorter"""
+        return min(timeout, self.remaining())
+
+    def abandoned(self):
+        """'deadline' or 'disconnected' if nobody is waiting for the reply any more, else None"""
+        if self.expired():
+            return 'deadline'
+        if self.connection is not None and socket_closed(self.connection):
+            return 'disconnected'
+        return None
+
+    def detached(self):
+        """The same deadline without the connection, for work shared with other requests"""
+        shared = Deadline(self.seconds)
+        shared.expires = self.expires
+        return shared
+
+
+def set_deadline(deadline):
+    """Make `deadline` (or None) the current thread's or task's deadline"""
+    _deadline.set(deadline)
+    return deadline
+
+
+def current_deadline():
+    return _deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Run a block under `deadline`, e.g. a shared generation on another request's thread"""
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def time_left():
+    """Seconds until the current deadline, or None if there is none"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+
+class AbandonedGenerations:
+    """Generations stopped or skipped because their deadline passed or their student left, per persona kind"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (kind, reason) -> [generations stopped, seconds they ran, generations skipped]
+        self._counts = {}
+
+    def _counts_for(self, kind, reason):
+        return self._counts.setdefault((kind, reason), [0, 0.0, 0])
+
+    def record(self, kind, reason, seconds):
+        """Count a generation stopped after running for `seconds`"""
+        with self._lock:
+            counts = self._counts_for(kind, reason)
+            counts[0] += 1
+            counts[1] += seconds
+
+    def skip(self, kind, reason):
+        """Count a generation never started"""
+        with self._lock:
+            self._counts_for(kind, reason)[2] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for (kind, reason), (generations, seconds, skipped) in self._counts.items():
+                stats.setdefault(kind, {})[reason] = {
+                    'generations': generations,
+                    'seconds': round(seconds, 3),
+                    'skipped': skipped
+                }
+            return stats
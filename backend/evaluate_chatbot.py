@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Try a custom chatbot on a list of sample student messages.
+
+Sends the chatbot (a config JSON file, or the ID of a registered chatbot)
+and the messages to /api/chatbots/evaluate, then prints each reply as
+soon as it is ready with its timing and safety scan. Messages are read
+one per line from a text file, or as a JSON list.
+
+Run: python evaluate_chatbot.py questions.txt --config chatbot.json
+     python evaluate_chatbot.py questions.txt --chatbot-id 3f2a9c1e0b7d4e65 --output results.json
+
+A config file holds the fields the chatbot builder sends:
+{"name": "Ms Frizzle", "personality": "...", "conversationStyle": "encouraging",
+ "referenceMaterials": "..."}
+"""
+
+import argparse
+import json
+import sys
+
+import requests
+
+
+def read_messages(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith('.json'):
+        return json.loads(text)
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def read_events(response):
+    """(event, payload) pairs from a Server-Sent Events response"""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith('event: '):
+            event = line[len('event: '):]
+        elif line.startswith('data: '):
+            yield event, json.loads(line[len('data: '):])
+            event = None
+
+
+def print_result(result, total):
+    flags = ''
+    if result['safety_level'] != 'SAFE':
+        flags += f"  message {result['safety_level']}: {', '.join(result['safety_matched'])}"
+    if result['response_safety_level'] != 'SAFE':
+        flags += f"  reply {result['response_safety_level']}: {', '.join(result['response_safety_matched'])}"
+    print(f"\n[{result['index'] + 1}/{total}] {result['status']}  {result['seconds']:.2f}s "
+          f"(queued {result['queue_seconds']:.2f}s){flags}")
+    print(f"  Q: {result['message']}")
+    print(f"  A: {result['response']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a custom chatbot on sample messages")
+    parser.add_argument('messages', help='Text file with one message per line, or a .json list')
+    chatbot = parser.add_mutually_exclusive_group(required=True)
+    chatbot.add_argument('--config', help='Chatbot config JSON file')
+    chatbot.add_argument('--chatbot-id', help='ID of a chatbot registered with POST /api/chatbots')
+    parser.add_argument('--url', default='http://localhost:5000', help='Backend base URL')
+    parser.add_argument('--output', help='Also write all results, in message order, to this JSON file')
+    args = parser.parse_args()
+
+    messages = read_messages(args.messages)
+    body = {'messages': messages}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            body['chatbot_config'] = json.load(f)
+    else:
+        body['chatbot_id'] = args.chatbot_id
+
+    response = requests.post(f"{args.url}/api/chatbots/evaluate", json=body, stream=True,
+                             timeout=(5, None))
+    if response.status_code != 200:
+        print(f"Evaluation failed ({response.status_code}): {response.text}")
+        sys.exit(1)
+
+    results = []
+    summary = None
+    for event, payload in read_events(response):
+        if event == 'result':
+            results.append(payload)
+            print_result(payload, len(messages))
+        elif event == 'done':
+            summary = payload
+
+    if summary:
+        print(f"\n{summary['count']} messages in {summary['seconds']:.1f}s: "
+              + ', '.join(f"{count} {status}" for status, count in sorted(summary['statuses'].items())))
+        if summary['flagged']:
+            print(f"Safety flags on messages: {', '.join(str(index + 1) for index in summary['flagged'])}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(sorted(results, key=lambda result: result['index']), f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
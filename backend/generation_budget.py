@@ -0,0 +1,134 @@
+"""
+Reply budgets that adapt to load, to hold chat latency near a p95 target.
+
+Ollama keeps generating until the model stops or num_predict tokens are
+out, so a reply's length sets most of its latency, and under load every
+queued request also waits for the replies ahead of it. GenerationBudget
+chooses each chat generation's num_predict when it gets its slot:
+
+- the time it may take is the latency target split between it and the
+  generations queued behind it for each slot, and no more than is left of
+  the target after the time its request has already spent queued
+- that is scaled by a correction factor that tracks the observed p95:
+  every finished request nudges it down when it ran over the target and
+  up when it didn't, in the ratio that settles with 5% of requests over
+- and converted to tokens at the persona's observed generation speed,
+  after its usual prompt-eval time, between a minimum reply length and
+  the persona's own num_predict
+
+With an empty queue a reply gets as long as the target allows; a growing
+queue trims replies so it drains in time, and they grow back as it clears.
+"""
+
+import math
+import threading
+from collections import deque
+
+# Weight of the newest generation in the moving averages of speed and prompt-eval time
+_SMOOTHING = 0.2
+
+# The correction factor never trims replies below this share of their load-based budget
+_MIN_FACTOR = 0.2
+
+
+def context_size(tokens, step=512):
+    """Smallest multiple of `step` holding `tokens`, for Ollama's num_ctx"""
+    return max(step, math.ceil(tokens / step) * step)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class GenerationBudget:
+    """Chooses each chat generation's num_predict from queue depth, generation speed and observed latency"""
+
+    def __init__(self, target_p95, slots, min_tokens=96, kinds=None, quantile=0.95, step=0.2, window=500):
+        self.target = target_p95
+        self.slots = max(slots, 1)
+        self.min_tokens = min_tokens
+        # Persona kinds whose replies are budgeted; None for all of them
+        self.kinds = kinds
+        self.quantile = quantile
+        self.step = step
+        self.factor = 1.0
+        self._lock = threading.Lock()
+        self._speed = {}  # kind -> tokens generated per second
+        self._prompt_eval = {}  # kind -> prompt-eval seconds
+        self._latencies = deque(maxlen=window)
+        self._budgets = {}  # kind -> [budgets chosen, below the maximum, tokens, replies cut short]
+
+    def applies(self, kind):
+        return self.kinds is None or kind in self.kinds
+
+    def choose(self, kind, max_tokens, queue_depth, elapsed=0.0, time_left=None):
+        """num_predict for a generation starting now, `elapsed` seconds into its request"""
+        with self._lock:
+            speed = self._speed.get(kind)
+            if speed is None and self._speed:
+                # It's the same model whatever the persona
+                speed = sum(self._speed.values()) / len(self._speed)
+            prompt_eval = self._prompt_eval.get(kind, 0.0)
+            factor = self.factor
+        if speed is None:
+            # Nothing generated yet to size a budget from
+            budget = max_tokens
+        else:
+            seconds = factor * min(self.target - elapsed, self.target / (1 + queue_depth / self.slots))
+            if time_left is not None:
+                seconds = min(seconds, time_left)
+            budget = int((seconds - prompt_eval) * speed)
+        budget = max(min(budget, max_tokens), min(self.min_tokens, max_tokens))
+        with self._lock:
+            counts = self._budgets.setdefault(kind, [0, 0, 0, 0])
+            counts[0] += 1
+            counts[1] += budget < max_tokens
+            counts[2] += budget
+        return budget
+
+    def observe(self, kind, response_json):
+        """Update a persona's speed and prompt-eval time from a finished generation's timings"""
+        eval_count = response_json.get('eval_count', 0)
+        eval_seconds = response_json.get('eval_duration', 0) / 1e9
+        prompt_eval = response_json.get('prompt_eval_duration', 0) / 1e9
+        with self._lock:
+            if eval_count and eval_seconds > 0:
+                speed = eval_count / eval_seconds
+                self._speed[kind] = speed if kind not in self._speed else (
+                    (1 - _SMOOTHING) * self._speed[kind] + _SMOOTHING * speed)
+            self._prompt_eval[kind] = prompt_eval if kind not in self._prompt_eval else (
+                (1 - _SMOOTHING) * self._prompt_eval[kind] + _SMOOTHING * prompt_eval)
+            if response_json.get('done_reason') == 'length' and kind in self._budgets:
+                self._budgets[kind][3] += 1
+
+    def observe_latency(self, seconds):
+        """Nudge the correction factor with a budgeted request's latency up to the end of its reply"""
+        over = seconds > self.target
+        with self._lock:
+            self._latencies.append(seconds)
+            self.factor *= math.exp(self.step * ((1 - self.quantile) - over))
+            self.factor = min(max(self.factor, _MIN_FACTOR), 1.0)
+
+    def snapshot(self):
+        with self._lock:
+            observed = percentile(list(self._latencies), self.quantile)
+            return {
+                'target_p95_seconds': self.target,
+                'observed_p95_seconds': round(observed, 3) if observed is not None else None,
+                'factor': round(self.factor, 3),
+                'personas': {
+                    kind: {
+                        'tokens_per_second': round(self._speed[kind], 1) if kind in self._speed else None,
+                        'prompt_eval_seconds': round(self._prompt_eval.get(kind, 0.0), 3),
+                        'budgets': chosen,
+                        'trimmed': trimmed,
+                        'mean_num_predict': round(tokens / chosen) if chosen else None,
+                        'cut_short': cut_short
+                    }
+                    for kind, (chosen, trimmed, tokens, cut_short) in self._budgets.items()
+                }
+            }
@@ -0,0 +1,307 @@
+"""
+Priority-aware admission control in front of Ollama generations.
+
+Ollama on one CPU box can only generate a few replies at once. Every
+generation takes a slot from a GenerationScheduler. When all slots are
+busy, requests wait in a bounded priority queue: wellbeing conversations
+flagged CONCERN go first, then general wellbeing, then custom chatbots,
+then Holden. Within a priority, requests are ordered fair-share by
+owner (the student): each request is tagged one past its owner's
+previous request, or the scheduler's virtual time if that is later, so
+a student with five queued requests gets one turn for every turn of a
+student with one. When the queue is full, a new request bumps the last
+waiter in that order if it would be served before it, or is itself
+rejected. Rejection, or a wait that exceeds the limit or the time the
+request's client will still wait, raises SchedulerBusy so the route can
+answer 429.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+PRIORITY_WELLBEING_CONCERN = 0
+PRIORITY_WELLBEING = 1
+PRIORITY_CUSTOM = 2
+PRIORITY_HOLDEN = 3
+# Housekeeping such as prompt warming, only run when nobody is waiting
+PRIORITY_BACKGROUND = 4
+
+PRIORITY_NAMES = {
+    PRIORITY_WELLBEING_CONCERN: 'wellbeing_concern',
+    PRIORITY_WELLBEING: 'wellbeing',
+    PRIORITY_CUSTOM: 'custom',
+    PRIORITY_HOLDEN: 'holden',
+    PRIORITY_BACKGROUND: 'background'
+}
+
+
+class SchedulerBusy(Exception):
+    """Raised when a generation can't be admitted in time"""
+
+    def __init__(self, reason, queue_depth, retry_after):
+        super().__init__(f"Generation queue busy ({reason})")
+        self.reason = reason
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Re-raised in the worker when the scheduler is shared between processes
+        return type(self), (self.reason, self.queue_depth, self.retry_after)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'tag', 'seq', 'owner', 'granted', 'cancelled', 'evicted', 'signal')
+
+    def __init__(self, priority, tag, seq, owner, signal):
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.owner = owner
+        self.granted = False
+        self.cancelled = False
+        self.evicted = False
+        self.signal = signal
+
+    def __lt__(self, other):
+        return (self.priority, self.tag, self.seq) < (other.priority, other.tag, other.seq)
+
+
+class _SchedulerState:
+    """Slot and queue bookkeeping shared by the sync and async schedulers.
+
+    Callers must hold the scheduler's lock (or be on its event loop).
+    """
+
+    def __init__(self, max_concurrent, max_queue, max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._queue = []
+        self._queued = 0
+        self._seq = itertools.count()
+        # Fair-share tags: the tag of the last request granted a slot, and each owner's next tag
+        self._virtual = 0
+        self._owner_tags = {}
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'evicted': 0, 'timeout': 0, 'deadline': 0, 'cancelled': 0}
+        self.total_wait = 0.0
+
+    def fair_share_tag(self, owner):
+        """Tag for an owner's next request, counting it against the owner's share"""
+        if owner is None:
+            return self._virtual
+        tag = max(self._virtual, self._owner_tags.get(owner, 0))
+        self._owner_tags[owner] = tag + 1
+        return tag
+
+    def wait_limit(self, timeout):
+        """(seconds to wait, rejection reason) for a request whose client waits `timeout` more seconds"""
+        if timeout is None or timeout >= self.max_wait:
+            return self.max_wait, 'timeout'
+        return max(timeout, 0.0), 'deadline'
+
+    def reject(self, reason):
+        self.rejected[reason] += 1
+        return self.busy(reason)
+
+    def try_admit(self, priority, signal, owner=None):
+        """Take a free slot or join the queue.
+        
+        Returns (waiter, evicted): waiter is None if a slot was free, and
+        evicted is a waiter bumped out of a full queue, which the caller
+        must wake so it can fail fast.
+        """
+        tag = self.fair_share_tag(owner)
+        if self.active < self.max_concurrent and not self._queued:
+            self.active += 1
+            self.admitted += 1
+            self._advance(tag)
+            return None, None
+
+        waiter = _Waiter(priority, tag, next(self._seq), owner, signal)
+        evicted = None
+        if self._queued >= self.max_queue:
+            evicted = max((w for w in self._queue if not w.cancelled), default=None)
+            if evicted is None or not waiter < evicted:
+                raise self.reject('queue_full')
+            evicted.cancelled = True
+            evicted.evicted = True
+            self._queued -= 1
+            self.rejected['evicted'] += 1
+
+        heapq.heappush(self._queue, waiter)
+        self._queued += 1
+        return waiter, evicted
+
+    def cancel(self, waiter, reason='timeout'):
+        """Give up waiting; returns False if the slot was granted meanwhile"""
+        if waiter.granted or waiter.evicted:
+            return False
+        waiter.cancelled = True
+        self._queued -= 1
+        self.rejected[reason] += 1
+        return True
+
+    def release(self):
+        """Free a slot, handing it straight to the best waiter if there is one"""
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._queued -= 1
+            self.admitted += 1
+            self._advance(waiter.tag)
+            return waiter
+        self.active -= 1
+        return None
+
+    def _advance(self, tag):
+        """Move virtual time up to a granted request's tag, forgetting owners it has caught up with"""
+        if tag <= self._virtual:
+            return
+        self._virtual = tag
+        if len(self._owner_tags) > self.max_queue + self.max_concurrent:
+            self._owner_tags = {owner: next_tag for owner, next_tag in self._owner_tags.items()
+                                if next_tag > tag}
+
+    def busy(self, reason):
+        # Rough hint: each slot frees up about every max_wait / max_concurrent seconds
+        retry_after = max(1, int(self.max_wait / max(self.max_concurrent, 1)))
+        return SchedulerBusy(reason, self._queued, retry_after)
+
+    def stats(self):
+        depth_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+        owners = set()
+        for waiter in self._queue:
+            if not waiter.cancelled:
+                depth_by_priority[PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))] += 1
+                owners.add(waiter.owner)
+        return {
+            'max_concurrent': self.max_concurrent,
+            'active': self.active,
+            'queue_depth': self._queued,
+            'queue_depth_by_priority': depth_by_priority,
+            'queued_owners': len(owners - {None}),
+            'max_queue': self.max_queue,
+            'max_wait_seconds': self.max_wait,
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            'avg_wait_seconds': round(self.total_wait / self.admitted, 3) if self.admitted else 0.0
+        }
+
+
+class GenerationScheduler:
+    """Thread-based scheduler used by the Flask app"""
+
+    def __init__(self, max_concurrent=2, max_queue=64, max_wait=20.0):
+        self._state = _SchedulerState(max_concurrent, max_queue, max_wait)
+        self._lock = threading.Lock()
+
+    def acquire(self, priority, owner=None, timeout=None):
+        """Block until a generation slot is available or raise SchedulerBusy.
+        
+        `owner` (e.g. the student) is who the request counts against for
+        fair sharing; requests without one aren't share-limited. `timeout`
+        is how long the request's client will still wait, if it is known.
+        """
+        start = time.monotonic()
+        wait, reason = self._state.wait_limit(timeout)
+        with self._lock:
+            if wait <= 0:
+                raise self._state.reject(reason)
+            waiter, evicted = self._state.try_admit(priority, threading.Event(), owner)
+        if evicted is not None:
+            evicted.signal.set()
+        if waiter is None:
+            return
+
+        waiter.signal.wait(wait)
+        with self._lock:
+            if waiter.evicted:
+                raise self._state.busy('evicted')
+            if not waiter.granted and self._state.cancel(waiter, reason):
+                raise self._state.busy(reason)
+            self._state.total_wait += time.monotonic() - start
+
+    def release(self):
+        with self._lock:
+            waiter = self._state.release()
+        if waiter is not None:
+            waiter.signal.set()
+
+    @contextmanager
+    def slot(self, priority, owner=None, timeout=None):
+        self.acquire(priority, owner, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queue_depth(self):
+        """Requests waiting for a slot"""
+        with self._lock:
+            return self._state._queued
+
+    def stats(self):
+        with self._lock:
+            return self._state.stats()
+
+
+class AsyncGenerationScheduler:
+    """asyncio scheduler used by async_app.py; must be used from one event loop"""
+
+    def __init__(self, max_concurrent=2, max_queue=64, max_wait=20.0):
+        self._state = _SchedulerState(max_concurrent, max_queue, max_wait)
+
+    async def acquire(self, priority, owner=None, timeout=None):
+        start = time.monotonic()
+        wait, reason = self._state.wait_limit(timeout)
+        if wait <= 0:
+            raise self._state.reject(reason)
+        waiter, evicted = self._state.try_admit(priority, asyncio.get_running_loop().create_future(), owner)
+        if evicted is not None and not evicted.signal.done():
+            evicted.signal.set_result(False)
+        if waiter is None:
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.signal), wait)
+            if waiter.evicted:
+                raise self._state.busy('evicted')
+        except asyncio.TimeoutError:
+            if self._state.cancel(waiter, reason):
+                raise self._state.busy(reason)
+            if waiter.evicted:
+                raise self._state.busy('evicted')
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on the slot if we were just granted it.
+            # An evicted waiter never held one.
+            if not self._state.cancel(waiter, 'cancelled') and waiter.granted:
+                self.release()
+            raise
+        self._state.total_wait += time.monotonic() - start
+
+    def release(self):
+        waiter = self._state.release()
+        if waiter is not None and not waiter.signal.done():
+            waiter.signal.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, priority, owner=None, timeout=None):
+        await self.acquire(priority, owner, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queue_depth(self):
+        return self._state._queued
+
+    def stats(self):
+        return self._state.stats()
@@ -0,0 +1,166 @@
+"""
+Token-budgeted conversation history with rolling summaries.
+
+Instead of always keeping the last N messages, the prompt keeps as many
+recent messages as fit a per-persona token budget. Any single message
+longer than half the budget (a pasted essay, say) is clipped. Messages
+that fall out of the window are folded into a short rolling summary per
+conversation. The summary is updated incrementally by a background
+worker, so no request waits for it: a turn uses whatever summary is
+ready and queues an update if the summary is behind.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from conversation_context import history_fingerprint
+from reference_index import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def clip_text(text, max_tokens):
+    """Shorten text to roughly max_tokens, marking the cut"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 4].rstrip() + " [...]"
+
+
+def select_history(conversation_history, token_budget):
+    """Pick the most recent messages that fit the budget.
+
+    Returns (start, window): history[start:] is covered by the window,
+    which holds copies of those messages with over-long content clipped.
+    """
+    window = []
+    used = 0
+    start = len(conversation_history)
+    per_message = max(token_budget // 2, 1)
+    for i in range(len(conversation_history) - 1, -1, -1):
+        msg = conversation_history[i]
+        content = clip_text(str(msg.get('content', '')), per_message)
+        cost = estimate_tokens(content) + 2
+        if used + cost > token_budget:
+            break
+        window.append({'role': msg.get('role'), 'content': content})
+        used += cost
+        start = i
+    window.reverse()
+    return start, window
+
+
+class RollingSummaries:
+    """Per-conversation summaries of history older than the prompt window.
+
+    `summarize(previous_summary, messages, assistant_label)` produces the
+    new summary text. It runs on a single background thread, which is
+    started on first use.
+    """
+
+    def __init__(self, summarize, max_conversations=1000, idle_timeout=1800, max_pending=256):
+        self.summarize = summarize
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()  # key -> (covered, fingerprint, summary, last_used)
+        self._pending = set()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.updates = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def get(self, key, conversation_history, start, assistant_label):
+        """Summary of history[:start] as far as it's been computed, or None.
+
+        Queues a background update when the stored summary covers less
+        than history[:start].
+        """
+        if not key or start <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                covered, fingerprint, summary, _ = entry
+                # A summary only counts if this history still starts the same way
+                if history_fingerprint(conversation_history[:covered]) != fingerprint:
+                    del self._entries[key]
+                    entry = None
+                else:
+                    self._entries[key] = (covered, fingerprint, summary, now)
+                    self._entries.move_to_end(key)
+                    if covered > start:
+                        # The window has grown back over summarised messages
+                        return None
+            covered = entry[0] if entry else 0
+            summary = entry[2] if entry else None
+            if covered < start and key not in self._pending:
+                self._schedule(key, list(conversation_history[:start]), assistant_label)
+        return summary
+
+    def _schedule(self, key, messages, assistant_label):
+        # Caller holds the lock
+        try:
+            self._queue.put_nowait((key, messages, assistant_label))
+        except queue.Full:
+            self.skipped += 1
+            return
+        self._pending.add(key)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='history-summaries', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            key, messages, assistant_label = self._queue.get()
+            try:
+                self._update(key, messages, assistant_label)
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Could not summarise conversation history: %s", e)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def _update(self, key, messages, assistant_label):
+        with self._lock:
+            entry = self._entries.get(key)
+        previous, covered = None, 0
+        if entry is not None and entry[0] <= len(messages) \
+                and history_fingerprint(messages[:entry[0]]) == entry[1]:
+            covered, _, previous, _ = entry
+
+        # Only the messages not yet in the summary are sent to the model
+        summary = self.summarize(previous, messages[covered:], assistant_label)
+        if not summary:
+            self.failures += 1
+            return
+
+        with self._lock:
+            self._entries[key] = (len(messages), history_fingerprint(messages), summary, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+            self.updates += 1
+
+    def _evict_idle(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[3] < self.idle_timeout:
+                break
+            del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'conversations': len(self._entries),
+                'pending': len(self._pending),
+                'updates': self.updates,
+                'failures': self.failures,
+                'skipped': self.skipped
+            }
@@ -0,0 +1,137 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Counters and fixed-bucket histograms keyed by label values. Updating one
+takes a dict lookup and a few additions under a short lock, so it is
+safe to call on every request. /api/metrics renders the whole registry.
+With several worker processes, each keeps its own registry and the one
+answering /api/metrics adds the others' snapshots in when rendering.
+"""
+
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self, others=()):
+        """Sample lines, with the values in `others` (snapshots from other processes) added in"""
+        values = self.snapshot()
+        for other in others:
+            for label_values, value in other.items():
+                values[label_values] = values.get(label_values, 0) + value
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class Histogram:
+    """Observations counted into fixed cumulative buckets per combination of label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(values) for labels, values in self._series.items()}
+
+    def samples(self, others=()):
+        """Sample lines, with the series in `others` (snapshots from other processes) added in"""
+        series = self.snapshot()
+        for other in others:
+            for label_values, values in other.items():
+                if label_values in series:
+                    series[label_values] = [a + b for a, b in zip(series[label_values], values)]
+                else:
+                    series[label_values] = list(values)
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {_number(values[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Named metrics, rendered in registration order"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self.prefix + name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Every metric's current values, to be added into another process's render()"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, others=()):
+        """The registry in the text format, summed with snapshots from other processes"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples([other[metric.name] for other in others if metric.name in other]))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,76 @@
+"""
+Shared HTTP client for talking to Ollama.
+
+Every chat persona and diagnostic endpoint goes through one OllamaClient so
+that connections to Ollama are pooled and kept alive instead of opening a
+new TCP connection for every student message.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class OllamaClient:
+    """Thread-safe, pooled, keep-alive client for the Ollama HTTP API.
+
+    requests.Session objects are not guaranteed to be thread-safe, so each
+    thread gets its own lightweight Session. All of them mount the same
+    HTTPAdapter, which owns the bounded urllib3 connection pool, so idle
+    keep-alive connections are shared across every thread.
+    """
+
+    def __init__(self, base_url, pool_size=16, pool_block=False,
+                 connect_timeout=2.0, read_timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=pool_block,
+            max_retries=0
+        )
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
+
+    def _timeout(self, timeout):
+        """Build a (connect, read) timeout tuple for a single call"""
+        if timeout is None:
+            timeout = self.read_timeout
+        if isinstance(timeout, tuple):
+            return timeout
+        return (min(self.connect_timeout, timeout), timeout)
+
+    def url(self, path=''):
+        return f"{self.base_url}{path}"
+
+    def get(self, path='', timeout=None):
+        """GET an Ollama endpoint, e.g. '' for the liveness banner or '/api/tags'"""
+        return self._session().get(self.url(path), timeout=self._timeout(timeout))
+
+    def post(self, path, payload, timeout=None, stream=False):
+        """POST a JSON payload to an Ollama endpoint"""
+        return self._session().post(
+            self.url(path),
+            json=payload,
+            timeout=self._timeout(timeout),
+            stream=stream
+        )
+
+    def generate(self, payload, timeout=None, stream=False):
+        """Call /api/generate with the given request body"""
+        return self.post('/api/generate', payload, timeout=timeout, stream=stream)
+
+    def close(self):
+        """Close every pooled connection"""
+        self._adapter.close()
@@ -0,0 +1,253 @@
+"""
+Cached Ollama health state and a circuit breaker around generation calls.
+
+The HealthMonitor probes Ollama in a background thread so chat requests can
+read a cached up/down flag instead of paying an extra HTTP round trip. The
+CircuitBreaker trips after repeated generation failures so that, during an
+outage, requests fail fast with the persona's fallback message instead of
+each waiting out a timeout. The StartupCheck confirms Ollama and the
+model in the background when the server starts, so the port is open
+straight away and the app reports not-ready until the check passes.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """Periodically probes Ollama and caches whether it is reachable.
+
+    `on_check`, if given, is called with the result after every probe.
+    """
+
+    def __init__(self, client, interval=5.0, probe_timeout=2.0, on_check=None):
+        self.client = client
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.on_check = on_check
+        self._lock = threading.Lock()
+        self._up = None  # Unknown until the first probe completes
+        self._last_checked = None
+        self._last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Probe Ollama once and update the cached state"""
+        try:
+            response = self.client.get(timeout=self.probe_timeout)
+            up = response.status_code == 200 and "Ollama is running" in response.text
+            error = None if up else f"Unexpected response: {response.status_code}"
+        except Exception as e:
+            up = False
+            error = str(e)
+
+        self._set_state(up, error)
+        if self.on_check:
+            self.on_check(up)
+        return up
+
+    def mark_down(self, error):
+        """Record an outage seen by a request without waiting for the next probe"""
+        self._set_state(False, error)
+
+    def _set_state(self, up, error):
+        with self._lock:
+            changed = up != self._up
+            self._up = up
+            self._last_error = error
+            self._last_checked = time.time()
+
+        if changed:
+            if up:
+                logger.info("Ollama health: up (%s)", self.client.base_url)
+            else:
+                logger.error("Ollama health: down at %s (%s)", self.client.base_url, error)
+
+    def is_up(self):
+        """Cached reachability; an unknown state is treated as up"""
+        if self._up is False and not self.running:
+            # No background thread to notice recovery, so one caller per
+            # interval re-probes inline while the others keep failing fast
+            with self._lock:
+                stale = time.time() - self._last_checked >= self.interval
+                if stale:
+                    self._last_checked = time.time()
+            if stale:
+                return self.check()
+        return self._up is not False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background probe thread (idempotent)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ollama-health', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.interval)
+
+    def snapshot(self):
+        with self._lock:
+            up, last_checked, last_error = self._up, self._last_checked, self._last_error
+        return {
+            'status': 'unknown' if up is None else ('up' if up else 'down'),
+            'last_checked': datetime.fromtimestamp(last_checked).isoformat() if last_checked else None,
+            'last_error': last_error,
+            'probe_interval_seconds': self.interval
+        }
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open breaker around Ollama generations"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow_request(self):
+        """Return True if a generation may be attempted right now"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                # Let exactly one trial request through to test recovery
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit breaker closed - Ollama generations recovered")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            # Failures while already open (requests that were in flight when it opened, or other
+            # workers') don't push the next trial back
+            if state != self.OPEN and (state == self.HALF_OPEN or self._failures >= self.failure_threshold):
+                logger.error("Circuit breaker opened after %s failure(s)", self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a request that neither succeeded nor failed (cut short by its own deadline, or
+        cancelled), so a half-open breaker lets another trial through instead of waiting forever"""
+        with self._lock:
+            if self._current_state() == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            retry_in = 0.0
+            if state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout_seconds': self.reset_timeout,
+                'retry_in_seconds': round(retry_in, 1),
+                'rejected_requests': self._rejected
+            }
+
+
+class StartupCheck:
+    """Runs a startup check in a background thread, retrying until it passes"""
+
+    def __init__(self, check, retry_interval=10.0):
+        self.check = check
+        self.retry_interval = retry_interval
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+        self.ready_after = None
+        self.attempts = 0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """Start checking in the background (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='startup-check', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        """Block until the check has passed; returns False on timeout"""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.attempts += 1
+            try:
+                passed = self.check()
+            except Exception as e:
+                logger.error("Startup check failed: %s", e)
+                passed = False
+            if passed:
+                self.ready_after = time.monotonic() - self._started_at
+                self._ready.set()
+                return
+            logger.warning("Startup check did not pass; retrying in %ss", self.retry_interval)
+            self._stop.wait(self.retry_interval)
+
+    def snapshot(self):
+        return {
+            'status': 'ready' if self.ready else ('starting' if self._thread is not None else 'not started'),
+            'attempts': self.attempts,
+            'ready_after_seconds': round(self.ready_after, 3) if self.ready_after is not None else None
+        }
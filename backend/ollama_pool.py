@@ -0,0 +1,359 @@
+"""
+Routing generations across several Ollama nodes.
+
+OLLAMA_NODES lists the Ollama servers the backend may use. Each node has
+its own pooled OllamaClient, HealthMonitor and CircuitBreaker. Every
+generation goes to the healthy node with the fewest outstanding requests
+among those serving the requested model. A node whose probe fails, or
+whose breaker opens after repeated errors, is skipped. It is re-admitted
+once its probe succeeds and a half-open trial request gets through.
+Models are taken from the node's configuration or, if none are listed,
+from its /api/tags, refreshed with each health probe.
+
+Each probe also reads which models the node has loaded (/api/ps). If a
+node has a warm_model and it is not loaded, whether at startup or after
+Ollama evicted it, a background thread preloads it with the configured
+keep_alive, so students do not pay the load time. Readiness is answered
+from this cached state without generating anything.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from ollama_client import OllamaClient
+from ollama_health import CircuitBreaker, HealthMonitor
+
+logger = logging.getLogger(__name__)
+
+
+class NoOllamaNode(requests.exceptions.ConnectionError):
+    """No healthy node serves the requested model"""
+
+
+def model_name(name):
+    """Canonical model name; Ollama treats 'llama3.2' as 'llama3.2:latest'"""
+    return name if ':' in name else f"{name}:latest"
+
+
+def parse_nodes(spec):
+    """Parse 'url[|model|model...],url...' into (url, models or None) pairs"""
+    nodes = []
+    for entry in spec.split(','):
+        parts = [part.strip() for part in entry.split('|') if part.strip()]
+        if parts:
+            nodes.append((parts[0], {model_name(model) for model in parts[1:]} or None))
+    return nodes
+
+
+class OllamaNode:
+    """One Ollama server with its own connection pool, health state and breaker"""
+
+    def __init__(self, url, models=None, pool_size=16, pool_block=False, connect_timeout=2.0,
+                 failure_threshold=3, reset_timeout=30.0, health_interval=5.0,
+                 warm_model=None, keep_alive=None, warm_timeout=120.0, breaker=None, warm_options=None):
+        self.client = OllamaClient(url, pool_size=pool_size, pool_block=pool_block,
+                                   connect_timeout=connect_timeout)
+        self.health = HealthMonitor(self.client, interval=health_interval, on_check=self._refresh_models)
+        # Other processes serving the same app may pass in a breaker they share
+        self.breaker = breaker if breaker is not None else CircuitBreaker(failure_threshold=failure_threshold,
+                                                                          reset_timeout=reset_timeout)
+        self.configured_models = models
+        self.installed_models = None  # From /api/tags; None until first read
+        self.loaded_models = None  # From /api/ps; None if unknown
+        self.warm_model = warm_model
+        self.keep_alive = keep_alive
+        # Options that decide how Ollama loads the model (num_ctx), matching the generations'
+        self.warm_options = warm_options
+        self.warm_timeout = warm_timeout
+        self._warm_lock = threading.Lock()
+        self._warming = False
+        self.warmups = 0
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def base_url(self):
+        return self.client.base_url
+
+    def url(self, path=''):
+        return self.client.url(path)
+
+    @property
+    def models(self):
+        """Models this node serves, or None if not known yet (treated as any)"""
+        return self.configured_models or self.installed_models
+
+    def serves(self, model):
+        models = self.models
+        return model is None or models is None or model_name(model) in models
+
+    def has_installed(self, model):
+        """Whether /api/tags listed the model (None if the node's models are unknown)"""
+        if self.installed_models is None:
+            return None
+        return model_name(model) in self.installed_models
+
+    def has_loaded(self, model):
+        loaded = self.loaded_models
+        return loaded is not None and model_name(model) in loaded
+
+    def usable(self):
+        """Up and not ejected by its breaker (a half-open breaker counts as usable)"""
+        return self.health.is_up() and self.breaker.state != CircuitBreaker.OPEN
+
+    def _list_models(self, path):
+        """Model names from /api/tags or /api/ps, or None if the node could not say"""
+        try:
+            response = self.client.get(path, timeout=self.health.probe_timeout)
+            if response.status_code == 200:
+                return {model_name(model['name']) for model in response.json().get('models', [])}
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logger.warning("Could not read %s on Ollama node %s: %s", path, self.base_url, e)
+        return None
+
+    def _refresh_models(self, up):
+        """After each probe, re-read installed and loaded models and re-warm if evicted"""
+        if not up:
+            self.loaded_models = None
+            return
+        self.installed_models = self._list_models('/api/tags')
+        self.loaded_models = self._list_models('/api/ps')
+        if self.needs_warm_up():
+            self.start_warm_up()
+
+    def needs_warm_up(self):
+        model = self.warm_model
+        if not model or not self.serves(model) or self.has_installed(model) is False:
+            return False
+        if self.loaded_models is None:
+            # Ollama without /api/ps: preload once, then rely on keep_alive
+            return not self.warmups
+        return not self.has_loaded(model)
+
+    def start_warm_up(self):
+        """Preload warm_model on a background thread unless a warm-up is already running"""
+        with self._warm_lock:
+            if self._warming:
+                return
+            self._warming = True
+        threading.Thread(target=self.warm_up, daemon=True).start()
+
+    def warm_up(self):
+        """Load warm_model into memory and pin it there for keep_alive; returns True if loaded"""
+        model = self.warm_model
+        started = time.perf_counter()
+        try:
+            # A generate request without a prompt only loads the model
+            payload = {"model": model, "keep_alive": self.keep_alive}
+            if self.warm_options:
+                payload["options"] = self.warm_options
+            response = self.client.generate(payload, timeout=self.warm_timeout)
+            if response.status_code != 200:
+                logger.warning("Could not load %s on Ollama node %s: status %s",
+                               model, self.base_url, response.status_code)
+                return False
+            self.warmups += 1
+            self.loaded_models = (self.loaded_models or set()) | {model_name(model)}
+            logger.info("Loaded %s on Ollama node %s in %.1fs",
+                        model, self.base_url, time.perf_counter() - started)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not load %s on Ollama node %s: %s", model, self.base_url, e)
+            return False
+        finally:
+            self._warming = False
+
+    def record_status(self, status_code):
+        """Feed a generation's HTTP status into this node's breaker"""
+        if status_code >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def record_error(self, error, connection_lost=False):
+        self.failures += 1
+        self.breaker.record_failure()
+        if connection_lost:
+            self.health.mark_down(str(error))
+
+    def snapshot(self):
+        return {
+            'url': self.base_url,
+            'models': sorted(self.models) if self.models else None,
+            'loaded_models': sorted(self.loaded_models) if self.loaded_models is not None else None,
+            'warmups': self.warmups,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'health': self.health.snapshot(),
+            'circuit_breaker': self.breaker.snapshot()
+        }
+
+
+class OllamaPool:
+    """Least-outstanding-requests routing over a set of OllamaNodes"""
+
+    def __init__(self, nodes):
+        if not nodes:
+            raise ValueError("At least one Ollama node is required")
+        self.nodes = list(nodes)
+        self._lock = threading.Lock()
+        self.unroutable = 0
+
+    def available(self, model=None):
+        """Cheap pre-flight check: is any usable node serving this model?"""
+        return any(node.serves(model) and node.usable() for node in self.nodes)
+
+    def acquire(self, model=None):
+        """Pick the least-loaded usable node for a model and count a request against it.
+
+        Raises NoOllamaNode if there is none. Every acquire must be paired
+        with a release.
+        """
+        candidates = [node for node in self.nodes if node.serves(model) and node.usable()]
+        with self._lock:
+            candidates.sort(key=lambda node: node.outstanding)
+            for node in candidates:
+                # A half-open breaker only lets one trial request through
+                if node.breaker.allow_request():
+                    node.outstanding += 1
+                    node.requests += 1
+                    return node
+            self.unroutable += 1
+        raise NoOllamaNode(f"No healthy Ollama node serves model {model}")
+
+    def release(self, node, error=None, connection_errors=(requests.exceptions.ConnectionError,)):
+        """Finish a request on a node, recording a failure if it raised `error`"""
+        with self._lock:
+            node.outstanding -= 1
+        if error is not None:
+            node.record_error(error, connection_lost=isinstance(error, connection_errors))
+        else:
+            # Without a status recorded (an expected error, a cancelled request) a
+            # half-open trial would otherwise never end; after one it does nothing
+            node.breaker.release_trial()
+
+    @contextmanager
+    def lease(self, model=None, connection_errors=(requests.exceptions.ConnectionError,), expected_errors=()):
+        """Hold a node for the duration of a request made with another client (e.g. aiohttp).
+
+        Exceptions raised inside count as failures of the node, except
+        `expected_errors` (such as a timeout the caller cut short for its
+        own deadline) and cancellation (asyncio.CancelledError, a
+        BaseException, when the client disconnects); the caller reports
+        HTTP statuses with node.record_status() once it has read the reply.
+        """
+        node = self.acquire(model)
+        error = None
+        try:
+            yield node
+        except BaseException as e:
+            if isinstance(e, Exception) and not isinstance(e, expected_errors):
+                error = e
+            raise
+        finally:
+            self.release(node, error, connection_errors)
+
+    def get(self, path='', timeout=None):
+        """GET an Ollama endpoint on the least-loaded usable node"""
+        with self.lease() as node:
+            return node.client.get(path, timeout=timeout)
+
+    def generate(self, payload, timeout=None, stream=False, expected_errors=()):
+        """Call /api/generate on the least-loaded node serving the payload's model.
+
+        A streamed response keeps its node busy until the caller closes it.
+        Its headers only say the generation started, so the caller reports
+        how the stream ended with response.finish(error=None) before closing
+        it: a success, or `error` counted against the node. A stream closed
+        without finishing (abandoned by its reader) counts as neither.
+        Errors in `expected_errors` don't count against the node.
+        """
+        node = self.acquire(payload.get('model'))
+        try:
+            response = node.client.generate(payload, timeout=timeout, stream=stream)
+        except Exception as e:
+            self.release(node, None if isinstance(e, expected_errors) else e)
+            raise
+        if not stream or response.status_code != 200:
+            node.record_status(response.status_code)
+        if not stream:
+            self.release(node)
+            return response
+
+        close = response.close
+        outcome = []
+        released = []
+
+        def finish(error=None):
+            # The first outcome reported wins, e.g. over an error after the reply was read
+            if not outcome:
+                outcome.append(error)
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    error = outcome[0] if outcome else None
+                    if outcome and error is None:
+                        node.record_status(response.status_code)
+                    self.release(node, error)
+
+        response.finish = finish
+        response.close = close_and_release
+        return response
+
+    def readiness(self, model):
+        """Cached readiness of a model across the nodes, without generating anything"""
+        usable = [node for node in self.nodes if node.serves(model) and node.usable()]
+        installed = [node for node in usable if node.has_installed(model) is not False]
+        if any(node.has_loaded(model) for node in installed):
+            model_status = 'loaded'
+        elif any(node.has_installed(model) for node in installed):
+            model_status = 'available'
+        elif installed:
+            model_status = 'unknown'
+        else:
+            model_status = 'not found'
+        return {
+            'ollama_status': 'connected' if usable or any(node.health.is_up() for node in self.nodes)
+                             else 'disconnected',
+            'model_status': model_status,
+            'ready': bool(installed)
+        }
+
+    def check(self):
+        """Probe every node once; returns True if any is up"""
+        return any([node.health.check() for node in self.nodes])
+
+    def start(self):
+        """Start each node's background health probe (idempotent)"""
+        for node in self.nodes:
+            node.health.start()
+
+    def stop(self):
+        for node in self.nodes:
+            node.health.stop()
+
+    def close(self):
+        for node in self.nodes:
+            node.client.close()
+
+    def snapshot(self):
+        nodes = [node.snapshot() for node in self.nodes]
+        up = [node for node in nodes if node['health']['status'] != 'down'
+              and node['circuit_breaker']['state'] != CircuitBreaker.OPEN]
+        return {
+            'status': 'up' if up else 'down',
+            'nodes_up': len(up),
+            'unroutable_requests': self.unroutable,
+            'nodes': nodes
+        }
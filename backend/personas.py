@@ -0,0 +1,118 @@
+"""
+Chatbot personas and their prompts.
+
+Every chatbot the API serves (wellbeing support, Holden, and each
+teacher-defined custom chatbot) is a Persona: its system prompt, Ollama
+options, history policy, fallback messages and the label its replies are
+written under. One set of generation functions in app.py and async_app.py
+works for all of them.
+
+A full prompt is the persona's prefix, rendered once from its system
+prompt, followed by everything that varies per turn: the summary of
+older messages, the history window, any reference excerpts and the
+student's message. Ollama keeps the KV cache of recent prompts and only
+evaluates what follows the longest prefix it already holds, so keeping
+the per-persona prefix byte-identical across students lets most
+generations skip evaluating the system prompt.
+
+PrefixReuse measures how much of each prompt was reused, from what Ollama
+returns: the context holds every prompt token followed by the generated
+ones, and prompt_eval_count counts only the prompt tokens it evaluated.
+"""
+
+import threading
+
+
+def format_history(messages, assistant_label):
+    """Conversation messages as 'Student: ...' / '<assistant>: ...' lines"""
+    lines = ""
+    for msg in messages:
+        role = "Student" if msg.get("role") == "user" else assistant_label
+        lines += f"{role}: {msg.get('content', '')}\n"
+    return lines
+
+
+class Persona:
+    """A chatbot's prompt, generation options, history policy and fallback messages"""
+
+    def __init__(self, name, system_prompt, options, fallbacks, label, history_tokens,
+                 summaries=True, config=None):
+        # 'wellbeing', 'holden' or 'custom:<hash>'; metrics and stats group by kind
+        self.name = name
+        self.kind = name.split(':', 1)[0]
+        self.system_prompt = system_prompt
+        self.options = options
+        self.fallbacks = fallbacks
+        self.label = label
+        # Recent history is kept up to this many tokens, older messages summarised if enabled
+        self.history_tokens = history_tokens
+        self.summaries = summaries
+        # A custom chatbot's config (for its reference materials), else None
+        self.config = config
+        # Every full prompt starts with exactly these bytes
+        self.prefix = f"{system_prompt}\n\n"
+
+    def student_turn(self, message, reference=None):
+        """The new student message, preceded by any reference excerpts for it"""
+        turn = f"Relevant reference material:\n{reference}\n\n" if reference else ""
+        return turn + f"Student: {message}\n{self.label}:"
+
+    def render(self, message, history_window=None, reference=None, summary=None):
+        """The full prompt: the fixed prefix, then everything that changes per turn"""
+        prompt = self.prefix
+        # Earlier messages that no longer fit the history budget
+        if summary:
+            prompt += f"Summary of the earlier conversation: {summary}\n\n"
+        if history_window:
+            prompt += format_history(history_window, self.label)
+        return prompt + self.student_turn(message, reference)
+
+    def __repr__(self):
+        return f"Persona({self.name!r})"
+
+
+def reused_prompt_tokens(response_json):
+    """(prompt tokens, tokens Ollama reused from its cache) for a finished generation, or None"""
+    context = response_json.get('context')
+    evaluated = response_json.get('prompt_eval_count')
+    generated = response_json.get('eval_count')
+    if not context or evaluated is None or generated is None:
+        return None
+    prompt_tokens = len(context) - generated
+    if prompt_tokens <= 0:
+        return None
+    return prompt_tokens, max(prompt_tokens - evaluated, 0)
+
+
+class PrefixReuse:
+    """How much of each persona kind's full prompts Ollama served from its prompt cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # kind -> [generations, prompt tokens, reused tokens]
+        self._counts = {}
+
+    def record(self, kind, response_json):
+        """Count a full-prompt generation; returns (prompt tokens, reused tokens) or None"""
+        measured = reused_prompt_tokens(response_json)
+        if measured is None:
+            return None
+        prompt_tokens, reused = measured
+        with self._lock:
+            counts = self._counts.setdefault(kind, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += prompt_tokens
+            counts[2] += reused
+        return measured
+
+    def stats(self):
+        with self._lock:
+            return {
+                kind: {
+                    'generations': generations,
+                    'prompt_tokens': prompt_tokens,
+                    'reused_tokens': reused,
+                    'reuse_rate': round(reused / prompt_tokens, 3)
+                }
+                for kind, (generations, prompt_tokens, reused) in self._counts.items()
+            }
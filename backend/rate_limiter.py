@@ -0,0 +1,137 @@
+"""
+Per-student and per-IP rate limits for the chat API.
+
+Each endpoint has a token bucket per student_id and per client IP. A
+bucket holds up to `capacity` requests and refills at capacity/seconds,
+so a student can send a short burst but not a sustained stream. A
+request needs a token from both its student's bucket and its IP's; the
+IP limit is meant to be generous, since a whole class usually shares one
+address.
+
+Buckets are two-item lists kept in least-recently-used order. A bucket
+that has been idle long enough to refill completely carries no
+information, so it is dropped as soon as it reaches the front. Memory is
+therefore proportional to recently active students, with `max_keys` as a
+hard cap.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimited(Exception):
+    """Raised when a student or IP has used up its requests for an endpoint"""
+
+    def __init__(self, endpoint, scope, retry_after):
+        super().__init__(f"Rate limited ({scope} limit for {endpoint})")
+        self.endpoint = endpoint
+        self.scope = scope
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Re-raised in the worker when the limiter is shared between processes
+        return type(self), (self.endpoint, self.scope, self.retry_after)
+
+
+def parse_limits(spec):
+    """Parse 'endpoint:requests/seconds,...' into {endpoint: (requests, seconds)}; '*' is the default"""
+    limits = {}
+    for entry in spec.split(','):
+        endpoint, _, limit = entry.strip().partition(':')
+        if endpoint and limit:
+            requests, _, seconds = limit.partition('/')
+            limits[endpoint] = (int(requests), float(seconds or 60))
+    return limits
+
+
+class TokenBuckets:
+    """One limit's token buckets for many keys"""
+
+    def __init__(self, capacity, seconds, max_keys=100000):
+        self.capacity = capacity
+        self.rate = capacity / seconds
+        self.max_keys = max_keys
+        # key -> [tokens, last update], least recently updated first
+        self._buckets = OrderedDict()
+
+    def take(self, key, now):
+        """Take a token for `key`; returns 0 if allowed, else seconds until one is available"""
+        self._evict(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.capacity, now]
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+    def _evict(self, now):
+        # The front bucket is the longest idle; drop it if it has refilled, and enforce the cap
+        while self._buckets:
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            if len(self._buckets) >= self.max_keys or tokens + (now - updated) * self.rate >= self.capacity:
+                del self._buckets[key]
+            else:
+                break
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """Per-endpoint token buckets keyed by student and by IP"""
+
+    SCOPES = ('student', 'ip')
+
+    def __init__(self, student_limits, ip_limits, max_keys=100000):
+        self.limits = {'student': dict(student_limits), 'ip': dict(ip_limits)}
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.rejected = {scope: 0 for scope in self.SCOPES}
+
+    def _bucket(self, scope, endpoint):
+        # Caller holds the lock
+        limits = self.limits[scope]
+        name = endpoint if endpoint in limits else '*'
+        if name not in limits:
+            return None
+        buckets = self._buckets.get((scope, name))
+        if buckets is None:
+            capacity, seconds = limits[name]
+            buckets = self._buckets[(scope, name)] = TokenBuckets(capacity, seconds, self.max_keys)
+        return buckets
+
+    def check(self, endpoint, student_id=None, ip=None):
+        """Count a request against its student's and IP's limits, raising RateLimited if either is used up.
+
+        Anonymous requests (no student_id) are only limited by IP. A request
+        turned away by its student limit doesn't use up the IP's tokens.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for scope, key in (('student', student_id), ('ip', ip)):
+                if not key:
+                    continue
+                buckets = self._bucket(scope, endpoint)
+                if buckets is None:
+                    continue
+                wait = buckets.take(key, now)
+                if wait:
+                    self.rejected[scope] += 1
+                    raise RateLimited(endpoint, scope, max(1, int(wait + 0.999)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limits': {scope: {endpoint: f"{requests}/{seconds:g}s" for endpoint, (requests, seconds) in limits.items()}
+                           for scope, limits in self.limits.items()},
+                'tracked': {f"{scope}:{endpoint}": len(buckets) for (scope, endpoint), buckets in self._buckets.items()},
+                'rejected': dict(self.rejected)
+            }
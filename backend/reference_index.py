@@ -0,0 +1,157 @@
+"""
+BM25 retrieval over custom chatbot reference materials.
+
+Teachers paste whole chapters and syllabi into a chatbot's reference
+materials. Rather than putting all of it in every prompt, the text is
+split into overlapping chunks and indexed once per distinct set of
+materials. Each turn then includes only the chunks most relevant to the
+student's question, up to a token budget.
+"""
+
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from safety_scanner import normalise
+
+# Words too common to help rank chunks
+STOPWORDS = frozenset("""
+a an and are as at be but by do does did for from had has have he her him his how i if in
+into is it its me my no not of on or she so than that the their them then there they this
+to too was we were what when where which who why will with you your
+""".split())
+
+_PARAGRAPHS = re.compile(r'\n\s*\n')
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+
+def chunk_text(text, chunk_words=120, overlap=30):
+    """Split text into chunks of about chunk_words words.
+
+    Short paragraphs are packed together; long ones are cut into windows
+    that overlap by `overlap` words so an answer isn't split in half.
+    """
+    chunks = []
+    current = []
+    for paragraph in _PARAGRAPHS.split(text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if current and len(current) + len(words) > chunk_words:
+            chunks.append(' '.join(current))
+            current = []
+        if len(words) <= chunk_words:
+            current.extend(words)
+            continue
+        step = max(chunk_words - overlap, 1)
+        for start in range(0, len(words), step):
+            chunks.append(' '.join(words[start:start + chunk_words]))
+            if start + chunk_words >= len(words):
+                break
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def _terms(text):
+    return [word for word in normalise(text) if word not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks"""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._tf = [Counter(_terms(chunk)) for chunk in chunks]
+        self._lengths = [sum(tf.values()) for tf in self._tf]
+        self._avg_length = (sum(self._lengths) / len(chunks)) if chunks else 0.0
+        self._postings = {}
+        for i, tf in enumerate(self._tf):
+            for term in tf:
+                self._postings.setdefault(term, []).append(i)
+        n = len(chunks)
+        self._idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self._postings.items()
+        }
+
+    def search(self, query, k=4):
+        """Return up to k (score, chunk index) pairs, best first"""
+        scores = Counter()
+        for term in set(_terms(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i in self._postings[term]:
+                tf = self._tf[i][term]
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / self._avg_length)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return [(score, i) for i, score in scores.most_common(k)]
+
+    def select(self, query, k=4, token_budget=600):
+        """Top-k chunks for the query that fit the token budget, in document order"""
+        picked = []
+        used = 0
+        for _, i in self.search(query, k):
+            cost = estimate_tokens(self.chunks[i])
+            if used + cost > token_budget or any(self.chunks[j] == self.chunks[i] for j in picked):
+                continue
+            picked.append(i)
+            used += cost
+        return [self.chunks[i] for i in sorted(picked)]
+
+
+class ReferenceIndexCache:
+    """Bounded LRU of BM25 indexes keyed by the reference text's hash"""
+
+    def __init__(self, max_indexes=64, chunk_words=120, overlap=30):
+        self.max_indexes = max_indexes
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+
+    def get(self, text):
+        """Index for this reference text, building it on first use"""
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                self.hits += 1
+                return index
+
+        # Build outside the lock; a racing duplicate build is harmless
+        start = time.perf_counter()
+        index = BM25Index(chunk_text(text, self.chunk_words, self.overlap))
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            self.builds += 1
+            self.build_seconds += elapsed
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def stats(self):
+        with self._lock:
+            return {
+                'indexes': len(self._indexes),
+                'hits': self.hits,
+                'builds': self.builds,
+                'avg_build_ms': round(self.build_seconds / self.builds * 1000, 2) if self.builds else 0.0
+            }
@@ -0,0 +1,166 @@
+"""
+Application logging off the request path, as JSON lines tagged with a request ID.
+
+Handlers that write to the terminal or a file block the calling thread on
+every record, so a slow disk slows every chat reply. Instead the root
+logger gets a single RequestQueueHandler, which only puts records on a
+bounded queue; a QueueListener thread formats them and does the writing.
+When the queue is full a record is dropped and counted rather than
+making a request wait.
+
+Each request gets an ID (the client's X-Request-ID, or a new one) held in
+a context variable, so every record logged while handling it carries the
+ID without it being passed around. With a sample rate below 1, only that
+fraction of requests keep their INFO and DEBUG records; warnings and
+errors are always kept. The decision is made once per request so a
+sampled request's records tell its whole story.
+
+Log calls should pass arguments %-style (logger.info("... %s", value))
+rather than as f-strings: a disabled level then costs one level check,
+and a record whose arguments are all plain values is rendered by the
+listener thread rather than the request.
+"""
+
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
+import uuid
+from datetime import datetime
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_sampled = contextvars.ContextVar('log_sampled', default=True)
+
+# Client-supplied IDs are echoed back and logged, so only accept plain tokens
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Arguments of these types can't change before the listener renders the message
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record, with the request ID and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'source': f"{record.filename}:{record.lineno}",
+            'message': record.getMessage()
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """Queue records for the listener, tagged with the request ID and sampled per request"""
+
+    def __init__(self, log_queue, pipeline):
+        super().__init__(log_queue)
+        self.pipeline = pipeline
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING and not _sampled.get():
+            self.pipeline.count('sampled_out')
+            return
+        record.request_id = _request_id.get()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.pipeline.count('dropped')
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        # Arguments that could change, and tracebacks, must be rendered before the request moves on
+        args = record.args
+        if not record.exc_info and (not args or (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE) for arg in args))):
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.pipeline.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room rather than failing when stopped with a full queue
+        self.queue.put(self._sentinel)
+
+
+class RequestLogPipeline:
+    """Root logging through a bounded queue to a writer thread"""
+
+    def __init__(self, handlers, level=logging.INFO, json_lines=True, max_queue=10000, sample_rate=1.0):
+        self.level = level
+        self.sample_rate = sample_rate
+        self.formatter = JsonLineFormatter() if json_lines else logging.Formatter(TEXT_FORMAT)
+        for handler in handlers:
+            handler.setFormatter(self.formatter)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.handler = RequestQueueHandler(self.queue, self)
+        self.listener = _Listener(self.queue, *handlers, respect_handler_level=True)
+        self._lock = threading.Lock()
+        self._counts = {'requests': 0, 'sampled_requests': 0, 'sampled_out': 0, 'dropped': 0}
+        self._started = False
+
+    def install(self):
+        """Route the root logger through the queue, unless logging is already configured"""
+        root = logging.getLogger()
+        if root.handlers:
+            return False
+        root.setLevel(self.level)
+        root.addHandler(self.handler)
+        self.listener.start()
+        self._started = True
+        return True
+
+    def stop(self):
+        """Write out everything still queued and stop the writer thread"""
+        if self._started:
+            self._started = False
+            self.listener.stop()
+
+    def start_request(self, request_id=None):
+        """Tag this thread's or task's records with a request ID and decide if its INFO logs are kept"""
+        if not request_id or not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        _request_id.set(request_id)
+        _sampled.set(sampled)
+        with self._lock:
+            self._counts['requests'] += 1
+            self._counts['sampled_requests'] += 1 if sampled else 0
+        return request_id
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return dict(counts, queued=self.queue.qsize(), sample_rate=self.sample_rate)
@@ -0,0 +1,178 @@
+"""
+Near-duplicate response cache for persona chats.
+
+Many students in a class ask a persona the same opening question in
+slightly different words. Replies are cached per persona, keyed on the
+normalised message. A lookup first tries an exact match. Failing that it
+compares character trigram vectors against cached questions that share a
+word with the new one (and mention the same numbers and negations), and returns the
+best reply whose cosine similarity reaches the threshold. Everything runs
+in-process with no model or network calls.
+
+Entries expire after a TTL and the least recently used are evicted once
+the entry count or approximate memory use exceeds its cap.
+"""
+
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from safety_scanner import normalise
+
+# Only the cached questions sharing the most words with a query are scored
+_MAX_CANDIDATES = 32
+
+# Negations, with contractions as normalise() leaves them (apostrophes dropped)
+_NEGATIONS = frozenset((
+    'not', 'no', 'never', 'nor', 'none', 'nobody', 'nothing', 'neither', 'nowhere', 'cannot',
+    'dont', 'doesnt', 'didnt', 'isnt', 'arent', 'wasnt', 'werent', 'cant', 'couldnt', 'wont',
+    'wouldnt', 'shouldnt', 'havent', 'hasnt', 'hadnt', 'aint', 'mustnt', 'neednt', 'mightnt'
+))
+
+
+def _trigrams(text):
+    padded = f" {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _numbers(words):
+    # "chapter 3" and "chapter 5" look alike as text but are different questions
+    return {word for word in words if any(char.isdigit() for char in word)}
+
+
+def _negations(words):
+    # "why does holden hate phonies" and "why doesn't holden hate phonies" differ by a few
+    # characters but ask opposite questions
+    return Counter(word for word in words if word in _NEGATIONS)
+
+
+class _Entry:
+    __slots__ = ('persona', 'text', 'words', 'vector', 'norm', 'response', 'expires', 'size')
+
+    def __init__(self, persona, text, words, response, expires):
+        self.persona = persona
+        self.text = text
+        self.words = words
+        self.vector = _trigrams(text)
+        self.norm = math.sqrt(sum(count * count for count in self.vector.values()))
+        self.response = response
+        self.expires = expires
+        # Rough footprint: strings plus ~100 bytes per trigram dict slot
+        self.size = len(text) + len(response.encode('utf-8')) + 100 * len(self.vector) + 200
+
+
+class ResponseCache:
+    """Thread-safe LRU/TTL cache with exact and near-duplicate lookup"""
+
+    def __init__(self, max_entries=2000, max_bytes=8 * 1024 * 1024, ttl=3600.0, similarity=0.9):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # (persona, text) -> _Entry, least recently used first
+        self._index = {}  # (persona, word) -> set of (persona, text) keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, persona, message):
+        """Cached reply for this or a near-identical question, or None"""
+        words = normalise(message)
+        if not words:
+            return None
+        text = ' '.join(words)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get((persona, text))
+            if entry is not None and entry.expires <= now:
+                self._remove((persona, text))
+                self.expirations += 1
+                entry = None
+
+            if entry is None and self.similarity < 1.0:
+                entry = self._nearest(persona, text, words, now)
+                if entry is not None:
+                    self.similar_hits += 1
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end((entry.persona, entry.text))
+            return entry.response
+
+    def _nearest(self, persona, text, words, now):
+        shared = Counter()
+        for word in set(words):
+            for key in self._index.get((persona, word), ()):
+                shared[key] += 1
+        if not shared:
+            return None
+
+        vector = _trigrams(text)
+        norm = math.sqrt(sum(count * count for count in vector.values()))
+        numbers = _numbers(words)
+        negations = _negations(words)
+        best, best_score = None, self.similarity
+        for key, _ in shared.most_common(_MAX_CANDIDATES):
+            entry = self._entries[key]
+            if entry.expires <= now or _numbers(entry.words) != numbers or _negations(entry.words) != negations:
+                continue
+            dot = sum(count * entry.vector.get(gram, 0) for gram, count in vector.items())
+            score = dot / (norm * entry.norm)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, persona, message, response):
+        words = normalise(message)
+        if not words or not response:
+            return
+        text = ' '.join(words)
+        key = (persona, text)
+        entry = _Entry(persona, text, words, response, time.monotonic() + self.ttl)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for word in set(words):
+                self._index.setdefault((persona, word), set()).add(key)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for word in set(entry.words):
+            keys = self._index.get((entry.persona, word))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(entry.persona, word)]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'approx_bytes': self._bytes,
+                'hits': self.hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
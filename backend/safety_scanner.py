@@ -0,0 +1,194 @@
+"""
+Compiled multi-phrase matcher for the wellbeing safety check.
+
+All crisis and concern phrases are compiled once into a single word-level
+Aho-Corasick automaton, so a message is scanned in one pass no matter how
+many phrases counsellors add. Messages and phrases get the same
+normalisation (Unicode NFKC, case folding, apostrophes dropped, any other
+punctuation treated as a word break). As a result "can't cope" matches
+"cant cope", "self-harm" matches "self harm", and "scared" no longer
+matches inside "scaredy". The first and last word of a phrase also match
+their common inflections ("self harming", "killing myself", "hopelessly"),
+which the old substring scan caught for the last word.
+
+Phrases can be loaded from a JSON file of the form
+    {"CRISIS": ["kill myself", ...], "CONCERN": ["bullied", ...]}
+which is re-read automatically when it changes.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Most severe first; a message's level is the most severe level matched
+SAFETY_LEVELS = ('CRISIS', 'CONCERN')
+
+_APOSTROPHES = re.compile(r"['‘’ʼ`´]")
+_WORD = re.compile(r"[^\W_]+")
+
+# Suffixes that inflect a phrase's first and last word
+_SUFFIXES = ('s', 'es', 'd', 'ed', 'ing', 'er', 'ers', 'ly', 'ness', 'ful', 'al', 'ity')
+
+
+def normalise(text):
+    """Split text into normalised words"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _WORD.findall(_APOSTROPHES.sub('', text))
+
+
+def inflections(word):
+    """The word and its common inflections: harm -> harms, harmed, harming, ..."""
+    forms = {word}
+    forms.update(word + suffix for suffix in _SUFFIXES)
+    if len(word) > 2 and word.endswith('e'):
+        # overdose -> overdosing, suicide -> suicidal
+        forms.update(word[:-1] + suffix for suffix in _SUFFIXES if suffix[0] in 'aei')
+    elif len(word) > 2 and word.endswith('y'):
+        # anxiety -> anxieties
+        forms.update(word[:-1] + suffix for suffix in ('ies', 'ied'))
+    elif len(word) > 2 and word[-1] not in 'aeiouwxy' and word[-2] in 'aeiou' and word[-3] not in 'aeiou':
+        # cut -> cutting, stop -> stopped
+        forms.update(word + word[-1] + suffix for suffix in ('ing', 'ed', 'er'))
+    return forms
+
+
+def phrase_forms(words):
+    """Every word tuple a phrase matches, with its first and last word inflected"""
+    if len(words) == 1:
+        return [(form,) for form in inflections(words[0])]
+    return [(first,) + words[1:-1] + (last,)
+            for first in inflections(words[0]) for last in inflections(words[-1])]
+
+
+class _Automaton:
+    """Aho-Corasick automaton whose alphabet is whole words"""
+
+    def __init__(self, phrases):
+        # phrases: iterable of (word tuple, payload)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+
+        for words, payload in phrases:
+            state = 0
+            for word in words:
+                nxt = self.goto[state].get(word)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][word] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] = self.out[state] + (payload,)
+
+        # Breadth-first pass to build failure links and merge outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(word, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scan(self, words):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        found = []
+        for word in words:
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+
+class SafetyScanner:
+    """Thread-safe, reloadable matcher over all safety phrases"""
+
+    def __init__(self, keywords_by_level, path=None, reload_interval=30.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._compile(keywords_by_level)
+        if path:
+            self.reload_if_changed(force=True)
+
+    def _compile(self, keywords_by_level):
+        phrases = []
+        counts = {}
+        for level in SAFETY_LEVELS:
+            keywords = keywords_by_level.get(level, [])
+            counts[level] = len(keywords)
+            for keyword in keywords:
+                words = tuple(normalise(keyword))
+                if words:
+                    phrases.extend((form, (level, keyword)) for form in phrase_forms(words))
+        # Swap in the new automaton in one assignment so scans never see a half-built one
+        self._automaton = _Automaton(phrases)
+        self.phrase_counts = counts
+
+    def reload_if_changed(self, force=False):
+        """Recompile from the config file if it changed (checked at most every reload_interval)"""
+        if not self.path:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+
+        with self._lock:
+            self._next_check = now + self.reload_interval
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                if force:
+                    logger.warning("Safety keyword file %s not found, using built-in keywords", self.path)
+                return False
+            if mtime == self._mtime:
+                return False
+
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    keywords_by_level = json.load(f)
+                self._compile(keywords_by_level)
+            except (OSError, ValueError) as e:
+                # Keep scanning with the previous phrases rather than failing open
+                logger.error("Could not load safety keywords from %s: %s", self.path, e)
+                return False
+            self._mtime = mtime
+
+        logger.info("Loaded safety keywords from %s: %s", self.path, self.phrase_counts)
+        return True
+
+    def scan(self, message):
+        """Return every (level, phrase) matched in the message, in one pass"""
+        self.reload_if_changed()
+        seen = set()
+        matches = []
+        for match in self._automaton.scan(normalise(message)):
+            if match not in seen:
+                seen.add(match)
+                matches.append(match)
+        return matches
+
+    def classify(self, message):
+        """Return (most severe level or 'SAFE', matched phrases at that level)"""
+        matches = self.scan(message)
+        for level in SAFETY_LEVELS:
+            phrases = [phrase for match_level, phrase in matches if match_level == level]
+            if phrases:
+                return level, phrases
+        return 'SAFE', []
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Production server for the chat API: several worker processes, each with a pool of threads.
+
+`python app.py` runs Flask's single-process development server. This
+runs the same app under gunicorn instead: SERVER_WORKERS processes, each
+handling up to SERVER_THREADS requests at once, so the CPU-bound parts
+of requests (safety checks, prompt building, JSON) run in parallel and
+one crashed worker doesn't take the API down. Before forking the
+workers it starts the shared state server (shared_state.py), so
+sessions, rate limits, generation slots, circuit breakers, the response
+cache and safety alerts behave as they do in one process. Workers run
+their startup checks in the background, so the port is open at once and
+/api/test answers 503 until Ollama and the model are confirmed.
+
+Needs gunicorn, which runs on Linux and macOS (pip install -r requirements.txt).
+
+Run: python serve.py
+"""
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    sys.exit("serve.py needs gunicorn, which doesn't run on Windows; use python app.py there")
+
+from shared_state import StateServer
+
+load_dotenv()
+
+
+def default_threads(workers):
+    """Threads per worker to hold every running and queued generation across the workers, plus a few"""
+    generations = int(os.getenv('GENERATION_MAX_CONCURRENT', '2')) + int(os.getenv('GENERATION_QUEUE_SIZE', '64'))
+    return math.ceil(generations / workers) + 4
+
+
+def server_options():
+    """gunicorn settings from the environment"""
+    workers = int(os.getenv('SERVER_WORKERS') or min(os.cpu_count() or 1, 4))
+    return {
+        'bind': f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('PORT', '5000')}",
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('SERVER_THREADS') or default_threads(workers)),
+        # Workers are restarted if they stop answering the master for this long
+        'timeout': int(os.getenv('SERVER_WORKER_TIMEOUT', '30')),
+        'graceful_timeout': int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30')),
+        # Each worker imports the app itself, after the fork, so its threads and connections are its own
+        'preload_app': False,
+        # The app writes its own access log lines
+        'accesslog': None
+    }
+
+
+class ProductionServer(BaseApplication):
+    """gunicorn running app.create_app() in each worker, with a shared state server alongside"""
+
+    def __init__(self, options):
+        self.options = options
+        self.state_server = StateServer()
+        self.chatbot_dir = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('on_starting', self.on_starting)
+        self.cfg.set('child_exit', self.child_exit)
+        self.cfg.set('on_exit', self.on_exit)
+
+    def load(self):
+        from app import create_app
+        return create_app()
+
+    def on_starting(self, server):
+        os.makedirs(os.getenv('SAFETY_LOG_DIR', 'wellbeing_logs'), exist_ok=True)
+        if not os.getenv('CHATBOT_REGISTRY_DIR'):
+            # Workers share registered chatbots through a directory; without one configured,
+            # use a temporary one for this run
+            self.chatbot_dir = tempfile.mkdtemp(prefix='chatbots-')
+            os.environ['CHATBOT_REGISTRY_DIR'] = self.chatbot_dir
+        address = self.state_server.start()
+        server.log.info("Shared state server listening at %s", address)
+
+    def child_exit(self, server, worker):
+        # A worker that died mid-generation would otherwise keep its slots forever
+        self.state_server.worker_exited(worker.pid)
+
+    def on_exit(self, server):
+        self.state_server.stop()
+        if self.chatbot_dir:
+            shutil.rmtree(self.chatbot_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    options = server_options()
+    print(f"Serving on http://{options['bind']} with {options['workers']} workers x "
+          f"{options['threads']} threads")
+    ProductionServer(options).run()
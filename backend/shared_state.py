@@ -0,0 +1,384 @@
+"""
+State shared by the worker processes of the production server (serve.py).
+
+Each worker is a separate Python process with its own copy of every
+module-level object, but some state is only right if the workers agree
+on it. A session's history must be there whichever worker the student's
+next message lands on. A rate limit, or the GENERATION_MAX_CONCURRENT
+generation slots, must count every worker's requests. Once one worker's
+breaker ejects an Ollama node, the others should stop sending to it too.
+
+Before forking the workers, the server starts a StateServer: a
+multiprocessing manager process holding the single instance of each such
+object. app.py builds them with shared_object(). In a worker this asks
+the StateServer for the instance and returns a proxy; each call is then
+a round trip over a local socket, well under a millisecond. In a single
+process, shared_object() just builds the object. Workers also publish
+their metrics to the StateServer, so /api/metrics can add them up.
+"""
+
+import atexit
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager, BaseProxy
+
+from generation_scheduler import GenerationScheduler
+from ollama_health import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_ENV = 'SHARED_STATE_ADDRESS'
+AUTHKEY_ENV = 'SHARED_STATE_AUTHKEY'
+
+# Held in the StateServer process: name -> object, created by the first worker to ask
+_objects = {}
+_objects_lock = threading.Lock()
+
+
+def _shared(name, factory, args, kwargs):
+    with _objects_lock:
+        if name not in _objects:
+            _objects[name] = factory(*args, **kwargs)
+        return _objects[name]
+
+
+def _shared_scheduler(name, factory, args, kwargs):
+    return _shared(name, lambda *args, **kwargs: _WorkerSlots(factory(*args, **kwargs)), args, kwargs)
+
+
+class _WorkerSlots:
+    """A GenerationScheduler shared by the workers, which gets back the slots of workers that die holding them"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._held = {}  # worker -> slots held
+        self._gone = set()
+
+    def acquire(self, worker, priority, owner=None, timeout=None):
+        self.scheduler.acquire(priority, owner, timeout)
+        with self._lock:
+            if worker not in self._gone:
+                self._held[worker] = self._held.get(worker, 0) + 1
+                return
+        # Its worker died while it was queued
+        self.scheduler.release()
+
+    def release(self, worker):
+        with self._lock:
+            if not self._held.get(worker):
+                return
+            self._held[worker] -= 1
+        self.scheduler.release()
+
+    def release_worker(self, pid):
+        with self._lock:
+            workers = {worker for worker in self._held if worker[0] == pid}
+            self._gone |= workers
+            held = sum(self._held.pop(worker) for worker in workers)
+        for _ in range(held):
+            self.scheduler.release()
+        return held
+
+    def queue_depth(self):
+        return self.scheduler.queue_depth()
+
+    def stats(self):
+        return self.scheduler.stats()
+
+
+class _Workers:
+    """Each live worker's latest metrics, and the totals of workers that have exited"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # worker -> metrics snapshot
+        self._retired = []
+
+    def publish(self, worker, snapshot):
+        with self._lock:
+            self._metrics[worker] = snapshot
+
+    def metrics(self, exclude=None):
+        with self._lock:
+            return [snapshot for worker, snapshot in self._metrics.items() if worker != exclude] + self._retired
+
+    def exited(self, pid):
+        """Keep an exited worker's counts in the totals and free the generation slots it held"""
+        with self._lock:
+            for worker in [worker for worker in self._metrics if worker[0] == pid]:
+                self._retired.append(self._metrics.pop(worker))
+        with _objects_lock:
+            schedulers = [obj for obj in _objects.values() if isinstance(obj, _WorkerSlots)]
+        released = sum(scheduler.release_worker(pid) for scheduler in schedulers)
+        if released:
+            logger.warning("Freed %s generation slot(s) held by exited worker %s", released, pid)
+
+    def close(self):
+        """Close the shared objects that buffer writes (e.g. safety alerts) before shutting down"""
+        with _objects_lock:
+            objects = list(_objects.values())
+        for obj in objects:
+            if hasattr(obj, 'close'):
+                obj.close()
+
+
+_workers = _Workers()
+
+
+def _get_workers():
+    return _workers
+
+
+class SchedulerProxy(BaseProxy):
+    """A worker's handle on the shared GenerationScheduler, with the same methods"""
+
+    _exposed_ = ('acquire', 'release', 'queue_depth', 'stats')
+
+    def acquire(self, priority, owner=None, timeout=None):
+        return self._callmethod('acquire', (worker_id(), priority, owner, timeout))
+
+    def release(self):
+        return self._callmethod('release', (worker_id(),))
+
+    @contextmanager
+    def slot(self, priority, owner=None, timeout=None):
+        self.acquire(priority, owner, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queue_depth(self):
+        return self._callmethod('queue_depth')
+
+    def stats(self):
+        return self._callmethod('stats')
+
+
+class BreakerProxy(BaseProxy):
+    """A worker's handle on a node's shared CircuitBreaker, including its `state` property"""
+
+    _exposed_ = ('__getattribute__', 'allow_request', 'record_success', 'record_failure', 'release_trial',
+                 'snapshot')
+
+    @property
+    def state(self):
+        return self._callmethod('__getattribute__', ('state',))
+
+    def allow_request(self):
+        return self._callmethod('allow_request')
+
+    def record_success(self):
+        return self._callmethod('record_success')
+
+    def record_failure(self):
+        return self._callmethod('record_failure')
+
+    def release_trial(self):
+        return self._callmethod('release_trial')
+
+    def snapshot(self):
+        return self._callmethod('snapshot')
+
+
+class WorkersProxy(BaseProxy):
+    _exposed_ = ('publish', 'metrics', 'exited')
+
+    def publish(self, worker, snapshot):
+        return self._callmethod('publish', (worker, snapshot))
+
+    def metrics(self, exclude=None):
+        return self._callmethod('metrics', (exclude,))
+
+    def exited(self, pid):
+        return self._callmethod('exited', (pid,))
+
+
+class StateManager(BaseManager):
+    pass
+
+
+StateManager.register('shared', _shared)
+StateManager.register('scheduler', _shared_scheduler, SchedulerProxy)
+StateManager.register('breaker', _shared, BreakerProxy)
+StateManager.register('workers', _get_workers, WorkersProxy)
+
+# Factories whose objects need a proxy type other than the automatic one
+_PROXIES = {GenerationScheduler: 'scheduler', CircuitBreaker: 'breaker'}
+
+
+class StateServer:
+    """The process holding the shared state, started by the server before it forks its workers.
+
+    It is a plain subprocess rather than a multiprocessing child, which
+    forked workers would inherit and try to join when they exit.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.manager = None
+        self._directory = None
+
+    def start(self, timeout=10.0):
+        """Start the state process and export its address, so workers forked from here connect to it"""
+        self._directory = tempfile.mkdtemp(prefix='shared-state-')
+        address = os.path.join(self._directory, 'state.sock')
+        authkey = os.urandom(32).hex()
+        os.environ[ADDRESS_ENV] = address
+        os.environ[AUTHKEY_ENV] = authkey
+        # It runs until its stdin is closed, by stop() or by this process exiting
+        self.process = subprocess.Popen([sys.executable, '-c', 'import shared_state; shared_state.serve()'],
+                                        cwd=os.path.dirname(os.path.abspath(__file__)), stdin=subprocess.PIPE)
+        self.manager = StateManager(address=address, authkey=bytes.fromhex(authkey))
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.manager.connect()
+                return address
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("The shared state server did not start")
+                time.sleep(0.02)
+
+    def worker_exited(self, pid):
+        if self.manager is not None:
+            self.manager.workers().exited(pid)
+
+    def stop(self, timeout=30.0):
+        """Stop the state process, which first flushes the shared objects' buffered writes"""
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("The shared state server did not stop within %ss", timeout)
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        shutil.rmtree(self._directory, ignore_errors=True)
+        os.environ.pop(ADDRESS_ENV, None)
+        os.environ.pop(AUTHKEY_ENV, None)
+
+
+def serve():
+    """The state process: serve the shared objects until stdin closes (the server stopping or exiting)"""
+    # Ctrl-C, or a service manager's SIGTERM, can reach the whole process group. Keep serving
+    # the workers while they finish their requests; the server closes stdin once they have.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    manager = StateManager(address=os.environ[ADDRESS_ENV], authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    server = manager.get_server()
+
+    def exit_when_stdin_closes():
+        sys.stdin.buffer.read()
+        try:
+            _workers.close()
+        except Exception as e:
+            logger.error("Could not close the shared state objects: %s", e)
+        os._exit(0)
+
+    threading.Thread(target=exit_when_stdin_closes, name='stdin-watch', daemon=True).start()
+    server.serve_forever()
+
+
+_connection = None
+_workers_proxy = None
+_connection_lock = threading.Lock()
+_worker = None
+
+
+def worker_id():
+    """(pid, random tag) for this process, so a reused pid isn't taken for an exited worker"""
+    global _worker
+    if _worker is None or _worker[0] != os.getpid():
+        _worker = (os.getpid(), uuid.uuid4().hex[:8])
+    return _worker
+
+
+def connection():
+    """This worker's StateManager client, or None when not running under serve.py"""
+    global _connection
+    address = os.getenv(ADDRESS_ENV)
+    if not address:
+        return None
+    with _connection_lock:
+        if _connection is None:
+            manager = StateManager(address=address, authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+            manager.connect()
+            _connection = manager
+        return _connection
+
+
+def _workers_handle():
+    global _workers_proxy
+    manager = connection()
+    if manager is None:
+        return None
+    with _connection_lock:
+        if _workers_proxy is None:
+            _workers_proxy = manager.workers()
+        return _workers_proxy
+
+
+def state_shared():
+    """Whether this process is a worker sharing its state through a StateServer"""
+    return connection() is not None
+
+
+def shared_object(name, factory, *args, **kwargs):
+    """factory(*args, **kwargs), or in a worker a proxy for the StateServer's one instance named `name`"""
+    manager = connection()
+    if manager is None:
+        return factory(*args, **kwargs)
+    return getattr(manager, _PROXIES.get(factory, 'shared'))(name, factory, args, kwargs)
+
+
+def other_workers_metrics():
+    """Metrics snapshots published by the other workers (and exited ones); empty in a single process"""
+    workers = _workers_handle()
+    return [] if workers is None else workers.metrics(worker_id())
+
+
+class MetricsPublisher:
+    """Publishes a worker's metrics to the StateServer every `interval` seconds, and once more at exit"""
+
+    def __init__(self, registry, interval=5.0):
+        self.registry = registry
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if connection() is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='metrics-publisher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self.publish()
+
+    def publish(self):
+        try:
+            _workers_handle().publish(worker_id(), self.registry.snapshot())
+        except Exception as e:
+            logger.warning("Could not publish metrics to the shared state server: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.publish()
@@ -0,0 +1,346 @@
+"""
+Coalescing of identical in-flight generations.
+
+When a teacher tells a class to ask a chatbot the same question, many
+identical requests arrive within a second or two. The first becomes the
+leader and runs the generation; requests with the same persona, message
+and conversation history that arrive within the persona's window join it
+as followers and receive the same reply, or the same stream of tokens,
+without queueing for a generation of their own.
+
+A flight's items are produced lazily by whichever subscriber needs the
+next one, so a follower keeps the stream going if the leader's student
+disconnects. The upstream generation is closed once every subscriber
+has left. Flight (threads) serves the sync app and AsyncFlight (asyncio)
+the async app; both are handed out by SingleFlight.claim().
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+
+_PULL = object()
+
+
+def coalescing_key(persona, message, conversation_history, student_id=None):
+    """Identify a generation by persona, message and the whole conversation so far.
+
+    `student_id` limits sharing to that student's requests, for a
+    generation planned from their stored conversation state.
+    """
+    digest = hashlib.sha1(persona.encode('utf-8'))
+    if student_id is not None:
+        digest.update(b'\x1c' + str(student_id).encode('utf-8'))
+    for msg in conversation_history or []:
+        digest.update(b'\x1e' + str(msg.get('role', '')).encode('utf-8'))
+        digest.update(b'\x1f' + str(msg.get('content', '')).encode('utf-8'))
+    digest.update(b'\x1d' + message.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def coalescing_windows(spec, default_window):
+    """Parse 'persona[:seconds],...' into {persona: window in seconds}"""
+    windows = {}
+    for entry in spec.split(','):
+        persona, _, seconds = entry.strip().partition(':')
+        if persona:
+            windows[persona] = float(seconds) if seconds else default_window
+    return windows
+
+
+class _FlightState:
+    """Items produced so far and who is reading them; shared by both flight kinds"""
+
+    def __init__(self, on_finish):
+        self.started = time.monotonic()
+        self._on_finish = on_finish
+        self._on_close = None
+        self._source = None
+        self._items = []
+        self._done = False
+        self._error = None
+        self._pulling = False
+        self._subscribers = 0
+
+    def _mark_done(self, error=None):
+        # Caller holds the flight's lock; returns True the first time only
+        if self._done:
+            return False
+        self._done = True
+        self._error = error
+        return True
+
+    def _finished(self):
+        # Called once, outside the lock, when the flight can take no more joins
+        self._on_finish(self)
+        if self._on_close:
+            self._on_close()
+
+
+class Flight(_FlightState):
+    """A generation shared between threads"""
+
+    def __init__(self, on_finish):
+        super().__init__(on_finish)
+        self._cond = threading.Condition()
+
+    def subscribe(self):
+        with self._cond:
+            self._subscribers += 1
+        return Subscription(self)
+
+    def start(self, source, on_close=None):
+        """Leader: supply the iterator every subscriber reads; on_close runs once it ends"""
+        with self._cond:
+            self._source = iter(source)
+            self._on_close = on_close
+            self._cond.notify_all()
+
+    def fail(self, error):
+        """Leader: the generation could not start; every subscriber raises `error`"""
+        with self._cond:
+            first = self._mark_done(error)
+            self._cond.notify_all()
+        if first:
+            self._finished()
+
+    def read(self):
+        index = 0
+        while True:
+            with self._cond:
+                while (index >= len(self._items) and not self._done
+                       and (self._pulling or self._source is None)):
+                    self._cond.wait()
+                if index < len(self._items):
+                    item = self._items[index]
+                    index += 1
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._pulling = True
+                    item = _PULL
+            if item is _PULL:
+                self._pull()
+            else:
+                yield item
+
+    def _pull(self):
+        error = None
+        try:
+            item = next(self._source)
+        except StopIteration:
+            item = _PULL
+        except Exception as e:
+            item, error = _PULL, e
+        with self._cond:
+            self._pulling = False
+            if item is _PULL:
+                first = self._mark_done(error)
+            else:
+                self._items.append(item)
+                first = False
+            self._cond.notify_all()
+        if first:
+            self._finished()
+
+    def leave(self):
+        with self._cond:
+            self._subscribers -= 1
+            # Nobody is left to read it, so stop the generation
+            first = self._subscribers == 0 and self._mark_done()
+            self._cond.notify_all()
+        if first:
+            if self._source is not None and hasattr(self._source, 'close'):
+                self._source.close()
+            self._finished()
+
+
+class Subscription:
+    """One request's view of a Flight. Iterate it for the items; close() it when done."""
+
+    def __init__(self, flight, leader=False):
+        self.flight = flight
+        self.leader = leader
+        self._closed = False
+
+    def start(self, source, on_close=None):
+        self.flight.start(source, on_close)
+
+    def fail(self, error):
+        self.flight.fail(error)
+
+    def __iter__(self):
+        try:
+            yield from self.flight.read()
+        finally:
+            self.close()
+
+    def close(self):
+        # Safe to call more than once, e.g. from the stream and the response's close hook
+        if not self._closed:
+            self._closed = True
+            self.flight.leave()
+
+
+class AsyncFlight(_FlightState):
+    """A generation shared between tasks on one event loop.
+
+    Items are pulled by a task of the flight's own, so a subscriber being
+    cancelled (its student disconnected) doesn't cut the stream short for
+    the others.
+    """
+
+    def __init__(self, on_finish):
+        super().__init__(on_finish)
+        self._changed = asyncio.Event()
+        self._puller = None
+
+    def subscribe(self):
+        self._subscribers += 1
+        return AsyncSubscription(self)
+
+    def _notify(self):
+        # Wake every waiting task; each re-checks the state and waits on a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self, source, on_close=None):
+        self._source = source
+        self._on_close = on_close
+        self._notify()
+
+    def fail(self, error):
+        if self._mark_done(error):
+            self._notify()
+            self._finished()
+
+    async def read(self):
+        index = 0
+        while True:
+            if index < len(self._items):
+                item = self._items[index]
+                index += 1
+                yield item
+            elif self._done:
+                if self._error is not None:
+                    raise self._error
+                return
+            else:
+                if not self._pulling and self._source is not None:
+                    self._pulling = True
+                    self._puller = asyncio.ensure_future(self._pull())
+                await self._changed.wait()
+
+    async def _pull(self):
+        error = None
+        try:
+            item = await self._source.__anext__()
+        except StopAsyncIteration:
+            item = _PULL
+        except Exception as e:
+            item, error = _PULL, e
+        finally:
+            self._pulling = False
+        if item is _PULL:
+            first = self._mark_done(error)
+        else:
+            self._items.append(item)
+            first = False
+        self._notify()
+        if first:
+            self._finished()
+
+    async def leave(self):
+        self._subscribers -= 1
+        if self._subscribers == 0 and self._mark_done():
+            self._notify()
+            if self._puller is not None and not self._puller.done():
+                self._puller.cancel()
+                await asyncio.gather(self._puller, return_exceptions=True)
+            if self._source is not None:
+                await self._source.aclose()
+            self._finished()
+
+
+class AsyncSubscription:
+    """Async counterpart of Subscription: iterate with `async for`, then aclose()"""
+
+    def __init__(self, flight, leader=False):
+        self.flight = flight
+        self.leader = leader
+        self._closed = False
+
+    def start(self, source, on_close=None):
+        self.flight.start(source, on_close)
+
+    def fail(self, error):
+        self.flight.fail(error)
+
+    async def __aiter__(self):
+        try:
+            async for item in self.flight.read():
+                yield item
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            await self.flight.leave()
+
+
+class SingleFlight:
+    """Hands out flights for coalescing personas, keyed by coalescing_key()"""
+
+    def __init__(self, windows, flight_class=Flight):
+        self.windows = dict(windows)
+        self.flight_class = flight_class
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.generations = 0
+        self.coalesced = 0
+
+    def window(self, persona):
+        """Join window in seconds for a persona, or None if it isn't coalesced"""
+        # Custom chatbots ('custom:<hash>') share the 'custom' setting
+        return self.windows.get(persona.split(':', 1)[0])
+
+    def claim(self, persona, key):
+        """Join the in-flight generation for `key` or become its leader.
+
+        Returns a subscription whose `leader` attribute says whether the
+        caller must start() (or fail()) the generation, or None if the
+        persona isn't coalesced. A flight only takes followers for its
+        persona's window after it started, and never once it has finished.
+        """
+        window = self.window(persona)
+        if window is None or window <= 0:
+            return None
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight._done and time.monotonic() - flight.started <= window:
+                self.coalesced += 1
+                return flight.subscribe()
+            flight = self.flight_class(lambda finished: self._forget(key, finished))
+            self._flights[key] = flight
+            self.generations += 1
+            subscription = flight.subscribe()
+        subscription.leader = True
+        return subscription
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'personas': self.windows,
+                'in_flight': len(self._flights),
+                'generations': self.generations,
+                'coalesced': self.coalesced
+            }
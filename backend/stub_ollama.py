@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Minimal local stand-in for the Ollama HTTP API, used by the benchmarks.
+
+Run standalone:  python stub_ollama.py --port 11435 --delay 0.05
+Then point the backend at it with OLLAMA_URL=http://localhost:11435
+"""
+
+import argparse
+import json
+import random
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_NAME = "llama3.2:3b"
+# Ollama's context size when a request doesn't set num_ctx
+DEFAULT_NUM_CTX = 2048
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # A classroom burst opens many connections at once
+    request_queue_size = 256
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; avoid Nagle/delayed-ACK stalls
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+
+        if self.path == '/':
+            body = b'Ollama is running'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/api/tags':
+            self._send_json({'models': [{'name': self.server.model}]})
+        elif self.path == '/api/ps':
+            loaded = [{'name': self.server.model}] if self.server.loaded else []
+            self._send_json({'models': loaded})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.requests += 1
+
+        payload = self._read_json()
+        if self.path != '/api/generate':
+            self._send_json({'error': 'not found'}, status=404)
+            return
+
+        if payload.get('model') != self.server.model:
+            self._send_json({'error': f"model '{payload.get('model')}' not found"}, status=404)
+            return
+
+        options = payload.get('options') or {}
+        self._load_model(options.get('num_ctx', DEFAULT_NUM_CTX))
+        if not payload.get('prompt'):
+            # An empty prompt only loads the model, as Ollama's preload request does
+            self._send_json({'model': self.server.model, 'response': '', 'done': True, 'done_reason': 'load'})
+            return
+
+        fault = self._fault()
+        if fault == 'error':
+            self._send_json({'error': 'stub: injected server error'}, status=500)
+            return
+        if fault == 'stall':
+            # Longer than the backend's read timeout, like a wedged model runner
+            time.sleep(self.server.stall_seconds)
+
+        started = time.perf_counter()
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak_active = max(self.server.peak_active, self.server.active)
+        try:
+            self._generate(payload)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+                self.server.generation_seconds += time.perf_counter() - started
+
+    def _generate(self, payload):
+        # Tokens in `context` are already in the KV cache; only the new prompt is evaluated
+        context = list(payload.get('context') or [])
+        words = payload.get('prompt', '').split()
+        prompt_tokens = len(words)
+        evaluated = prompt_tokens if context else self._uncached(words)
+        prompt_eval = self.server.delay + self.server.prompt_token_delay * evaluated
+        if not self._work(prompt_eval):
+            return
+
+        tokens = self._tokens()
+        num_predict = (payload.get('options') or {}).get('num_predict')
+        done_reason = 'stop'
+        if num_predict is not None and 0 <= num_predict < len(tokens):
+            tokens = tokens[:num_predict]
+            done_reason = 'length'
+        stats = {
+            'model': self.server.model,
+            'done': True,
+            'done_reason': done_reason,
+            'context': context + list(range(prompt_tokens + len(tokens))),
+            'prompt_eval_count': evaluated,
+            'prompt_eval_duration': int(prompt_eval * 1e9),
+            'eval_count': len(tokens),
+            'eval_duration': int(self.server.token_delay * len(tokens) * 1e9)
+        }
+        stats['total_duration'] = stats['prompt_eval_duration'] + stats['eval_duration']
+
+        if payload.get('stream', True):
+            self._stream_reply(tokens, stats)
+        elif self._work(self.server.token_delay * len(tokens)):
+            self._send_json(dict(stats, response=''.join(tokens)))
+
+    def _work(self, seconds):
+        """Spend `seconds` generating, stopping early if the client hangs up, as Ollama does"""
+        deadline = time.perf_counter() + seconds
+        while True:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                return True
+            time.sleep(min(left, 0.01))
+            if self._client_gone():
+                self._aborted()
+                return False
+
+    def _client_gone(self):
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        try:
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def _aborted(self):
+        with self.server.lock:
+            self.server.aborted += 1
+        self.close_connection = True
+
+    def _load_model(self, num_ctx):
+        """Pay the model load time if it is not in memory (e.g. after an eviction) or has another num_ctx"""
+        with self.server.load_lock:
+            if not self.server.loaded or num_ctx != self.server.num_ctx:
+                time.sleep(self.server.load_seconds)
+                self.server.loaded = True
+                self.server.num_ctx = num_ctx
+                self.server.loads += 1
+
+    def _uncached(self, words):
+        """Prompt words not covered by the longest matching prefix in the prompt cache"""
+        with self.server.lock:
+            cache = self.server.prompt_cache
+            if not self.server.prompt_cache_slots:
+                return len(words)
+            best, shared = None, 0
+            for slot, cached in enumerate(cache):
+                common = 0
+                for a, b in zip(cached, words):
+                    if a != b:
+                        break
+                    common += 1
+                if common > shared:
+                    best, shared = slot, common
+            # Like Ollama, only overwrite the best match if it is extended, not
+            # trimmed; otherwise the prompt takes a free or least recently used slot
+            if best is not None and shared == len(cache[best]):
+                del cache[best]
+            elif len(cache) >= self.server.prompt_cache_slots:
+                del cache[0]
+            cache.append(words)
+            # Like Ollama, the last prompt token is always evaluated
+            return len(words) - min(shared, len(words) - 1)
+
+    def _fault(self):
+        """Pick an injected failure for this request: 'error', 'stall' or None"""
+        with self.server.lock:
+            roll = self.server.random.random()
+            if roll < self.server.error_rate:
+                self.server.faults['error'] += 1
+                return 'error'
+            if roll < self.server.error_rate + self.server.stall_rate:
+                self.server.faults['stall'] += 1
+                return 'stall'
+        return None
+
+    def _tokens(self):
+        words = self.server.reply.split(' ')
+        return [word if i == 0 else ' ' + word for i, word in enumerate(words)]
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b'\r\n')
+
+    def _stream_reply(self, tokens, stats):
+        """Send the reply as newline-delimited JSON chunks, like Ollama does"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(self.server.token_delay)
+                self._write_chunk({'model': self.server.model, 'response': token, 'done': False})
+            self._write_chunk(dict(stats, response=''))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-generation, as a real Ollama would see it
+            self._aborted()
+
+
+def start_stub_server(host='127.0.0.1', port=0, delay=0.0, model=MODEL_NAME,
+                      reply="Hello, I'm working!", token_delay=0.0, prompt_token_delay=0.0,
+                      error_rate=0.0, stall_rate=0.0, stall_seconds=35.0, seed=None,
+                      load_seconds=0.0, prompt_cache_slots=0):
+    """Start a stub Ollama server in a daemon thread and return it.
+
+    `delay` is a fixed per-request latency, `prompt_token_delay` the time to
+    evaluate each prompt word and `token_delay` the time per generated token. The bound address is available as server.server_address
+    and the number of TCP connections accepted so far as server.connections.
+    Time spent generating is summed in server.generation_seconds, and the
+    most generations running at once is server.peak_active. A client
+    hanging up stops its generation early, counted in server.aborted.
+
+    A fraction `error_rate` of generations is answered with a 500, and a
+    fraction `stall_rate` first sleeps `stall_seconds`. Injected failures
+    are counted in server.faults. The rates can be changed while running.
+
+    The model starts unloaded. The first generation or preload waits
+    `load_seconds` to load it; set server.loaded = False to simulate an
+    eviction. Like Ollama, a request for another num_ctx than the loaded
+    model's reloads it. Loads are counted in server.loads.
+
+    Replies stop after the request's num_predict tokens, with done_reason
+    'length'.
+
+    With `prompt_cache_slots`, the stub remembers that many recent prompts
+    and, like Ollama's runner, only evaluates the part of a new full prompt
+    after the longest prefix it shares with one of them.
+    """
+    server = StubOllamaServer((host, port), StubOllamaHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    server.aborted = 0
+    server.generation_seconds = 0.0
+    server.active = 0
+    server.peak_active = 0
+    server.delay = delay
+    server.token_delay = token_delay
+    server.prompt_token_delay = prompt_token_delay
+    server.model = model
+    server.reply = reply
+    server.error_rate = error_rate
+    server.stall_rate = stall_rate
+    server.stall_seconds = stall_seconds
+    server.random = random.Random(seed)
+    server.faults = {'error': 0, 'stall': 0}
+    server.load_lock = threading.Lock()
+    server.load_seconds = load_seconds
+    server.loaded = False
+    server.num_ctx = DEFAULT_NUM_CTX
+    server.loads = 0
+    server.prompt_cache_slots = prompt_cache_slots
+    server.prompt_cache = []
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def stub_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub Ollama server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds to wait before answering /api/generate')
+    parser.add_argument('--token-delay', type=float, default=0.0,
+                        help='Seconds per generated token')
+    parser.add_argument('--prompt-token-delay', type=float, default=0.0,
+                        help='Seconds to evaluate each prompt word')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of generations answered with a 500')
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help='Fraction of generations that stall for --stall-seconds first')
+    parser.add_argument('--stall-seconds', type=float, default=35.0)
+    parser.add_argument('--load-seconds', type=float, default=0.0,
+                        help='Seconds to load the model before its first generation')
+    parser.add_argument('--prompt-cache-slots', type=int, default=0,
+                        help='Recent prompts whose shared prefix is not evaluated again')
+    parser.add_argument('--model', default=MODEL_NAME)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.host, args.port, delay=args.delay, model=args.model,
+                               token_delay=args.token_delay,
+                               prompt_token_delay=args.prompt_token_delay,
+                               error_rate=args.error_rate, stall_rate=args.stall_rate,
+                               stall_seconds=args.stall_seconds,
+                               load_seconds=args.load_seconds,
+                               prompt_cache_slots=args.prompt_cache_slots)
+    print(f"Stub Ollama listening on {stub_url(server)} (model {args.model})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,80 @@
+"""
+Tests for the background safety alert writer.
+
+Run: python -m pytest test_alert_writer.py
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from alert_writer import AlertWriter
+
+
+def alert(when, text='Level: CONCERN'):
+    return f"{when.isoformat()} | Student: s1 | {text}\n"
+
+
+def backups(log_dir):
+    return sorted(name for name in os.listdir(log_dir) if name != 'wellbeing_alerts.log')
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_writes_queued_alerts_on_close(tmp_path):
+    writer = AlertWriter(str(tmp_path), flush_interval=0.05)
+    for i in range(5):
+        writer.write(alert(datetime.now(), f"alert {i}"))
+    writer.close()
+    assert read(writer.path).count('\n') == 5
+    assert writer.stats()['written'] == 5
+
+
+def test_rotates_by_size(tmp_path):
+    writer = AlertWriter(str(tmp_path), batch_size=1, flush_interval=0.01, max_bytes=200, fsync=False)
+    for i in range(10):
+        writer.write(alert(datetime.now(), f"alert {i} " + 'x' * 50))
+        time.sleep(0.02)
+    writer.close()
+    assert writer.rotations >= 2
+    assert os.path.getsize(writer.path) < 400
+
+
+def test_restart_keeps_the_age_of_an_existing_file(tmp_path):
+    path = tmp_path / 'wellbeing_alerts.log'
+    path.write_text(alert(datetime.now() - timedelta(days=2), 'from before the restart'), encoding='utf-8')
+
+    writer = AlertWriter(str(tmp_path), flush_interval=0.05, rotate_interval=86400, fsync=False)
+    writer.write(alert(datetime.now(), 'after the restart'))
+    writer.close()
+
+    assert writer.rotations == 1
+    assert 'after the restart' in read(path)
+    assert 'from before the restart' not in read(path)
+    assert len(backups(tmp_path)) == 1
+
+
+def test_restart_appends_to_a_recent_file(tmp_path):
+    path = tmp_path / 'wellbeing_alerts.log'
+    path.write_text(alert(datetime.now() - timedelta(hours=1), 'from before the restart'), encoding='utf-8')
+
+    writer = AlertWriter(str(tmp_path), flush_interval=0.05, rotate_interval=86400, fsync=False)
+    writer.write(alert(datetime.now(), 'after the restart'))
+    writer.close()
+
+    assert writer.rotations == 0
+    assert read(path).count('\n') == 2
+
+
+def test_prunes_old_backups(tmp_path):
+    for day in range(1, 6):
+        (tmp_path / f"wellbeing_alerts.log.2026010{day}-000000-000000").write_text('old\n')
+    (tmp_path / 'wellbeing_alerts.log').write_text(alert(datetime.now() - timedelta(days=2)))
+
+    writer = AlertWriter(str(tmp_path), flush_interval=0.05, backup_count=3, fsync=False)
+    writer.write(alert(datetime.now()))
+    writer.close()
+    assert len(backups(tmp_path)) == 3
@@ -0,0 +1,75 @@
+"""
+Tests for the registry of teacher-defined chatbots.
+
+Run: python -m pytest test_chatbot_registry.py
+"""
+
+import json
+import os
+import threading
+
+from chatbot_registry import ChatbotRegistry, chatbot_id
+
+CONFIG = {
+    'name': 'Mr Antolini',
+    'personality': 'A thoughtful English teacher',
+    'conversationStyle': 'Asks questions back',
+    'referenceMaterials': 'Chapter notes. ' * 20000
+}
+
+
+def compile_chatbot(config):
+    return dict(config, compiled=True)
+
+
+def test_same_config_gets_the_same_id(tmp_path):
+    registry = ChatbotRegistry(compile_chatbot, path=str(tmp_path))
+    key, compiled, created = registry.register(dict(CONFIG, ignored='field'))
+    assert created and compiled['compiled']
+    assert registry.register(CONFIG) == (key, compiled, False)
+    assert key == chatbot_id(CONFIG)
+
+
+def test_reloads_a_saved_chatbot_in_another_process(tmp_path):
+    key, _, _ = ChatbotRegistry(compile_chatbot, path=str(tmp_path)).register(CONFIG)
+    other = ChatbotRegistry(compile_chatbot, path=str(tmp_path))
+    assert other.get(key)['name'] == 'Mr Antolini'
+    assert other.stats()['loaded_from_disk'] == 1
+
+
+def test_removal_is_seen_by_other_processes(tmp_path):
+    key, _, _ = ChatbotRegistry(compile_chatbot, path=str(tmp_path)).register(CONFIG)
+    other = ChatbotRegistry(compile_chatbot, path=str(tmp_path), check_disk=True)
+    assert other.get(key) is not None
+    assert ChatbotRegistry(compile_chatbot, path=str(tmp_path)).remove(key)
+    assert other.get(key) is None
+
+
+def test_concurrent_saves_of_one_chatbot_leave_a_whole_file(tmp_path, caplog):
+    # Workers of the production server share the directory and may save the same chatbot at once
+    registries = [ChatbotRegistry(compile_chatbot, path=str(tmp_path)) for _ in range(8)]
+    start = threading.Barrier(len(registries))
+
+    def register(registry):
+        start.wait()
+        for _ in range(20):
+            registry.register(CONFIG)
+            registry._chatbots.clear()
+
+    threads = [threading.Thread(target=register, args=(registry,)) for registry in registries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert "Could not save chatbot" not in caplog.text
+    assert os.listdir(tmp_path) == [f"{chatbot_id(CONFIG)}.json"]
+    with open(tmp_path / f"{chatbot_id(CONFIG)}.json", encoding='utf-8') as f:
+        assert json.load(f) == CONFIG
+
+
+def test_unknown_or_malformed_ids_are_not_found(tmp_path):
+    registry = ChatbotRegistry(compile_chatbot, path=str(tmp_path))
+    assert registry.get('0123456789abcdef') is None
+    assert registry.get('../../etc/passwd') is None
+    assert not registry.remove('../../etc/passwd')
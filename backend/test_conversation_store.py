@@ -0,0 +1,52 @@
+"""
+Tests for the session-mode conversation store.
+
+Run: python -m pytest test_conversation_store.py
+"""
+
+import time
+
+from conversation_store import ConversationStore
+
+HISTORY = [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hey'}]
+
+
+def test_turns_are_added_to_a_stored_conversation():
+    store = ConversationStore()
+    store.replace('holden:s1:a', HISTORY)
+    assert store.append('holden:s1:a', 'who is phoebe', 'My kid sister.')
+    assert store.get('holden:s1:a') == HISTORY + [
+        {'role': 'user', 'content': 'who is phoebe'},
+        {'role': 'assistant', 'content': 'My kid sister.'}
+    ]
+
+
+def test_turn_for_an_evicted_session_is_not_stored():
+    store = ConversationStore(max_conversations=1)
+    store.replace('holden:s1:a', HISTORY)
+    # Another student's session pushes it out while its reply is generated
+    store.replace('holden:s2:b', HISTORY)
+    assert not store.append('holden:s1:a', 'who is phoebe', 'My kid sister.')
+    assert store.get('holden:s1:a') is None
+
+
+def test_turn_for_an_expired_session_is_not_stored():
+    store = ConversationStore(idle_timeout=0.01)
+    store.replace('holden:s1:a', HISTORY)
+    time.sleep(0.02)
+    assert not store.append('holden:s1:a', 'who is phoebe', 'My kid sister.')
+    assert store.get('holden:s1:a') is None
+    assert store.stats()['conversations'] == 0
+
+
+def test_long_conversations_keep_their_latest_messages():
+    store = ConversationStore(max_messages=4, max_message_chars=5)
+    store.replace('holden:s1:a', HISTORY)
+    store.append('holden:s1:a', 'who is phoebe', 'My kid sister.')
+    store.append('holden:s1:a', 'who is allie', 'My brother.')
+    assert store.get('holden:s1:a') == [
+        {'role': 'user', 'content': 'who i'},
+        {'role': 'assistant', 'content': 'My ki'},
+        {'role': 'user', 'content': 'who i'},
+        {'role': 'assistant', 'content': 'My br'}
+    ]
@@ -0,0 +1,70 @@
+"""
+Tests for load-adaptive reply budgets.
+
+Run: python -m pytest test_generation_budget.py
+"""
+
+import pytest
+
+from generation_budget import GenerationBudget, context_size, percentile
+
+# 100 tokens a second after half a second of prompt eval
+TIMINGS = {'eval_count': 100, 'eval_duration': 1e9, 'prompt_eval_duration': 0.5e9}
+
+
+@pytest.fixture
+def budget():
+    budget = GenerationBudget(target_p95=10.0, slots=1, min_tokens=96)
+    budget.observe('holden', TIMINGS)
+    return budget
+
+
+def test_helpers():
+    assert context_size(1) == 512 and context_size(513) == 1024
+    assert percentile([], 0.95) is None
+    assert percentile(list(range(1, 101)), 0.95) == 95
+
+
+def test_full_budget_until_speed_is_known():
+    assert GenerationBudget(10.0, slots=1).choose('holden', 300, queue_depth=50) == 300
+
+
+def test_queue_trims_replies_down_to_the_minimum(budget):
+    assert budget.choose('holden', 300, queue_depth=0) == 300
+    assert budget.choose('holden', 300, queue_depth=4) == 150
+    assert budget.choose('holden', 300, queue_depth=40) == 96
+    assert budget.choose('holden', 64, queue_depth=40) == 64
+
+
+def test_time_already_queued_and_the_deadline_count(budget):
+    assert budget.choose('holden', 1000, queue_depth=0, elapsed=8.0) == 150
+    assert budget.choose('holden', 1000, queue_depth=0, time_left=3.0) == 250
+
+
+def test_other_personas_borrow_the_models_speed(budget):
+    assert budget.choose('custom', 1000, queue_depth=0) == 1000
+    assert budget.choose('custom', 1000, queue_depth=4) == 200
+
+
+def test_latencies_over_target_shrink_budgets_within_bounds(budget):
+    for _ in range(5):
+        budget.observe_latency(12.0)
+    shrunk = budget.factor
+    assert shrunk < 1.0
+    assert budget.choose('holden', 1000, queue_depth=4) < 150
+    for _ in range(200):
+        budget.observe_latency(12.0)
+    assert budget.factor == pytest.approx(0.2)
+    for _ in range(500):
+        budget.observe_latency(1.0)
+    assert budget.factor == 1.0
+    assert budget.snapshot()['observed_p95_seconds'] == 1.0
+
+
+def test_snapshot_counts_trimmed_and_cut_short_replies(budget):
+    budget.choose('holden', 300, queue_depth=0)
+    budget.choose('holden', 300, queue_depth=4)
+    budget.observe('holden', dict(TIMINGS, done_reason='length'))
+    stats = budget.snapshot()['personas']['holden']
+    assert stats['budgets'] == 2 and stats['trimmed'] == 1 and stats['cut_short'] == 1
+    assert stats['mean_num_predict'] == 225
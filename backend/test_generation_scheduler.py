@@ -0,0 +1,160 @@
+"""
+Tests for generation admission: slots, priorities, backpressure and timeouts.
+
+Run: python -m pytest test_generation_scheduler.py
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from generation_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_HOLDEN, PRIORITY_WELLBEING, PRIORITY_WELLBEING_CONCERN,
+    AsyncGenerationScheduler, GenerationScheduler, SchedulerBusy
+)
+
+
+def queue_state(scheduler):
+    stats = scheduler.stats()
+    return stats['queue_depth'], sum(stats['rejected'].values())
+
+
+def queue_in_order(scheduler, requests):
+    """Queue (label, priority, owner) requests one at a time behind a held slot.
+
+    Returns the labels in the order they got the slot, and any SchedulerBusy reasons.
+    """
+    granted, busy = [], {}
+
+    def wait_for_slot(label, priority, owner):
+        try:
+            with scheduler.slot(priority, owner):
+                granted.append(label)
+        except SchedulerBusy as e:
+            busy[label] = e.reason
+
+    scheduler.acquire(PRIORITY_WELLBEING)
+    threads = []
+    for label, priority, owner in requests:
+        before = queue_state(scheduler)
+        thread = threading.Thread(target=wait_for_slot, args=(label, priority, owner))
+        thread.start()
+        threads.append(thread)
+        while queue_state(scheduler) == before and thread.is_alive():
+            time.sleep(0.001)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    return granted, busy
+
+
+def test_free_slots_are_taken_without_queueing():
+    scheduler = GenerationScheduler(max_concurrent=2)
+    scheduler.acquire(PRIORITY_HOLDEN)
+    scheduler.acquire(PRIORITY_HOLDEN)
+    stats = scheduler.stats()
+    assert stats['active'] == 2 and stats['queue_depth'] == 0
+    scheduler.release()
+    scheduler.release()
+    assert scheduler.stats()['active'] == 0
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    scheduler = GenerationScheduler(max_concurrent=1)
+    granted, _ = queue_in_order(scheduler, [
+        ('holden', PRIORITY_HOLDEN, None),
+        ('background', PRIORITY_BACKGROUND, None),
+        ('wellbeing 1', PRIORITY_WELLBEING, None),
+        ('concern', PRIORITY_WELLBEING_CONCERN, None),
+        ('wellbeing 2', PRIORITY_WELLBEING, None)
+    ])
+    assert granted == ['concern', 'wellbeing 1', 'wellbeing 2', 'holden', 'background']
+
+
+def test_full_queue_rejects_or_bumps_the_last_waiter():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=2)
+    granted, busy = queue_in_order(scheduler, [
+        ('holden 1', PRIORITY_HOLDEN, None),
+        ('holden 2', PRIORITY_HOLDEN, None),
+        ('holden 3', PRIORITY_HOLDEN, None),
+        ('concern', PRIORITY_WELLBEING_CONCERN, None)
+    ])
+    assert busy == {'holden 3': 'queue_full', 'holden 2': 'evicted'}
+    assert granted == ['concern', 'holden 1']
+    assert scheduler.stats()['rejected']['queue_full'] == 1
+
+
+def test_wait_is_limited_by_max_wait_and_the_client_deadline():
+    scheduler = GenerationScheduler(max_concurrent=1, max_wait=0.05)
+    scheduler.acquire(PRIORITY_HOLDEN)
+    with pytest.raises(SchedulerBusy) as timed_out:
+        scheduler.acquire(PRIORITY_HOLDEN)
+    assert timed_out.value.reason == 'timeout'
+    with pytest.raises(SchedulerBusy) as past_deadline:
+        scheduler.acquire(PRIORITY_HOLDEN, timeout=0.01)
+    assert past_deadline.value.reason == 'deadline'
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire(PRIORITY_HOLDEN, timeout=0)
+    scheduler.release()
+    assert scheduler.stats()['active'] == 0
+    assert scheduler.stats()['queue_depth'] == 0
+
+
+def test_async_scheduler_passes_a_cancelled_waiters_slot_on():
+    async def run():
+        scheduler = AsyncGenerationScheduler(max_concurrent=1)
+        await scheduler.acquire(PRIORITY_HOLDEN)
+        leaving = asyncio.ensure_future(scheduler.acquire(PRIORITY_WELLBEING))
+        staying = asyncio.ensure_future(scheduler.acquire(PRIORITY_HOLDEN))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.wait_for(staying, 1)
+        held = scheduler.stats()
+        scheduler.release()
+        return leaving.cancelled(), held, scheduler.stats()
+
+    cancelled, held, released = asyncio.run(run())
+    assert cancelled
+    # Whether it left before or just after being granted the slot, the slot went to the next waiter
+    assert held['active'] == 1 and held['queue_depth'] == 0
+    assert released['active'] == 0
+
+
+def test_each_student_gets_a_fair_share_within_a_priority():
+    scheduler = GenerationScheduler(max_concurrent=1)
+    granted, _ = queue_in_order(scheduler, [
+        ('ali 1', PRIORITY_HOLDEN, 'ali'),
+        ('ali 2', PRIORITY_HOLDEN, 'ali'),
+        ('ali 3', PRIORITY_HOLDEN, 'ali'),
+        ('bea 1', PRIORITY_HOLDEN, 'bea'),
+        ('bea 2', PRIORITY_HOLDEN, 'bea')
+    ])
+    assert granted == ['ali 1', 'bea 1', 'ali 2', 'bea 2', 'ali 3']
+
+
+def test_async_evicted_waiter_cancelled_later_frees_no_slot():
+    async def run():
+        scheduler = AsyncGenerationScheduler(max_concurrent=1, max_queue=1)
+        await scheduler.acquire(PRIORITY_HOLDEN)
+        bumped = asyncio.ensure_future(scheduler.acquire(PRIORITY_HOLDEN))
+        await asyncio.sleep(0)
+        # The student disconnects just as a concern request bumps them out of the queue
+        concern = asyncio.ensure_future(scheduler.acquire(PRIORITY_WELLBEING_CONCERN))
+        bumped.cancel()
+        await asyncio.gather(bumped, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        held = scheduler.stats()
+        scheduler.release()
+        await asyncio.wait_for(concern, 1)
+        scheduler.release()
+        return bumped.cancelled(), held, scheduler.stats()
+
+    cancelled, held, released = asyncio.run(run())
+    assert cancelled
+    assert held['rejected']['evicted'] == 1 and held['rejected']['cancelled'] == 0
+    assert held['active'] == 1 and held['queue_depth'] == 1
+    assert released['active'] == 0 and released['queue_depth'] == 0
@@ -0,0 +1,171 @@
+"""
+Tests for Ollama node routing and the circuit breaker's half-open trial.
+
+Run: python -m pytest test_ollama_pool.py
+"""
+
+import asyncio
+import time
+
+import pytest
+import requests
+
+from ollama_health import CircuitBreaker
+from ollama_pool import NoOllamaNode, OllamaNode, OllamaPool
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    """Stands in for a node's OllamaClient: answers `status_code` or raises `error`"""
+
+    base_url = 'http://fake:11434'
+
+    def __init__(self):
+        self.status_code = 200
+        self.error = None
+
+    def generate(self, payload, timeout=None, stream=False):
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(self.status_code)
+
+    def close(self):
+        pass
+
+
+def make_pool(nodes=1, failure_threshold=1, reset_timeout=0.05):
+    pool_nodes = []
+    for _ in range(nodes):
+        node = OllamaNode('http://fake:11434', failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        node.client = FakeClient()
+        pool_nodes.append(node)
+    return OllamaPool(pool_nodes)
+
+
+def half_open(pool):
+    """Trip the only node's breaker and wait until it lets a trial through"""
+    node = pool.nodes[0]
+    node.client.error = requests.exceptions.HTTPError("boom")
+    with pytest.raises(requests.exceptions.HTTPError):
+        pool.generate({'model': 'llama3.2:3b'})
+    node.client.error = None
+    assert node.breaker.state == CircuitBreaker.OPEN
+    time.sleep(node.breaker.reset_timeout)
+    assert node.breaker.state == CircuitBreaker.HALF_OPEN
+    return node
+
+
+def test_breaker_opens_and_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+    time.sleep(0.05)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_failures_while_open_dont_delay_the_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.03)
+    # Requests that were already in flight fail too
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.03)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_failed_trial_reopens_the_breaker():
+    pool = make_pool()
+    node = half_open(pool)
+    node.client.error = requests.exceptions.HTTPError("still down")
+    with pytest.raises(requests.exceptions.HTTPError):
+        pool.generate({'model': 'llama3.2:3b'})
+    assert node.breaker.state == CircuitBreaker.OPEN
+
+
+def test_trial_cut_short_by_its_deadline_lets_another_trial_through():
+    pool = make_pool()
+    node = half_open(pool)
+    node.client.error = requests.exceptions.ReadTimeout("deadline")
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        pool.generate({'model': 'llama3.2:3b'}, expected_errors=(requests.exceptions.Timeout,))
+    assert node.failures == 1
+    assert node.breaker.state == CircuitBreaker.HALF_OPEN
+
+    node.client.error = None
+    assert pool.generate({'model': 'llama3.2:3b'}).status_code == 200
+    assert node.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_lease_lets_another_trial_through():
+    pool = make_pool()
+    node = half_open(pool)
+
+    async def disconnected_client():
+        with pool.lease('llama3.2:3b'):
+            raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(disconnected_client())
+    assert node.outstanding == 0
+    assert node.failures == 1
+    with pool.lease('llama3.2:3b') as leased:
+        leased.record_status(200)
+    assert node.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_stream_failing_after_its_headers_counts_against_the_node():
+    pool = make_pool()
+    node = pool.nodes[0]
+    response = pool.generate({'model': 'llama3.2:3b'}, stream=True)
+    response.finish(requests.exceptions.ChunkedEncodingError("connection broken mid-reply"))
+    response.close()
+    assert node.outstanding == 0
+    assert node.failures == 1
+    assert node.breaker.state == CircuitBreaker.OPEN
+
+
+def test_trial_stream_passes_only_when_it_finishes():
+    pool = make_pool()
+    node = half_open(pool)
+    # Headers alone, then the reader goes away: neither a success nor a failure
+    pool.generate({'model': 'llama3.2:3b'}, stream=True).close()
+    assert node.breaker.state == CircuitBreaker.HALF_OPEN
+
+    response = pool.generate({'model': 'llama3.2:3b'}, stream=True)
+    response.finish()
+    response.close()
+    assert node.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_trial_in_flight_turns_other_requests_away():
+    pool = make_pool()
+    half_open(pool)
+    with pool.lease('llama3.2:3b'):
+        with pytest.raises(NoOllamaNode):
+            pool.acquire('llama3.2:3b')
+
+
+def test_routes_to_least_outstanding_node():
+    pool = make_pool(nodes=2)
+    first = pool.acquire('llama3.2:3b')
+    second = pool.acquire('llama3.2:3b')
+    assert first is not second
+    pool.release(first)
+    assert pool.acquire('llama3.2:3b') is first
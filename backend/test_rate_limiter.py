@@ -0,0 +1,53 @@
+"""
+Tests for the per-student and per-IP rate limits.
+
+Run: python -m pytest test_rate_limiter.py
+"""
+
+import pytest
+
+from rate_limiter import RateLimited, RateLimiter, TokenBuckets, parse_limits
+
+
+def test_limits_spec():
+    assert parse_limits('chat:10/60, *:30,bad') == {'chat': (10, 60.0), '*': (30, 60.0)}
+
+
+def test_bucket_allows_a_burst_then_refills():
+    buckets = TokenBuckets(capacity=3, seconds=3)
+    assert [buckets.take('s1', 0.0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take('s1', 0.0) == pytest.approx(1.0)
+    assert buckets.take('s1', 1.0) == 0
+    assert buckets.take('s2', 1.0) == 0
+
+
+def test_idle_buckets_are_dropped():
+    buckets = TokenBuckets(capacity=2, seconds=2)
+    buckets.take('s1', 0.0)
+    buckets.take('s2', 0.5)
+    assert len(buckets) == 2
+    buckets.take('s3', 10.0)
+    assert len(buckets) == 1
+
+
+def test_student_limit_applies_before_the_ip_limit():
+    limiter = RateLimiter({'chat': (2, 60)}, {'*': (3, 60)})
+    limiter.check('chat', 's1', '10.0.0.1')
+    limiter.check('chat', 's1', '10.0.0.1')
+    with pytest.raises(RateLimited) as student:
+        limiter.check('chat', 's1', '10.0.0.1')
+    assert student.value.scope == 'student' and student.value.retry_after >= 1
+
+    # s1's rejected request didn't use up the class's shared address
+    limiter.check('chat', 's2', '10.0.0.1')
+    with pytest.raises(RateLimited) as ip:
+        limiter.check('chat', 's3', '10.0.0.1')
+    assert ip.value.scope == 'ip'
+    assert limiter.stats()['rejected'] == {'student': 1, 'ip': 1}
+
+
+def test_endpoints_without_a_limit_are_not_limited():
+    limiter = RateLimiter({'chat': (1, 60)}, {})
+    for _ in range(5):
+        limiter.check('health', 's1', '10.0.0.1')
+        limiter.check('chat', None, '10.0.0.1')
@@ -0,0 +1,75 @@
+"""
+Tests for the near-duplicate response cache.
+
+Run: python -m pytest test_response_cache.py
+"""
+
+import time
+
+import pytest
+
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache():
+    cache = ResponseCache()
+    cache.put('holden', "Why does Holden hate phonies?", "Because they're phony, that's why.")
+    return cache
+
+
+@pytest.mark.parametrize('question', [
+    "Why does Holden hate phonies?",
+    "why does holden hate phonies",
+    "WHY DOES HOLDEN HATE PHONIES!!",
+    "why does holdn hate phonies"
+])
+def test_same_or_near_identical_question_hits(cache, question):
+    assert cache.get('holden', question) == "Because they're phony, that's why."
+
+
+@pytest.mark.parametrize('question', [
+    "why doesn't holden hate phonies",
+    "why doesnt holden hate phonies",
+    "why does holden not hate phonies",
+    "why does holden never hate phonies"
+])
+def test_negated_question_misses(cache, question):
+    assert cache.get('holden', question) is None
+
+
+def test_negation_must_match_in_both_directions():
+    cache = ResponseCache()
+    cache.put('holden', "why doesn't holden like school", "He just doesn't.")
+    assert cache.get('holden', "why doesnt holden like school") == "He just doesn't."
+    assert cache.get('holden', "why does holden like school") is None
+
+
+def test_different_numbers_miss():
+    cache = ResponseCache()
+    cache.put('custom:abc', "what happens in chapter 3", "Holden leaves Pencey.")
+    assert cache.get('custom:abc', "what happens in chapter 5") is None
+    assert cache.get('custom:abc', "What happens in chapter 3?") == "Holden leaves Pencey."
+
+
+def test_personas_are_separate(cache):
+    assert cache.get('wellbeing', "Why does Holden hate phonies?") is None
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=0.01)
+    cache.put('holden', "who is phoebe", "My kid sister.")
+    time.sleep(0.02)
+    assert cache.get('holden', "who is phoebe") is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put('holden', "who is phoebe", "My kid sister.")
+    cache.put('holden', "who is allie", "My brother.")
+    cache.get('holden', "who is phoebe")
+    cache.put('holden', "who is stradlater", "My roommate.")
+    assert cache.get('holden', "who is allie") is None
+    assert cache.get('holden', "who is phoebe") == "My kid sister."
+    assert cache.stats()['evictions'] == 1
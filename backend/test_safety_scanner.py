@@ -0,0 +1,94 @@
+"""
+Tests for the compiled safety phrase matcher.
+
+Run: python -m pytest test_safety_scanner.py
+"""
+
+import json
+import os
+
+import pytest
+
+from safety_scanner import SAFETY_LEVELS, SafetyScanner
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(HERE, 'safety_keywords.json'), encoding='utf-8') as f:
+    KEYWORDS = json.load(f)
+
+# Endings the old substring scan matched after any keyword
+INFLECTIONS = ('', 's', 'es', 'd', 'ed', 'ing', 'er', 'ers', 'ly', 'ness', 'ful', 'al', 'ity')
+
+SEVERITY = {'SAFE': 0, 'CONCERN': 1, 'CRISIS': 2}
+
+
+def substring_level(message):
+    """The level check_message_safety gave before the compiled matcher"""
+    message = message.lower()
+    for level in SAFETY_LEVELS:
+        if any(keyword in message for keyword in KEYWORDS[level]):
+            return level
+    return 'SAFE'
+
+
+@pytest.fixture(scope='module')
+def scanner():
+    return SafetyScanner(KEYWORDS)
+
+
+@pytest.mark.parametrize('level', SAFETY_LEVELS)
+def test_inflections_are_never_downgraded(scanner, level):
+    lowered = []
+    for keyword in KEYWORDS[level]:
+        for ending in INFLECTIONS:
+            for message in (keyword + ending, f"lately I've been {keyword + ending} again"):
+                old = substring_level(message)
+                new, _ = scanner.classify(message)
+                if SEVERITY[new] < SEVERITY[old]:
+                    lowered.append((message, old, new))
+    assert lowered == []
+
+
+@pytest.mark.parametrize('message, level', [
+    ("I've been self harming again", 'CRISIS'),
+    ("I have been self-harming again", 'CRISIS'),
+    ("I keep harming myself", 'CRISIS'),
+    ("I thought about killing myself", 'CRISIS'),
+    ("I keep overdosing", 'CRISIS'),
+    ("I feel suicidal", 'CRISIS'),
+    ("i feel hopelessly lost", 'CONCERN'),
+    ("I CAN'T cope with exams", 'CONCERN'),
+    ("I'm having panic attacks", 'CONCERN'),
+    ("my anxieties are back", 'CONCERN'),
+    ("my brother is a scaredy cat", 'SAFE'),
+    ("we took a shortcut home", 'SAFE'),
+    ("what should I read next?", 'SAFE')
+])
+def test_classify(scanner, message, level):
+    assert scanner.classify(message)[0] == level
+
+
+def test_most_severe_level_wins(scanner):
+    level, phrases = scanner.classify("I'm scared and I want to die")
+    assert level == 'CRISIS'
+    assert phrases == ['want to die']
+
+
+def test_reloads_changed_file(tmp_path):
+    path = tmp_path / 'keywords.json'
+    path.write_text(json.dumps({'CRISIS': [], 'CONCERN': ['homesick']}))
+    scanner = SafetyScanner({}, path=str(path), reload_interval=0)
+    assert scanner.classify("I'm so homesick")[0] == 'CONCERN'
+
+    path.write_text(json.dumps({'CRISIS': ['homesick'], 'CONCERN': []}))
+    os.utime(path, (0, 0))
+    assert scanner.classify("I'm so homesick")[0] == 'CRISIS'
+
+
+def test_keeps_phrases_when_file_is_broken(tmp_path):
+    path = tmp_path / 'keywords.json'
+    path.write_text(json.dumps({'CRISIS': ['homesick']}))
+    scanner = SafetyScanner({}, path=str(path), reload_interval=0)
+    path.write_text('{not json')
+    os.utime(path, (0, 0))
+    assert scanner.classify("I'm so homesick")[0] == 'CRISIS'
@@ -0,0 +1,161 @@
+"""
+Tests for coalescing identical in-flight generations.
+
+Run: python -m pytest test_single_flight.py
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from single_flight import AsyncFlight, SingleFlight, coalescing_key, coalescing_windows
+
+HISTORY = [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hey'}]
+
+
+class Tokens:
+    """A generation's token stream that records whether it was closed"""
+
+    def __init__(self, tokens):
+        self._tokens = iter(tokens)
+        self.pulled = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = next(self._tokens)
+        self.pulled += 1
+        return token
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncTokens:
+    def __init__(self, tokens):
+        self._tokens = iter(tokens)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        try:
+            return next(self._tokens)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_key_covers_persona_message_and_history():
+    key = coalescing_key('holden', 'who is phoebe', HISTORY)
+    assert key == coalescing_key('holden', 'who is phoebe', list(HISTORY))
+    assert key != coalescing_key('wellbeing', 'who is phoebe', HISTORY)
+    assert key != coalescing_key('holden', 'who is allie', HISTORY)
+    assert key != coalescing_key('holden', 'who is phoebe', HISTORY[:1])
+
+
+def test_key_can_be_limited_to_one_student():
+    key = coalescing_key('holden', 'who is phoebe', HISTORY, 's1')
+    assert key == coalescing_key('holden', 'who is phoebe', HISTORY, 's1')
+    assert key != coalescing_key('holden', 'who is phoebe', HISTORY, 's2')
+    assert key != coalescing_key('holden', 'who is phoebe', HISTORY)
+
+
+def test_windows_spec():
+    assert coalescing_windows('holden, custom:0.5,', 2.0) == {'holden': 2.0, 'custom': 0.5}
+
+
+def test_personas_without_a_window_are_not_coalesced():
+    flights = SingleFlight({'holden': 2.0, 'custom': 1.0})
+    assert flights.claim('wellbeing', 'k') is None
+    assert flights.claim('custom:abc', 'k').leader
+
+
+def test_followers_get_the_leaders_reply_from_one_generation():
+    flights = SingleFlight({'holden': 2.0})
+    leader = flights.claim('holden', 'k')
+    follower = flights.claim('holden', 'k')
+    assert leader.leader and not follower.leader
+    source = Tokens(['Phoebe', ' is', ' my', ' sister'])
+    leader.start(source)
+    assert list(leader) == list(follower) == ['Phoebe', ' is', ' my', ' sister']
+    assert source.pulled == 4
+    assert flights.stats() == {'personas': {'holden': 2.0}, 'in_flight': 0, 'generations': 1, 'coalesced': 1}
+
+
+def test_follower_keeps_the_stream_going_after_the_leader_leaves():
+    flights = SingleFlight({'holden': 2.0})
+    leader = flights.claim('holden', 'k')
+    follower = flights.claim('holden', 'k')
+    source = Tokens(['a', 'b', 'c'])
+    leader.start(source)
+    stream = iter(leader)
+    assert next(stream) == 'a'
+    stream.close()
+    assert not source.closed
+    assert list(follower) == ['a', 'b', 'c']
+
+
+def test_generation_is_closed_once_every_subscriber_leaves():
+    flights = SingleFlight({'holden': 2.0})
+    leader = flights.claim('holden', 'k')
+    follower = flights.claim('holden', 'k')
+    closed = []
+    source = Tokens(['a', 'b', 'c'])
+    leader.start(source, on_close=lambda: closed.append(True))
+    leader.close()
+    assert not source.closed
+    follower.close()
+    assert source.closed and closed == [True]
+    assert flights.claim('holden', 'k').leader
+
+
+def test_failure_reaches_every_subscriber():
+    flights = SingleFlight({'holden': 2.0})
+    leader = flights.claim('holden', 'k')
+    follower = flights.claim('holden', 'k')
+    leader.fail(ConnectionError("ollama is down"))
+    with pytest.raises(ConnectionError):
+        list(follower)
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_late_requests_start_a_new_generation():
+    flights = SingleFlight({'holden': 0.01})
+    first = flights.claim('holden', 'k')
+    time.sleep(0.02)
+    second = flights.claim('holden', 'k')
+    assert first.leader and second.leader
+    assert flights.stats()['generations'] == 2
+
+
+def test_async_follower_outlives_a_cancelled_leader():
+    async def run():
+        flights = SingleFlight({'holden': 2.0}, flight_class=AsyncFlight)
+        leader = flights.claim('holden', 'k')
+        follower = flights.claim('holden', 'k')
+        source = AsyncTokens(['a', 'b', 'c'])
+        leader.start(source)
+
+        async def read(subscription):
+            return [item async for item in subscription]
+
+        leaving = asyncio.ensure_future(read(leader))
+        staying = asyncio.ensure_future(read(follower))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        reply = await asyncio.wait_for(staying, 1)
+        return leaving.cancelled(), reply, source.closed, flights.stats()['in_flight']
+
+    cancelled, reply, closed, in_flight = asyncio.run(run())
+    assert cancelled
+    assert reply == ['a', 'b', 'c']
+    assert not closed
+    assert in_flight == 0